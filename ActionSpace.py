@@ -0,0 +1,180 @@
+from Move import *
+from array import array
+import numpy as np
+
+
+# Maps moves to the flat action indices of a policy head. There is one action
+# for every geometrically possible (start, end) pair, that is every queen or
+# knight move on an empty board, and four more, one per promotion piece, for
+# every pawn move onto the last rank. Captures share the action of the
+# corresponding quiet move.
+
+
+# Returns whether a piece could ever move between two squares: along a rank,
+# file or diagonal, or a knight's jump.
+def is_reachable(start, end):
+    dr = abs(end // 5 - start // 5)
+    df = abs(end % 5 - start % 5)
+    if start == end:
+        return False
+    return dr == 0 or df == 0 or dr == df or {dr, df} == {1, 2}
+
+
+# Returns whether a pawn move between two squares would promote, for either
+# color.
+def is_promotion(start, end):
+    if abs(end % 5 - start % 5) > 1:
+        return False
+    return (start // 5, end // 5) in [(3, 4), (1, 0)]
+
+
+# Returns the square mirrored across the middle rank.
+def flip_square(sq):
+    return 20 - sq + 2 * (sq % 5)
+
+
+# Builds the action list as packed moves without capture bits, in order of
+# start square, then end square, then promotion piece.
+def gen_actions():
+    actions = []
+    for start in range(25):
+        for end in range(25):
+            if is_reachable(start, end):
+                actions.append(encode_move(start, end, Flags.Quiet))
+            if is_promotion(start, end):
+                for bits in PromBits:
+                    actions.append(start | end << EndShift | bits)
+
+    return actions
+
+
+# Packed moves, without capture bits, of every action.
+ActionMoves = np.array(gen_actions(), dtype=np.uint16)
+NumActions = len(ActionMoves)
+ActionStarts = (ActionMoves & StartMask).astype(np.intp)
+ActionEnds = (ActionMoves >> EndShift & StartMask).astype(np.intp)
+ActionIsProm = (ActionMoves >> FlagsShift & 8) != 0
+
+# Action index of every packed move, capture or not, or -1 for moves outside
+# the action space. Indexed by the 14 bits a packed move uses.
+MoveActions = np.full(1 << 14, -1, dtype=np.int16)
+MoveActions[ActionMoves] = np.arange(NumActions)
+MoveActions[ActionMoves | CaptureBits] = np.arange(NumActions)
+
+# Action of the same move seen from the other side of the board, for mapping
+# between actions of canonical and actual positions.
+FlippedActions = MoveActions[
+    np.array([flip_square(move_start(m)) | flip_square(move_end(m)) << EndShift | (m & ~0x3ff)
+              for m in ActionMoves.tolist()], dtype=np.uint16)].astype(np.intp)
+
+# Squares on the last rank of either color, where pawn moves promote.
+EdgeRanks = 0x1f | 0x1f << 20
+
+
+# Returns the action index of a packed move.
+def move_to_action(move):
+    return int(MoveActions[move & 0x3fff])
+
+
+# Returns the packed move of an action in a position, with the capture bit
+# set if the end square is occupied.
+def action_to_move(board, action):
+    move = int(ActionMoves[action])
+    if board.occupied >> (move >> EndShift & StartMask) & 1:
+        move |= CaptureBits
+    return move
+
+
+# Returns the action indices of an array('H') of packed moves as an array,
+# without copying the moves. In canonical mode the actions are mirrored
+# when black is to move, matching Encoder's canonical planes.
+def moves_to_actions(moves, white=True, canonical=False):
+    actions = MoveActions[np.frombuffer(moves, dtype=np.uint16)]
+    if canonical and not white:
+        return FlippedActions[actions]
+    return actions
+
+
+# Fills mask, a boolean array of NumActions, with the legal moves of a board
+# as generated by get_all_moves, and returns it. moves may be passed as a
+# reusable array('H') buffer for the move list.
+def legal_mask(board, mask=None, moves=None, canonical=False):
+    if mask is None:
+        mask = np.zeros(NumActions, dtype=bool)
+    else:
+        mask[:] = False
+    moves = board.get_all_moves(moves)
+    mask[moves_to_actions(moves, board.white, canonical)] = True
+    return mask
+
+
+# Fills out, an (N, NumActions) boolean array, with the legal masks of a list
+# of boards, scattering all moves in a single NumPy call, and returns it.
+def legal_masks(boards, out=None, canonical=False):
+    if out is None:
+        out = np.zeros((len(boards), NumActions), dtype=bool)
+    else:
+        out[:] = False
+    moves = array('H')
+    buffer = array('H')
+    counts = []
+    flipped = []
+    for board in boards:
+        moves.extend(board.get_all_moves(buffer))
+        counts.append(len(buffer))
+        flipped.append(canonical and not board.white)
+
+    actions = MoveActions[np.frombuffer(moves, dtype=np.uint16)]
+    rows = np.repeat(np.arange(len(boards)), counts)
+    actions = np.where(np.repeat(flipped, counts), FlippedActions[actions], actions)
+    out[rows, actions] = True
+    return out
+
+
+# Fills out with the legal masks of every game in a VecEnv, computed from its
+# per-square target bitboards without any per-game Python work.
+def env_legal_masks(env, out=None, canonical=False):
+    side, us, them = env.sides()
+    targets = env.targets[:, ActionStarts]
+    legal = ((targets >> ActionEnds.astype(np.uint32)) & np.uint32(1)).astype(bool)
+    # a pawn reaching the last rank must promote, and only pawns may
+    pawns = ((us[:, Piece.Pawn, None] >> ActionStarts.astype(np.uint32)) & np.uint32(1)).astype(bool)
+    promotes = pawns & ((EdgeRanks >> ActionEnds) & 1).astype(bool)
+    legal &= promotes == ActionIsProm
+    if canonical:
+        legal = np.where(env.white[:, None], legal, legal[:, FlippedActions])
+    if out is None:
+        return legal
+    out[:] = legal
+    return out
+
+
+# Returns the action probabilities of a batch of logits with illegal actions
+# masked out. logits and mask have shape (N, NumActions) or (NumActions,).
+def masked_softmax(logits, mask):
+    logits = np.where(mask, logits, -np.inf)
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=-1, keepdims=True)
+
+
+# Samples one legal action per row of logits with the Gumbel-max trick, or
+# picks the best legal one if temperature is 0. Rows without legal actions
+# give an arbitrary action.
+def sample_actions(logits, mask, rng, temperature=1.0):
+    if temperature > 0:
+        logits = logits / temperature + rng.gumbel(size=logits.shape)
+    return np.where(mask, logits, -np.inf).argmax(axis=-1)
+
+
+# Returns the packed moves of a batch of actions in the games of a VecEnv,
+# ready for VecEnv.step. In canonical mode the actions are taken to be
+# mirrored for games with black to move.
+def env_actions_to_moves(env, actions, canonical=False):
+    if canonical:
+        actions = np.where(env.white, actions, FlippedActions[actions])
+    moves = ActionMoves[actions]
+    side, us, them = env.sides()
+    occ_them = np.bitwise_or.reduce(them, axis=1)
+    capture = (occ_them >> ActionEnds[actions].astype(np.uint32)) & np.uint32(1)
+    return moves | (capture << 2 << FlagsShift).astype(np.uint16)
@@ -0,0 +1,325 @@
+from Enums import *
+from MiniChessBoard import MiniChessBoard, StartFen, capture_order
+from Move import *
+from Tablebase import Tablebases
+from TranspositionTable import TranspositionTable
+import Instrument
+import argparse
+import sys
+import time
+
+
+# Score of being mated at the root. Mate in n plies scores Mate - n.
+Mate = 30000
+Infinity = 32000
+
+# Ordering scores of the move classes, above any history score.
+HashMoveScore = 1 << 30
+CaptureScore = 1 << 28
+KillerScore = 1 << 27
+
+# Mate scores are stored in the transposition table relative to the
+# position rather than the root.
+MateBound = Mate - 256
+
+
+# Converts a score between the root-relative form used in the search and the
+# position-relative form stored in the transposition table.
+def to_tt(score, ply):
+    if score >= MateBound:
+        return score + ply
+    if score <= -MateBound:
+        return score - ply
+    return score
+
+
+def from_tt(score, ply):
+    if score >= MateBound:
+        return score - ply
+    if score <= -MateBound:
+        return score + ply
+    return score
+
+
+# Raised inside the search when the time or node limit is reached.
+class SearchAborted(Exception):
+    pass
+
+
+# Iterative-deepening principal variation search with a transposition table,
+# quiescence search over captures and promotions, MVV-LVA ordering of
+# captures and killer and history ordering of quiet moves. Positions are
+# scored by the board's incrementally updated material and piece-square
+# score. Moves come from the board's staged generator, so nodes that cut off
+# early skip generating quiet moves; with staged off every node generates
+# and sorts its full move list instead. Given Tablebases, positions below the
+# root that they cover are scored exactly instead of searched.
+class AlphaBeta():
+    def __init__(self, hash_mb=16, staged=True, tablebases=None):
+        self.tt = TranspositionTable(hash_mb)
+        self.staged = staged
+        self.tablebases = tablebases
+        self.history = [[[0] * 25 for sq in range(25)] for c in range(2)]
+        self.killers = [[0, 0] for ply in range(128)]
+        self.nodes = 0
+
+
+    # Clears the transposition table and ordering statistics between games.
+    def clear(self):
+        self.tt.clear()
+        self.history = [[[0] * 25 for sq in range(25)] for c in range(2)]
+        self.killers = [[0, 0] for ply in range(128)]
+
+
+    # Returns the static score of a position for the side to move.
+    def evaluate(self, board):
+        return board.score if board.white else -board.score
+
+
+    def check_limits(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+
+    # Sorts moves best first: the hash move, then captures and promotions by
+    # MVV-LVA, then killers, then quiet moves by history.
+    def order_moves(self, board, moves, hash_move, ply):
+        killers = self.killers[ply]
+        history = self.history[0 if board.white else 1]
+        mailbox = board.mailbox
+        scores = {}
+        for move in moves:
+            flags = move >> FlagsShift
+            if move == hash_move:
+                score = HashMoveScore
+            elif flags & (Flags.Capture | 8):
+                score = CaptureScore + capture_order(mailbox, move)
+            elif move == killers[0] or move == killers[1]:
+                score = KillerScore + (move == killers[0])
+            else:
+                score = history[move & StartMask][move >> EndShift & StartMask]
+            scores[move] = score
+
+        return sorted(moves, key=scores.__getitem__, reverse=True)
+
+
+    # Returns the moves of a node in search order.
+    def node_moves(self, board, hash_move, ply, quiets=True):
+        if self.staged:
+            killers = self.killers[ply]
+            history = self.history[0 if board.white else 1]
+            def quiet_key(move):
+                if move == killers[0] or move == killers[1]:
+                    return KillerScore + (move == killers[0])
+                return history[move & StartMask][move >> EndShift & StartMask]
+            return board.gen_staged_moves(hash_move, quiet_key, quiets)
+
+        moves = board.get_all_moves()
+        if not quiets:
+            moves = [move for move in moves if move >> FlagsShift & (Flags.Capture | 8)]
+        return self.order_moves(board, moves, hash_move, ply)
+
+
+    # Searches only captures and promotions until the position is quiet, so
+    # that the static score is never taken in the middle of an exchange.
+    # Captures that lose material by static exchange evaluation are skipped.
+    # In check every evasion is searched instead, which also detects mate.
+    def quiescence(self, board, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+
+        in_check = board.in_check()
+        if in_check:
+            best = -Mate + ply
+        else:
+            best = self.evaluate(board)
+            if best >= beta:
+                return best
+            if best > alpha:
+                alpha = best
+
+        for move in self.node_moves(board, 0, ply, quiets=in_check):
+            # captures that lose material by static exchange are not tried
+            if not in_check and not move >> FlagsShift & 8 and board.see(move) < 0:
+                continue
+            board.make_move(move)
+            score = -self.quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > best:
+                best = score
+            if score > alpha:
+                alpha = score
+
+        return best
+
+
+    # Principal variation search to a depth. Returns the score of the
+    # position for the side to move, within the (alpha, beta) window.
+    def pvs(self, board, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self.quiescence(board, alpha, beta, ply)
+
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+
+        hash_move = 0
+        entry = self.tt.probe(board.key)
+        if entry is not None:
+            entry_depth, bound, value, hash_move = entry
+            value = from_tt(value, ply)
+            if ply > 0 and entry_depth >= depth:
+                if bound == Bound.Exact:
+                    return value
+                if bound == Bound.Lower and value >= beta:
+                    return value
+                if bound == Bound.Upper and value <= alpha:
+                    return value
+
+        if ply > 0 and board.is_insufficient_material():
+            return 0
+
+        if ply > 0 and self.tablebases is not None:
+            probe = self.tablebases.probe(board)
+            if probe is not None:
+                wdl, dtm = probe
+                return wdl * (Mate - ply - dtm)
+
+        original_alpha = alpha
+        best_score = -Infinity
+        best_move = 0
+        i = -1
+        for i, move in enumerate(self.node_moves(board, hash_move, ply)):
+            board.make_move(move)
+            if i == 0:
+                score = -self.pvs(board, depth - 1, -beta, -alpha, ply + 1)
+            else:
+                score = -self.pvs(board, depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self.pvs(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not move >> FlagsShift & (Flags.Capture | 8):
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[0 if board.white else 1][move & StartMask][move >> EndShift & StartMask] += depth * depth
+                break
+
+        if i < 0:
+            return -Mate + ply if board.in_check() else 0
+
+        if best_score <= original_alpha:
+            bound = Bound.Upper
+        elif best_score >= beta:
+            bound = Bound.Lower
+        else:
+            bound = Bound.Exact
+        self.tt.store(board.key, depth, to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+
+    # Returns the principal variation stored in the transposition table.
+    def principal_variation(self, board, depth):
+        pv = []
+        for i in range(depth):
+            entry = self.tt.probe(board.key)
+            if entry is None or not entry[3] or entry[3] not in board.get_all_moves():
+                break
+            pv.append(entry[3])
+            board.make_move(entry[3])
+        for move in pv:
+            board.unmake_move()
+
+        return pv
+
+
+    # Searches a position with iterative deepening until max_depth is done
+    # or the time (in seconds) or node limit is reached, keeping the result
+    # of the last completed iteration. Returns (best move, score, info),
+    # where info holds one dict per completed depth with its score, nodes,
+    # time, nodes per second, effective branching factor (nodes of this
+    # iteration over the previous one) and principal variation.
+    def search(self, board, max_depth=64, time_limit=None, node_limit=None, verbose=False):
+        self.nodes = 0
+        self.node_limit = node_limit
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        start = time.perf_counter()
+        best_move = 0
+        best_score = 0
+        info = []
+        previous_nodes = 0
+        root_plies = board.move_count
+
+        # the search line and principal variation may be longer than the
+        # board's history limit, and must still unmake back to the root
+        cap = board.hold_history()
+        try:
+            for depth in range(1, max_depth + 1):
+                iteration_start = self.nodes
+                try:
+                    score = self.pvs(board, depth, -Infinity, Infinity, 0)
+                except SearchAborted:
+                    while board.move_count > root_plies:
+                        board.unmake_move()
+                    break
+
+                seconds = time.perf_counter() - start
+                nodes = self.nodes - iteration_start
+                pv = self.principal_variation(board, depth)
+                best_move = pv[0] if pv else best_move
+                best_score = score
+                info.append({"depth": depth, "score": score, "nodes": self.nodes, "seconds": seconds,
+                             "nps": self.nodes / seconds if seconds > 0 else 0,
+                             "ebf": nodes / previous_nodes if previous_nodes else 0, "pv": pv})
+                previous_nodes = nodes
+                if verbose:
+                    print("depth {:>2} score {:>6} nodes {:>10,} nps {:>8,.0f} ebf {:5.2f} pv {}".format(
+                        depth, score, self.nodes, info[-1]["nps"], info[-1]["ebf"],
+                        " ".join(move_str(move) for move in pv)))
+                if abs(score) >= Mate - depth:
+                    break
+        finally:
+            board.release_history(cap)
+
+        if not best_move:
+            moves = board.get_all_moves()
+            best_move = moves[0] if moves else 0
+
+        return best_move, best_score, info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Searches a position with alpha-beta.")
+    parser.add_argument("--fen", default=StartFen)
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--time", type=float, default=None, help="time limit in seconds")
+    parser.add_argument("--nodes", type=int, default=None, help="node limit")
+    parser.add_argument("--hash", type=int, default=16, metavar="MB")
+    parser.add_argument("--tablebases", default=None, metavar="DIR", help="directory of endgame tablebases")
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+    if args.time is None and args.nodes is None and args.depth == 64:
+        args.time = 5.0
+
+    board = MiniChessBoard(args.fen)
+    engine = AlphaBeta(args.hash, tablebases=Tablebases(args.tablebases) if args.tablebases else None)
+    move, score, info = engine.search(board, args.depth, args.time, args.nodes, verbose=True)
+    print("bestmove {} score {}".format(move_str(move) if move else "(none)", score))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
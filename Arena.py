@@ -0,0 +1,287 @@
+from AlphaBeta import AlphaBeta
+from MiniChessBoard import MiniChessBoard, StartFen
+from Move import *
+from multiprocessing import Pool
+import Instrument
+import MCTS
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+
+# Engines play one side of a game. They are called with the board and
+# return the packed move to play, leaving the board as they found it.
+# new_game(seed) is called before every game, so engines can clear their
+# tables and reseed their randomness.
+
+# Plays uniformly random legal moves.
+class RandomEngine():
+    def __init__(self):
+        self.rng = random.Random()
+
+
+    def new_game(self, seed):
+        self.rng.seed(seed)
+
+
+    def __call__(self, board):
+        moves = board.get_all_moves()
+        return moves[self.rng.randrange(len(moves))]
+
+
+# Plays the best move of an alpha-beta search to a depth, node or time
+# limit. Without any limit it searches to depth 3.
+class AlphaBetaEngine():
+    def __init__(self, depth=None, nodes=None, time=None, hash_mb=4):
+        self.nodes = None if nodes is None else int(nodes)
+        self.time = None if time is None else float(time)
+        if depth is not None:
+            self.depth = int(depth)
+        else:
+            self.depth = 3 if self.nodes is None and self.time is None else 64
+        self.search = AlphaBeta(int(hash_mb))
+
+
+    def new_game(self, seed):
+        self.search.clear()
+
+
+    def __call__(self, board):
+        return self.search.search(board, self.depth, self.time, self.nodes)[0]
+
+
+# Plays the most visited move of a Monte Carlo tree search with a uniform
+# evaluator.
+class MCTSEngine():
+    def __init__(self, simulations=64, batch_size=8):
+        self.simulations = int(simulations)
+        self.search = MCTS.MCTS(MCTS.UniformEvaluator(), 1 << 16, int(batch_size))
+
+
+    def new_game(self, seed):
+        self.search.clear()
+
+
+    def __call__(self, board):
+        self.search.search(board, self.simulations)
+        return self.search.select_move()
+
+
+Engines = {"random": RandomEngine, "alphabeta": AlphaBetaEngine, "mcts": MCTSEngine}
+
+
+# Builds an engine from a spec: a name from Engines with optional keyword
+# arguments, such as "alphabeta:depth=4" or "mcts:simulations=200,batch_size=16",
+# or a picklable callable returning an engine.
+def make_engine(spec):
+    if callable(spec):
+        return spec()
+    name, _, options = spec.partition(":")
+    if name not in Engines:
+        raise ValueError("unknown engine: " + name)
+    kwargs = dict(option.split("=", 1) for option in options.split(",") if option)
+    return Engines[name](**kwargs)
+
+
+# Returns count distinct non-terminal positions reached by plies random
+# moves from the start position, as FENs.
+def random_openings(count, plies=4, seed=0):
+    rng = random.Random(seed)
+    openings = []
+    seen = set()
+    for attempt in range(100 * count):
+        if len(openings) == count:
+            break
+        board = MiniChessBoard()
+        for ply in range(plies):
+            moves = board.get_all_moves()
+            if not moves:
+                break
+            board.make_move(moves[rng.randrange(len(moves))])
+        fen = board.get_fen()
+        if board.outcome() is None and fen not in seen:
+            seen.add(fen)
+            openings.append(fen)
+
+    return openings
+
+
+# Plays one game from a FEN and returns the result from white's point of
+# view. Games still going after max_plies are drawn. White's engine is
+# seeded with seed and black's with seed + 1.
+def play_game(white, black, fen=StartFen, max_plies=256, seed=0):
+    board = MiniChessBoard(fen)
+    for i, engine in enumerate((white, black)):
+        if hasattr(engine, "new_game"):
+            engine.new_game(seed + i)
+    for ply in range(max_plies):
+        outcome = board.outcome()
+        if outcome is not None:
+            return outcome[0]
+        board.make_move((white if board.white else black)(board))
+    return 0
+
+
+# Engines of the current worker process, built once by _init_worker.
+_engines = None
+
+
+def _init_worker(spec_a, spec_b):
+    global _engines
+    _engines = make_engine(spec_a), make_engine(spec_b)
+
+
+# Plays both games of an opening, A with white first and then with black.
+# Returns the opening's index and A's two scores (1, 0.5 or 0).
+def _play_pair(args):
+    index, fen, max_plies, seed = args
+    a, b = _engines
+    first = play_game(a, b, fen, max_plies, 4 * seed)
+    second = play_game(b, a, fen, max_plies, 4 * seed + 2)
+    return index, (1 + first) / 2, (1 - second) / 2
+
+
+# Returns the Elo difference that an expected score stands for.
+def elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+# Returns the expected score of an Elo difference.
+def expected_score(rating):
+    return 1 / (1 + 10 ** (-rating / 400))
+
+
+# Summarizes the pair scores of a match (each the mean of A's two games) as
+# (elo, lower, upper) with a confidence interval at level z standard errors.
+# Pairs rather than games are the samples, so the correlation between the
+# two games of an opening is accounted for. As in sprt_llr, the variance
+# includes a lost and a won pseudo-pair, so that a match of identical pair
+# scores does not get an interval of zero width.
+def elo_interval(pairs, z=1.96):
+    n = len(pairs)
+    if not n:
+        return 0.0, -math.inf, math.inf
+    mean = sum(pairs) / n
+    padded = list(pairs) + [0.0, 1.0]
+    padded_mean = sum(padded) / len(padded)
+    var = sum((p - padded_mean) ** 2 for p in padded) / len(padded)
+    margin = z * math.sqrt(var / n)
+    return elo(mean), elo(mean - margin), elo(mean + margin)
+
+
+# Returns the log-likelihood ratio of elo1 over elo0 for the pair scores
+# of a match, by the normal approximation of the generalized SPRT. One lost
+# and one won pseudo-pair are added so that the variance of a one-sided
+# match is never zero.
+def sprt_llr(pairs, elo0, elo1):
+    pairs = list(pairs) + [0.0, 1.0]
+    n = len(pairs)
+    mean = sum(pairs) / n
+    var = sum((p - mean) ** 2 for p in pairs) / n
+    s0 = expected_score(elo0)
+    s1 = expected_score(elo1)
+    return n * (s1 - s0) * (2 * mean - s0 - s1) / (2 * var)
+
+
+# Returns the (lower, upper) LLR bounds of an SPRT with false positive rate
+# alpha and false negative rate beta.
+def sprt_bounds(alpha=0.05, beta=0.05):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+# Plays engine A against engine B in pairs of games from each opening, one
+# with each color, spread over a process pool. Engines are given as specs
+# for make_engine, so every worker builds its own. With sprt set to
+# (elo0, elo1) the match stops as soon as the test accepts either
+# hypothesis, at false positive and negative rates alpha and beta; games
+# beyond that point are cancelled. Returns a dict with the game counts from
+# A's point of view, the Elo estimate and interval, and the SPRT state.
+def run_match(engine_a, engine_b, openings, pairs=None, processes=1, max_plies=256, seed=0,
+              sprt=None, alpha=0.05, beta=0.05, callback=None):
+    pairs = len(openings) if pairs is None else pairs
+    tasks = [(i, openings[i % len(openings)], max_plies, (seed << 20) + i) for i in range(pairs)]
+    lower, upper = sprt_bounds(alpha, beta)
+    scores = []
+    games = [0, 0, 0]
+    llr = 0.0
+    decision = None
+    start = time.perf_counter()
+
+    if processes > 1:
+        pool = Pool(processes, _init_worker, (engine_a, engine_b))
+        results = pool.imap_unordered(_play_pair, tasks)
+    else:
+        pool = None
+        _init_worker(engine_a, engine_b)
+        results = map(_play_pair, tasks)
+    try:
+        for index, first, second in results:
+            for score in (first, second):
+                games[int(2 * score)] += 1
+            scores.append((first + second) / 2)
+            if sprt is not None:
+                llr = sprt_llr(scores, *sprt)
+                if llr <= lower or llr >= upper:
+                    decision = "H1" if llr >= upper else "H0"
+            if callback is not None:
+                callback(len(scores), games, llr)
+            if decision is not None:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    rating, low, high = elo_interval(scores)
+    return {"pairs": len(scores), "losses": games[0], "draws": games[1], "wins": games[2],
+            "score": sum(scores) / len(scores) if scores else 0.5, "elo": rating,
+            "elo_low": low, "elo_high": high, "llr": llr, "llr_bounds": (lower, upper),
+            "decision": decision, "seconds": time.perf_counter() - start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays two engines against each other.")
+    parser.add_argument("engine_a", help="engine spec such as alphabeta:depth=3 or mcts:simulations=64")
+    parser.add_argument("engine_b", help="engine spec such as random")
+    parser.add_argument("--pairs", type=int, default=100, help="maximum number of game pairs")
+    parser.add_argument("--openings", type=int, default=100, help="number of random openings")
+    parser.add_argument("--opening-plies", type=int, default=4)
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--max-plies", type=int, default=256)
+    parser.add_argument("--sprt", type=float, nargs=2, default=None, metavar=("ELO0", "ELO1"),
+                        help="stop once an SPRT of elo0 against elo1 decides")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+
+    openings = random_openings(args.openings, args.opening_plies, args.seed)
+
+    def progress(pairs, games, llr):
+        if pairs % 10 == 0:
+            print("{:>5} pairs: +{} ={} -{} llr {:.2f}".format(pairs, games[2], games[1], games[0], llr))
+
+    result = run_match(args.engine_a, args.engine_b, openings, args.pairs, args.processes,
+                       args.max_plies, args.seed, args.sprt, args.alpha, args.beta, progress)
+    print("{} vs {}: +{} ={} -{} in {:.1f}s, score {:.3f}".format(
+        args.engine_a, args.engine_b, result["wins"], result["draws"], result["losses"],
+        result["seconds"], result["score"]))
+    print("elo {:+.1f} (95% interval {:+.1f} to {:+.1f})".format(
+        result["elo"], result["elo_low"], result["elo_high"]))
+    if args.sprt is not None:
+        print("sprt elo0 {:g} elo1 {:g}: llr {:.2f} bounds [{:.2f}, {:.2f}] {}".format(
+            args.sprt[0], args.sprt[1], result["llr"], *result["llr_bounds"],
+            {"H0": "accepted elo0", "H1": "accepted elo1", None: "undecided"}[result["decision"]]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,24 @@
-import pickle
 from Enums import *
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+
+# Layout of the magic table file, all little-endian:
+#   header: 8-byte tag, format version, number of attack table entries
+#   50 square records, 25 for the bishop and then 25 for the rook:
+#       mask (u32), magic (u64), bits (u32), offset of the square's table (u32)
+#   attack table: one u32 attack bitboard per entry. The table of a square
+#       holds 1 << bits entries starting at its offset.
+# Bump MagicsVersion whenever the layout or the tables change, so that stale
+# files are rebuilt.
+MagicsTag = b"MCMAGIC\0"
+MagicsVersion = 2
+MagicsHeader = struct.Struct("<8sII")
+MagicsRecord = struct.Struct("<IQII")
+MagicsPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "magics.bin")
 
 # Stores utility functions that handle operations on a Bitboard
 class Bitboard():
@@ -24,11 +43,22 @@ class Bitboard():
                     0x1ca7000, 0x1846000, 0x218000, 0x538000,
                     0xa70000, 0x14e0000, 0x8c0000]
 
-    # Load magic number information
-    with open("bishop_magics.pkl", "rb") as f:
-        bishop_magics = pickle.load(f)
-    with open("rook_magics.pkl", "rb") as f:
-        rook_magics = pickle.load(f)
+    # Magic bitboard tables, filled in by load_magics. For each square they
+    # hold the relevant occupancy mask, the magic number, the shift
+    # (64 - bits) and the offset of the square's entries in attack_table.
+    bishop_masks = bishop_numbers = bishop_shifts = bishop_offsets = None
+    rook_masks = rook_numbers = rook_shifts = rook_offsets = None
+    attack_table = None
+
+    # Kindergarten tables, filled in by gen_kindergarten_tables. Each line
+    # through a square (rank, file, diagonal, anti-diagonal) has a list of 32
+    # attack bitboards per square, indexed by the 5-bit occupancy of that
+    # line: table[sq][occupancy].
+    rank_attacks = file_attacks = diag_attacks = anti_attacks = None
+    rank_shifts = file_shifts = diag_masks = anti_masks = None
+
+    # Name of the sliding attack backend in use, see select_attacks.
+    attack_backend = None
 
     full64 = 0xFFFFFFFFFFFFFFFF
 
@@ -50,25 +80,50 @@ class Bitboard():
 
 
     # Gets the bitboard of bishop attacks from a given square, given the
-    # bitboard of occupied pieces.
-    def get_bishop_attacks(sq, occupied):
-        mask = Bitboard.bishop_magics[sq]["mask"]
-        magic = Bitboard.bishop_magics[sq]["magic"]
-        bits = Bitboard.bishop_magics[sq]["bits"]
-        index = (((occupied & mask) * magic) & Bitboard.full64) >> (64 - bits)
+    # bitboard of occupied pieces, using the magic tables.
+    def get_magic_bishop_attacks(sq, occupied):
+        index = (((occupied & Bitboard.bishop_masks[sq]) * Bitboard.bishop_numbers[sq])
+                 & Bitboard.full64) >> Bitboard.bishop_shifts[sq]
 
-        return Bitboard.bishop_magics[sq]["table"][index]
+        return Bitboard.attack_table[Bitboard.bishop_offsets[sq] + index]
 
 
     # Gets the bitboard of rook attacks from a given square, given the
-    # bitboard of occupied pieces.
-    def get_rook_attacks(sq, occupied):
-        mask = Bitboard.rook_magics[sq]["mask"]
-        magic = Bitboard.rook_magics[sq]["magic"]
-        bits = Bitboard.rook_magics[sq]["bits"]
-        index = (((occupied & mask) * magic) & Bitboard.full64) >> (64 - bits)
+    # bitboard of occupied pieces, using the magic tables.
+    def get_magic_rook_attacks(sq, occupied):
+        index = (((occupied & Bitboard.rook_masks[sq]) * Bitboard.rook_numbers[sq])
+                 & Bitboard.full64) >> Bitboard.rook_shifts[sq]
+
+        return Bitboard.attack_table[Bitboard.rook_offsets[sq] + index]
+
+
+    # Gets the bitboard of bishop attacks from a given square, given the
+    # bitboard of occupied pieces, using the kindergarten tables. Multiplying
+    # a diagonal by 0x108421 (the a-file) stacks its squares into rank 5, so
+    # bits 20-24 hold its occupancy by file.
+    def get_kindergarten_bishop_attacks(sq, occupied):
+        return (Bitboard.diag_attacks[sq][(occupied & Bitboard.diag_masks[sq]) * 0x108421 >> 20 & 31]
+                | Bitboard.anti_attacks[sq][(occupied & Bitboard.anti_masks[sq]) * 0x108421 >> 20 & 31])
+
+
+    # Gets the bitboard of rook attacks from a given square, given the
+    # bitboard of occupied pieces, using the kindergarten tables. The rank
+    # occupancy is a shift away. The file is shifted onto the a-file, and
+    # multiplying by 0x111110 moves its square on rank r to bit 20 + r.
+    def get_kindergarten_rook_attacks(sq, occupied):
+        return (Bitboard.rank_attacks[sq][occupied >> Bitboard.rank_shifts[sq] & 31]
+                | Bitboard.file_attacks[sq][(occupied >> Bitboard.file_shifts[sq] & 0x108421)
+                                            * 0x111110 >> 20 & 31])
 
-        return Bitboard.rook_magics[sq]["table"][index]
+
+    # Gets the bitboard of bishop attacks from a given square, given the
+    # bitboard of occupied pieces. Set by select_attacks.
+    get_bishop_attacks = None
+
+
+    # Gets the bitboard of rook attacks from a given square, given the
+    # bitboard of occupied pieces. Set by select_attacks.
+    get_rook_attacks = None
 
 
     # Gets the bitboard of queen attacks from a given square, given the
@@ -145,6 +200,181 @@ class Bitboard():
     def is_valid_square(sq):
         return sq >= 0 and sq < 25
 
-    
-
 
+# Serializes magic tables into the magic table file format. bishop and rook
+# are lists of 25 (mask, magic, bits, table) tuples, where table maps each
+# magic index to its attack bitboard.
+def pack_magics(bishop, rook):
+    records = []
+    entries = array('I')
+    for mask, magic, bits, table in bishop + rook:
+        records.append(MagicsRecord.pack(mask, magic, bits, len(entries)))
+        square_table = [0] * (1 << bits)
+        for index, attacks in table.items():
+            square_table[index] = attacks
+        entries.extend(square_table)
+
+    if sys.byteorder == "big":
+        entries.byteswap()
+    header = MagicsHeader.pack(MagicsTag, MagicsVersion, len(entries))
+    return header + b"".join(records) + entries.tobytes()
+
+
+# Memory-maps a magic table file. Returns None if the file is missing, was
+# written by another format version or is truncated.
+def map_magics(path):
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    size = MagicsHeader.size + 50 * MagicsRecord.size
+    if len(data) >= size:
+        tag, version, entries = MagicsHeader.unpack_from(data)
+        if tag == MagicsTag and version == MagicsVersion and len(data) == size + 4 * entries:
+            return data
+
+    data.close()
+    return None
+
+
+# Writes a magic table file atomically, so that concurrent readers never see
+# a partially written file.
+def write_magics(path, data):
+    tmp = path + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# Returns whether the running script is Magic.py, which builds and loads the
+# tables itself.
+def building_magics():
+    script = getattr(sys.modules.get("__main__"), "__file__", None) or ""
+    return os.path.basename(script) == "Magic.py"
+
+
+# Loads the magic tables into Bitboard, from data if given and from the file
+# at path otherwise. The file is memory-mapped, so forked workers share its
+# pages. If it is missing or out of date the tables are rebuilt with
+# Magic.build_magics and cached for the next import, unless Magic.py is
+# running and about to build them anyway.
+def load_magics(path=MagicsPath, data=None):
+    if data is None:
+        data = map_magics(path)
+    if data is None:
+        if building_magics():
+            return
+        import Magic
+        data = pack_magics(*Magic.build_magics())
+        try:
+            write_magics(path, data)
+        except OSError:
+            pass
+
+    records = [MagicsRecord.unpack_from(data, MagicsHeader.size + i * MagicsRecord.size)
+               for i in range(50)]
+    masks, numbers, bits, offsets = [list(field) for field in zip(*records)]
+    shifts = [64 - b for b in bits]
+    Bitboard.bishop_masks, Bitboard.rook_masks = masks[:25], masks[25:]
+    Bitboard.bishop_numbers, Bitboard.rook_numbers = numbers[:25], numbers[25:]
+    Bitboard.bishop_shifts, Bitboard.rook_shifts = shifts[:25], shifts[25:]
+    Bitboard.bishop_offsets, Bitboard.rook_offsets = offsets[:25], offsets[25:]
+
+    table = memoryview(data)[MagicsHeader.size + 50 * MagicsRecord.size:]
+    if sys.byteorder == "big":
+        table = array('I', table)
+        table.byteswap()
+    else:
+        table = table.cast('I')
+    Bitboard.attack_table = table
+
+
+# Generates the between and line tables. between[a][b] holds the squares
+# strictly between two aligned squares, and line[a][b] the whole rank, file or
+# diagonal through both. Both are 0 for squares that are not aligned.
+def gen_line_tables():
+    between = [[0] * 25 for i in range(25)]
+    line = [[0] * 25 for i in range(25)]
+    for sq in range(25):
+        rank, file = divmod(sq, 5)
+        for dr, df in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+            rays = [[], []]
+            for ray, sign in zip(rays, (1, -1)):
+                r, f = rank + sign * dr, file + sign * df
+                while 0 <= r < 5 and 0 <= f < 5:
+                    ray.append(5 * r + f)
+                    r, f = r + sign * dr, f + sign * df
+
+            full = Bitboard.gen_bitboard([sq] + rays[0] + rays[1])
+            for ray in rays:
+                for i, end in enumerate(ray):
+                    between[sq][end] = Bitboard.gen_bitboard(ray[:i])
+                    line[sq][end] = full
+
+    return between, line
+
+
+# Generates the kindergarten tables. For every square and each line through
+# it, the table holds the attacks along that line for each 5-bit occupancy
+# of the line, where bit i of the occupancy is the line's square on file i
+# (or rank i for files).
+def gen_kindergarten_tables():
+    tables = []
+    for dr, df in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        table = [[0] * 32 for sq in range(25)]
+        for sq in range(25):
+            rank, file = divmod(sq, 5)
+            for occupancy in range(32):
+                attacks = 0
+                for sign in (1, -1):
+                    r, f = rank + sign * dr, file + sign * df
+                    while 0 <= r < 5 and 0 <= f < 5:
+                        attacks = Bitboard.set_square(attacks, 5 * r + f)
+                        if Bitboard.is_set(occupancy, r if df == 0 else f):
+                            break
+                        r, f = r + sign * dr, f + sign * df
+                table[sq][occupancy] = attacks
+        tables.append(table)
+
+    Bitboard.rank_attacks, Bitboard.file_attacks, Bitboard.diag_attacks, Bitboard.anti_attacks = tables
+    Bitboard.rank_shifts = [5 * (sq // 5) for sq in range(25)]
+    Bitboard.file_shifts = [sq % 5 for sq in range(25)]
+    # the lines through a square, as given by the between/line tables
+    Bitboard.diag_masks = [Bitboard.line[sq][sq + 6] if sq % 5 < 4 and sq < 20 else
+                           Bitboard.line[sq][sq - 6] if sq % 5 > 0 and sq >= 5 else 1 << sq
+                           for sq in range(25)]
+    Bitboard.anti_masks = [Bitboard.line[sq][sq + 4] if sq % 5 > 0 and sq < 20 else
+                           Bitboard.line[sq][sq - 4] if sq % 5 < 4 and sq >= 5 else 1 << sq
+                           for sq in range(25)]
+
+
+# Sliding attack backends, as (bishop lookup, rook lookup) pairs.
+AttackBackends = {
+    "magic": (Bitboard.get_magic_bishop_attacks, Bitboard.get_magic_rook_attacks),
+    "kindergarten": (Bitboard.get_kindergarten_bishop_attacks, Bitboard.get_kindergarten_rook_attacks),
+}
+
+# Backend used unless MINICHESS_ATTACKS names another one. Pick the fastest
+# in `python bench.py attacks`.
+DefaultAttackBackend = "kindergarten"
+
+
+# Makes Bitboard.get_bishop_attacks and Bitboard.get_rook_attacks use the
+# named backend.
+def select_attacks(name):
+    if name not in AttackBackends:
+        raise ValueError("Unknown attack backend: " + name)
+    Bitboard.get_bishop_attacks, Bitboard.get_rook_attacks = AttackBackends[name]
+    Bitboard.attack_backend = name
+
+
+Bitboard.between, Bitboard.line = gen_line_tables()
+load_magics()
+gen_kindergarten_tables()
+select_attacks(os.environ.get("MINICHESS_ATTACKS") or DefaultAttackBackend)
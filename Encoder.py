@@ -0,0 +1,95 @@
+import numpy as np
+
+
+# Encodes positions as AlphaZero input planes of shape (C, 5, 5), where row r
+# is rank r + 1 and column f is file f. For each of the current position and
+# `history` previous ones there are 12 piece planes, white pawn to king then
+# black pawn to king, followed by one side-to-move plane that is 1 when white
+# is to move. In canonical mode positions with black to move are mirrored
+# rank-wise with the colors swapped, so the side to move always comes first
+# and plays up the board.
+
+
+# Returns the number of planes for a given number of history positions.
+def num_planes(history=0):
+    return 12 * (history + 1) + 1
+
+
+# Returns a zeroed (n, num_planes(history), 5, 5) buffer for encode.
+def new_buffer(n, history=0, dtype=np.float32):
+    return np.zeros((n, num_planes(history), 5, 5), dtype=dtype)
+
+
+# Collects the bitboards of a list of MiniChessBoards into an
+# (N, history + 1, 12) uint32 array, with the current position first and
+# zeros for positions before the start of the game. Previous positions are
+# reached by unmaking the recorded moves, which are then made again. In
+# canonical mode the colors are swapped for boards with black to move.
+def gather(boards, history=0, canonical=False):
+    values = []
+    for board in boards:
+        swap = canonical and not board.white
+        values += board.board[6:] + board.board[:6] if swap else board.board
+        if history:
+            undone = board.moves[len(board.moves) - min(history, len(board.moves) - 1):]
+            for i in range(len(undone)):
+                board.unmake_move()
+                values += board.board[6:] + board.board[:6] if swap else board.board
+            for move in undone:
+                board.make_move(move)
+            values += [0] * (12 * (history - len(undone)))
+
+    return np.array(values, dtype=np.uint32).reshape(len(boards), history + 1, 12)
+
+
+# Writes the planes of positions given as bitboards into out, an
+# (N, num_planes(history), 5, 5) array of any numeric dtype. bitboards is an
+# (N, history + 1, 12) or (N, 2, 6) array of uint32, as produced by gather or
+# held by VecEnv, and white an (N,) boolean array. If canonical is set the
+# bitboards must already have their colors swapped for black to move, and
+# those positions are mirrored here. Returns out.
+def encode_bitboards(bitboards, white, out, canonical=False):
+    n = len(white)
+    bitboards = np.ascontiguousarray(bitboards, dtype="<u4").reshape(n, -1)
+    planes = bitboards.shape[1]
+    bits = np.unpackbits(bitboards.view(np.uint8).reshape(n, planes, 4), axis=2, bitorder="little")
+    bits = bits[:, :, :25].reshape(n, planes, 5, 5)
+
+    out[:, :planes] = bits
+    if canonical:
+        black = ~np.asarray(white, dtype=bool)
+        out[black, :planes] = bits[black, :, ::-1, :]
+        out[:, planes] = 1
+    else:
+        out[:, planes] = np.asarray(white, dtype=out.dtype)[:, None, None]
+
+    return out
+
+
+# Encodes a list of MiniChessBoards into out, allocating a float32 buffer if
+# out is None. Returns out.
+def encode(boards, out=None, history=0, canonical=False):
+    if out is None:
+        out = new_buffer(len(boards), history)
+    white = np.array([board.white for board in boards], dtype=bool)
+    return encode_bitboards(gather(boards, history, canonical), white, out, canonical)
+
+
+# Encodes the current positions of a VecEnv into out without any per-game
+# Python work. Returns out.
+def encode_env(env, out=None, canonical=False):
+    if out is None:
+        out = new_buffer(env.n)
+    bitboards = env.boards
+    if canonical:
+        bitboards = np.where(env.white[:, None, None], bitboards, bitboards[:, ::-1])
+    return encode_bitboards(bitboards, env.white, out, canonical)
+
+
+# Returns a view of the piece planes of encoded positions as seen by the
+# other side: colors swapped and ranks mirrored. No data is copied, and the
+# side-to-move plane is left out since it would be inverted.
+def flipped_view(planes, history=0):
+    n = planes.shape[0]
+    pieces = planes[:, :12 * (history + 1)].reshape(n, history + 1, 2, 6, 5, 5)
+    return pieces[:, :, ::-1, :, ::-1, :]
@@ -32,3 +32,11 @@ class Flags(IntEnum):
     RookPromCap = 14,
     QueenPromCap = 15
 
+
+# Represents how a stored search value relates to the true value of a position.
+Bound = IntEnum('Bound',
+    ["Exact", "Lower", "Upper"], start=0)
+
+# Represents the ways a game can end.
+Termination = IntEnum('Termination',
+    ["Checkmate", "Stalemate", "InsufficientMaterial", "Repetition", "MoveRule"], start=0)
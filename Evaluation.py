@@ -0,0 +1,77 @@
+from Bitboard import Bitboard
+
+
+# Material values in centipawns, indexed by piece type. The king is never
+# captured, so it has no material value.
+PieceValues = [100, 300, 310, 500, 900, 0]
+
+# Positional bonuses for white pieces by square, from a1 to e5. Black uses
+# the same tables with the ranks mirrored.
+PawnTable = [
+      0,   0,   0,   0,   0,
+      0,   5,  10,   5,   0,
+     10,  20,  25,  20,  10,
+     40,  45,  50,  45,  40,
+      0,   0,   0,   0,   0,
+]
+KnightTable = [
+    -30, -15, -10, -15, -30,
+    -15,   5,  10,   5, -15,
+    -10,  10,  20,  10, -10,
+    -15,   5,  10,   5, -15,
+    -30, -15, -10, -15, -30,
+]
+BishopTable = [
+    -10,  -5,  -5,  -5, -10,
+     -5,  10,   5,  10,  -5,
+     -5,   5,  15,   5,  -5,
+     -5,  10,   5,  10,  -5,
+    -10,  -5,  -5,  -5, -10,
+]
+RookTable = [
+      0,   0,   5,   0,   0,
+     -5,   0,   0,   0,  -5,
+     -5,   0,   0,   0,  -5,
+      5,  10,  10,  10,   5,
+      0,   0,   5,   0,   0,
+]
+QueenTable = [
+     -5,   0,   0,   0,  -5,
+      0,   5,   5,   5,   0,
+      0,   5,  10,   5,   0,
+      0,   5,   5,   5,   0,
+     -5,   0,   0,   0,  -5,
+]
+KingTable = [
+     10,  15,   5,  15,  10,
+      0,   0, -10,   0,   0,
+    -15, -20, -25, -20, -15,
+    -25, -30, -35, -30, -25,
+    -30, -35, -40, -35, -30,
+]
+
+
+# Stores the material plus piece-square scores used by the board to keep an
+# incremental evaluation, from white's point of view.
+class Evaluation():
+    # piece_square[color][piece][square], negated for black
+    piece_square = [
+        [[PieceValues[p] + table[sq] for sq in range(25)]
+         for p, table in enumerate([PawnTable, KnightTable, BishopTable, RookTable, QueenTable, KingTable])],
+        [[-(PieceValues[p] + table[20 - sq + 2 * (sq % 5)]) for sq in range(25)]
+         for p, table in enumerate([PawnTable, KnightTable, BishopTable, RookTable, QueenTable, KingTable])],
+    ]
+
+
+    # Computes the score of a position from scratch. Used to initialize a
+    # board and to check the incrementally updated score.
+    def compute(board):
+        score = 0
+        for c in range(2):
+            for p in range(6):
+                pieces = board.board[6 * c + p]
+                while pieces:
+                    score += Evaluation.piece_square[c][p][Bitboard.lsb(pieces)]
+                    pieces = Bitboard.pop_lsb(pieces)
+
+        return score
@@ -0,0 +1,194 @@
+from MiniChessBoard import MiniChessBoard
+from array import array
+import os
+import struct
+import sys
+import zlib
+
+
+# Games are stored in a directory of chunk files, each holding up to
+# games_per_chunk games. A chunk file starts with a header and is followed
+# by blocks of games, each optionally zlib-compressed, then an index with the
+# offset, size and game count of every block, and a footer locating the
+# index. Inside a block each game is a record header (number of plies and
+# result from white's point of view) followed by its packed 16-bit moves.
+# Bump GamesVersion whenever the layout changes.
+GamesTag = b"MCGAMES\0"
+GamesVersion = 1
+GamesHeader = struct.Struct("<8sII")
+GameRecord = struct.Struct("<Hb")
+BlockEntry = struct.Struct("<QII")
+GamesFooter = struct.Struct("<QI8s")
+ChunkName = "games-{:05d}.mcg"
+
+# Header flags.
+Compressed = 1
+
+
+# Writes games into a directory of chunk files. Use as a context manager,
+# or call close, so the last block and index are written.
+class GameWriter():
+    def __init__(self, directory, games_per_chunk=100000, block_size=1024, compress=True, level=6):
+        self.directory = directory
+        self.games_per_chunk = games_per_chunk
+        self.block_size = block_size
+        self.compress = compress
+        self.level = level
+        os.makedirs(directory, exist_ok=True)
+        self.chunk = len([name for name in os.listdir(directory) if name.endswith(".mcg")])
+        self.file = None
+        self.block = bytearray()
+        self.block_games = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def open_chunk(self):
+        path = os.path.join(self.directory, ChunkName.format(self.chunk))
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(GamesHeader.pack(GamesTag, GamesVersion, Compressed if self.compress else 0))
+        self.index = []
+        self.chunk_games = 0
+
+
+    # Appends a game, given as a sequence of packed moves and its result.
+    def write(self, moves, result):
+        if self.file is None:
+            self.open_chunk()
+        if not isinstance(moves, array):
+            moves = array('H', moves)
+        if sys.byteorder == "big":
+            moves = array('H', moves)
+            moves.byteswap()
+        self.block += GameRecord.pack(len(moves), result)
+        self.block += moves.tobytes()
+        self.block_games += 1
+        self.chunk_games += 1
+        if self.block_games == self.block_size:
+            self.flush_block()
+        if self.chunk_games == self.games_per_chunk:
+            self.close_chunk()
+
+
+    def flush_block(self):
+        if not self.block_games:
+            return
+        data = zlib.compress(bytes(self.block), self.level) if self.compress else bytes(self.block)
+        self.index.append(BlockEntry.pack(self.file.tell(), len(data), self.block_games))
+        self.file.write(data)
+        self.block = bytearray()
+        self.block_games = 0
+
+
+    # Finishes the current chunk file, which only then appears under its
+    # final name.
+    def close_chunk(self):
+        self.flush_block()
+        offset = self.file.tell()
+        self.file.write(b"".join(self.index))
+        self.file.write(GamesFooter.pack(offset, len(self.index), GamesTag))
+        self.file.close()
+        os.replace(self.file.name, self.file.name[:-len(".tmp")])
+        self.file = None
+        self.chunk += 1
+
+
+    def close(self):
+        if self.file is not None:
+            self.close_chunk()
+
+
+# Reads one chunk file's header and index. Returns (flags, blocks), where
+# blocks is a list of (offset, size, games) tuples. Raises ValueError if the
+# file is not a game chunk of this format version.
+def read_index(f):
+    tag, version, flags = GamesHeader.unpack(f.read(GamesHeader.size))
+    if tag != GamesTag or version != GamesVersion:
+        raise ValueError("not a version {} game file: {}".format(GamesVersion, f.name))
+    f.seek(-GamesFooter.size, os.SEEK_END)
+    offset, count, tag = GamesFooter.unpack(f.read(GamesFooter.size))
+    if tag != GamesTag:
+        raise ValueError("truncated game file: " + f.name)
+    f.seek(offset)
+    data = f.read(count * BlockEntry.size)
+    return flags, [BlockEntry.unpack_from(data, i * BlockEntry.size) for i in range(count)]
+
+
+# Splits a decompressed block into (moves, result) pairs.
+def parse_block(data, games):
+    pos = 0
+    for i in range(games):
+        plies, result = GameRecord.unpack_from(data, pos)
+        pos += GameRecord.size
+        moves = array('H')
+        moves.frombytes(data[pos:pos + 2 * plies])
+        if sys.byteorder == "big":
+            moves.byteswap()
+        pos += 2 * plies
+        yield moves, result
+
+
+# Streams games from a directory of chunk files, holding one block in memory
+# at a time.
+class GameReader():
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.endswith(".mcg"))
+
+
+    # Returns the number of games, from the chunk indexes alone.
+    def __len__(self):
+        total = 0
+        for path in self.paths:
+            with open(path, "rb") as f:
+                total += sum(games for offset, size, games in read_index(f)[1])
+        return total
+
+
+    # Yields every game as (moves, result), with the moves as an array('H').
+    def __iter__(self):
+        for path in self.paths:
+            with open(path, "rb") as f:
+                flags, blocks = read_index(f)
+                for offset, size, games in blocks:
+                    f.seek(offset)
+                    data = f.read(size)
+                    if flags & Compressed:
+                        data = zlib.decompress(data)
+                    yield from parse_block(data, games)
+
+
+    # Returns game number i as (moves, result), reading only its block.
+    def game(self, i):
+        for path in self.paths:
+            with open(path, "rb") as f:
+                flags, blocks = read_index(f)
+                for offset, size, games in blocks:
+                    if i < games:
+                        f.seek(offset)
+                        data = f.read(size)
+                        if flags & Compressed:
+                            data = zlib.decompress(data)
+                        for j, game in enumerate(parse_block(data, games)):
+                            if j == i:
+                                return game
+                    i -= games
+        raise IndexError("game index out of range")
+
+
+    # Replays every game through make_move and yields (board, move, result)
+    # for each position before a move. The same board object is reused and
+    # changed by the next step, so copy what must be kept.
+    def positions(self):
+        for moves, result in self:
+            board = MiniChessBoard()
+            for move in moves:
+                yield board, move, result
+                board.make_move(move)
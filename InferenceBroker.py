@@ -0,0 +1,170 @@
+from Encoder import num_planes
+from collections import deque
+import ActionSpace
+import asyncio
+import numpy as np
+import threading
+import time
+
+
+# Small two-layer network in NumPy standing in for the real model, so that
+# batching can be run and measured offline. Called like an MCTS evaluator:
+# model(planes, masks) returns (logits, values).
+class NumpyModel():
+    def __init__(self, hidden=256, history=0, seed=0):
+        rng = np.random.default_rng(seed)
+        inputs = num_planes(history) * 25
+        self.w1 = (rng.standard_normal((inputs, hidden)) / np.sqrt(inputs)).astype(np.float32)
+        self.b1 = np.zeros(hidden, dtype=np.float32)
+        self.policy = (rng.standard_normal((hidden, ActionSpace.NumActions)) / np.sqrt(hidden)).astype(np.float32)
+        self.value = (rng.standard_normal(hidden) / np.sqrt(hidden)).astype(np.float32)
+
+
+    def __call__(self, planes, masks):
+        x = planes.reshape(len(planes), -1).astype(np.float32, copy=False)
+        h = np.maximum(x @ self.w1 + self.b1, 0)
+        return h @ self.policy, np.tanh(h @ self.value)
+
+
+# Collects positions submitted by many games into batches for one model.
+# A batch is run as soon as it holds max_batch_size positions, or once the
+# oldest position in it has waited max_latency seconds. Positions are
+# submitted from coroutines with evaluate or evaluate_many, or from other
+# threads through the MCTS-compatible evaluator returned by evaluator().
+# Queue depths and latencies are kept for the last stats_window batches and
+# positions, so a long-running broker uses bounded memory.
+class InferenceBroker():
+    def __init__(self, model, max_batch_size=64, max_latency=0.002, stats_window=100000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.stats_window = stats_window
+        self.queue = None
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.reset_stats()
+
+
+    def reset_stats(self):
+        self.batch_sizes = np.zeros(self.max_batch_size + 1, dtype=np.int64)
+        self.depths = deque(maxlen=self.stats_window)
+        self.latencies = deque(maxlen=self.stats_window)
+        self.model_seconds = 0.0
+
+
+    # Serves batches until stop is called. Must run on the loop that
+    # submits positions.
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.ready.set()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = item[3] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                if self.queue.empty():
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self.queue.get_nowait()
+                if item is None:
+                    self.queue.put_nowait(None)
+                    break
+                batch.append(item)
+            self.run_batch(batch)
+
+
+    # Evaluates a batch of (planes, mask, future, submit time) items and
+    # resolves their futures with (logits, value). If the model raises, every
+    # future of the batch gets the exception and the broker keeps serving.
+    def run_batch(self, batch):
+        self.depths.append(self.queue.qsize())
+        self.batch_sizes[len(batch)] += 1
+        start = time.perf_counter()
+        try:
+            planes = np.stack([item[0] for item in batch])
+            masks = np.stack([item[1] for item in batch])
+            logits, values = self.model(planes, masks)
+        except Exception as e:
+            for p, m, future, submitted in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+        finally:
+            now = time.perf_counter()
+            self.model_seconds += now - start
+        for i, (p, m, future, submitted) in enumerate(batch):
+            self.latencies.append(now - submitted)
+            if not future.cancelled():
+                future.set_result((logits[i], values[i]))
+
+
+    # Submits one position, given as its (C, 5, 5) planes and action mask,
+    # and returns its (logits, value) once its batch has run.
+    async def evaluate(self, planes, mask):
+        future = self.loop.create_future()
+        self.queue.put_nowait((planes, mask, future, time.perf_counter()))
+        return await future
+
+
+    # Submits a batch of positions, such as the leaves of one MCTS batch,
+    # which may be spread over several model batches. Returns (logits,
+    # values) for all of them.
+    async def evaluate_many(self, planes, masks):
+        results = await asyncio.gather(*[self.evaluate(planes[i], masks[i]) for i in range(len(planes))])
+        return np.stack([r[0] for r in results]), np.array([r[1] for r in results])
+
+
+    # Runs the broker on its own event loop in a background thread.
+    def start(self):
+        self.ready.clear()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    # Returns an MCTS evaluator that submits its batches to the broker from
+    # another thread and blocks until they are evaluated.
+    def evaluator(self):
+        def evaluate(planes, masks):
+            return asyncio.run_coroutine_threadsafe(self.evaluate_many(planes, masks), self.loop).result()
+        return evaluate
+
+
+    # Returns batch and latency statistics: the number of batches and
+    # positions, the mean batch size, the histogram of batch sizes, the
+    # queue depth left behind when batches were formed and latency
+    # percentiles in milliseconds (both over the last stats_window), and the
+    # time spent in the model.
+    def stats(self):
+        sizes = np.arange(len(self.batch_sizes))
+        batches = int(self.batch_sizes.sum())
+        positions = int((sizes * self.batch_sizes).sum())
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "batches": batches,
+            "positions": positions,
+            "mean_batch_size": positions / max(batches, 1),
+            "batch_sizes": {int(s): int(c) for s, c in zip(sizes, self.batch_sizes) if c},
+            "mean_queue_depth": float(np.mean(self.depths)) if self.depths else 0.0,
+            "max_queue_depth": max(self.depths, default=0),
+            "latency_ms": dict(zip(["p50", "p90", "p99", "max"],
+                                   np.percentile(latencies, [50, 90, 99, 100]).tolist())),
+            "model_seconds": self.model_seconds,
+        }
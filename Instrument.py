@@ -0,0 +1,327 @@
+from Bitboard import Bitboard
+from Enums import *
+from MiniChessBoard import MiniChessBoard, StartFen
+from Move import *
+from contextlib import contextmanager
+from time import perf_counter_ns
+import argparse
+import atexit
+import json
+import os
+import sys
+
+
+# Instrumentation of the move generation hot paths. While enabled, the hot
+# functions below are replaced on their classes by wrappers that count calls,
+# time them and record call stacks, move generation stages and magic table
+# lookups. Disabling puts the original functions back, so an uninstrumented
+# run executes exactly the code it would without this module.
+#
+# Enable it for a block with `with instrumented() as profile:`, or for a
+# whole run of a command line tool with MINICHESS_PROFILE=<file>, which
+# writes the profile when the process exits. Files ending in .json get the
+# JSON summary and any other name the collapsed stacks read by flamegraph.pl
+# and speedscope. Only the process that enabled it is profiled, not pool
+# workers.
+
+# MiniChessBoard methods that are counted and timed.
+BoardFunctions = ("get_all_moves", "is_legal", "make_move", "unmake_move", "get_check_info",
+                  "get_king_moves", "get_moves", "get_square_moves", "attacked", "attackers_to",
+                  "attack_map", "in_check", "see", "outcome")
+
+# Bitboard attack lookups that are counted and timed.
+AttackFunctions = ("get_knight_attacks", "get_bishop_attacks", "get_rook_attacks",
+                   "get_queen_attacks", "get_king_attacks")
+
+# Stages of gen_staged_moves, in the order they yield moves.
+Stages = ("hash", "tactical", "quiet")
+
+# Version of the JSON layout written by Profile.to_json.
+ProfileVersion = 1
+
+
+# Counters collected by one instrumented run. Times are in nanoseconds.
+# Stacks map a call stack of instrumented functions, joined by ";", to the
+# time spent in its last function outside of instrumented callees.
+class Profile():
+    def __init__(self):
+        self.calls = {}
+        self.nanos = {}
+        self.stacks = {}
+        self.frames = [["", 0]]
+        # moves yielded by each stage of gen_staged_moves, and the stage the
+        # consumer stopped in ("exhausted" when every stage ran out)
+        self.stage_moves = dict.fromkeys(Stages, 0)
+        self.stage_stops = dict.fromkeys(Stages + ("none", "exhausted"), 0)
+        # moves returned by get_all_moves
+        self.legal_moves = 0
+        # sliding lookups per square, and hits per Bitboard.attack_table
+        # entry. Entries are the magic indices of each lookup whatever
+        # backend is selected, so runs on either backend compare.
+        self.slider_squares = {"bishop": [0] * 25, "rook": [0] * 25}
+        self.table_hits = [0] * len(Bitboard.attack_table)
+
+
+    # Returns the profile as a dict of plain values for json.dump.
+    def to_json(self):
+        functions = {}
+        for name, calls in self.calls.items():
+            if calls:
+                functions[name] = {"calls": calls, "seconds": self.nanos[name] / 1e9,
+                                   "ns_per_call": self.nanos[name] / calls}
+        magic = {}
+        for kind in ("bishop", "rook"):
+            offsets = getattr(Bitboard, kind + "_offsets")
+            shifts = getattr(Bitboard, kind + "_shifts")
+            base = min(offsets)
+            size = sum(1 << (64 - shift) for shift in shifts)
+            hits = self.table_hits[base:base + size]
+            magic[kind] = {"lookups": sum(self.slider_squares[kind]),
+                           "squares": self.slider_squares[kind],
+                           "entries": size, "entries_hit": sum(1 for h in hits if h),
+                           "max_entry_hits": max(hits, default=0), "hits": hits}
+        return {"version": ProfileVersion, "attack_backend": Bitboard.attack_backend,
+                "functions": functions, "legal_moves": self.legal_moves,
+                "stages": {"moves": self.stage_moves, "stops": self.stage_stops},
+                "magic": magic, "stacks": self.stacks}
+
+
+    # Returns the call stacks in the collapsed format of flamegraph.pl, one
+    # "a;b;c nanoseconds" line per stack.
+    def collapsed(self):
+        return ["{} {}".format(stack, nanos) for stack, nanos in sorted(self.stacks.items())]
+
+
+    # Writes the profile to path, as JSON if the name ends in .json and as
+    # collapsed stacks otherwise.
+    def write(self, path):
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(self.to_json(), f, indent=1)
+            else:
+                f.write("\n".join(self.collapsed()) + "\n")
+
+
+    # Prints a table of the functions by total time, with the change in
+    # time per call against a baseline from to_json if one is given.
+    def print_summary(self, baseline=None, file=sys.stdout):
+        rows = sorted(self.to_json()["functions"].items(), key=lambda item: -item[1]["seconds"])
+        before = baseline["functions"] if baseline else {}
+        print("{:<20} {:>12} {:>10} {:>10}{}".format("function", "calls", "seconds", "ns/call",
+                                                      " {:>8}".format("change") if baseline else ""),
+              file=file)
+        for name, row in rows:
+            change = ""
+            if name in before:
+                change = " {:>+7.1f}%".format(100 * (row["ns_per_call"] / before[name]["ns_per_call"] - 1))
+            print("{:<20} {:>12,} {:>10.3f} {:>10,.0f}{}".format(
+                name, row["calls"], row["seconds"], row["ns_per_call"], change), file=file)
+        if sum(self.stage_stops.values()):
+            print("staged moves " + ", ".join("{} {:,}".format(s, n) for s, n in self.stage_moves.items()),
+                  file=file)
+            print("stopped in   " + ", ".join("{} {:,}".format(s, n) for s, n in self.stage_stops.items()),
+                  file=file)
+        for kind, row in self.to_json()["magic"].items():
+            if row["lookups"]:
+                print("{} magic: {:,} lookups, {} of {} entries hit, busiest {:,}".format(
+                    kind, row["lookups"], row["entries_hit"], row["entries"], row["max_entry_hits"]),
+                      file=file)
+
+
+# Returns fn wrapped to count its calls and time them into profile under
+# name.
+def _timed(profile, name, fn):
+    calls, nanos, stacks, frames = profile.calls, profile.nanos, profile.stacks, profile.frames
+    calls.setdefault(name, 0)
+    nanos.setdefault(name, 0)
+
+    def wrapper(*args, **kwargs):
+        parent = frames[-1]
+        frame = [parent[0] + ";" + name if parent[0] else name, 0]
+        frames.append(frame)
+        start = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = perf_counter_ns() - start
+            frames.pop()
+            parent[1] += elapsed
+            calls[name] += 1
+            nanos[name] += elapsed
+            stacks[frame[0]] = stacks.get(frame[0], 0) + elapsed - frame[1]
+    return wrapper
+
+
+# Returns a sliding attack lookup wrapped to record its square and the
+# magic table entry it hits.
+def _counted_slider(profile, kind, fn):
+    squares = profile.slider_squares[kind]
+    hits = profile.table_hits
+    masks, numbers, shifts, offsets = (getattr(Bitboard, kind + "_" + table)
+                                       for table in ("masks", "numbers", "shifts", "offsets"))
+    full64 = Bitboard.full64
+
+    def lookup(sq, occupied):
+        squares[sq] += 1
+        hits[offsets[sq] + (((occupied & masks[sq]) * numbers[sq] & full64) >> shifts[sq])] += 1
+        return fn(sq, occupied)
+    return lookup
+
+
+# Returns get_all_moves wrapped to count the moves it returns.
+def _counted_moves(profile, fn):
+    def get_all_moves(board, moves=None):
+        moves = fn(board, moves)
+        profile.legal_moves += len(moves)
+        return moves
+    return get_all_moves
+
+
+# Returns gen_staged_moves wrapped to count the moves of each stage and the
+# stage the consumer stops in. Every resumption of the generator is timed
+# as a call, so the time of lazily generated stages lands in the right
+# stacks.
+def _staged(profile, fn):
+    resume = _timed(profile, "gen_staged_moves", next)
+    moves, stops = profile.stage_moves, profile.stage_stops
+
+    def gen_staged_moves(board, hash_move=0, quiet_key=None, quiets=True):
+        gen = fn(board, hash_move, quiet_key, quiets)
+        stage = "none"
+        try:
+            while True:
+                try:
+                    move = resume(gen)
+                except StopIteration:
+                    stage = "exhausted"
+                    return
+                stage = ("hash" if move == hash_move else
+                         "tactical" if move >> FlagsShift & (Flags.Capture | 8) else "quiet")
+                moves[stage] += 1
+                yield move
+        finally:
+            stops[stage] += 1
+    return gen_staged_moves
+
+
+_profile = None
+_originals = []
+
+
+# Returns the profile being collected, or None when disabled.
+def active():
+    return _profile
+
+
+# Patches the instrumented functions in and returns the profile they record
+# into. Switch attack backends before enabling, since disable() restores the
+# lookups that were selected at this point.
+def enable(profile=None):
+    global _profile
+    if _profile is not None:
+        raise RuntimeError("instrumentation is already enabled")
+    profile = profile or Profile()
+
+    patches = []
+    for name in BoardFunctions:
+        fn = MiniChessBoard.__dict__[name]
+        if name == "get_all_moves":
+            fn = _counted_moves(profile, fn)
+        patches.append((MiniChessBoard, name, _timed(profile, name, fn)))
+    patches.append((MiniChessBoard, "gen_staged_moves",
+                    _staged(profile, MiniChessBoard.__dict__["gen_staged_moves"])))
+    for name in AttackFunctions:
+        fn = Bitboard.__dict__[name]
+        if name in ("get_bishop_attacks", "get_rook_attacks"):
+            fn = _counted_slider(profile, name[4:-8], fn)
+        patches.append((Bitboard, name, _timed(profile, name, fn)))
+
+    for owner, name, wrapper in patches:
+        _originals.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, wrapper)
+    _profile = profile
+    return profile
+
+
+# Restores the original functions and returns the profile collected since
+# enable().
+def disable():
+    global _profile
+    while _originals:
+        owner, name, fn = _originals.pop()
+        setattr(owner, name, fn)
+    profile, _profile = _profile, None
+    return profile
+
+
+# Instruments the hot paths for the duration of a with block, yielding the
+# profile.
+@contextmanager
+def instrumented(profile=None):
+    profile = enable(profile)
+    try:
+        yield profile
+    finally:
+        disable()
+
+
+# Enables instrumentation for the rest of the process if MINICHESS_PROFILE
+# names an output file, and writes the profile there at exit. Called by the
+# command line entry points. Does nothing if a profile is already running.
+def enable_from_env():
+    path = os.environ.get("MINICHESS_PROFILE")
+    if not path or _profile is not None:
+        return
+    profile = enable()
+    pid = os.getpid()
+
+    def write():
+        if os.getpid() == pid:
+            profile.write(path)
+    atexit.register(write)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profiles move generation on a perft or search workload.")
+    parser.add_argument("workload", choices=["perft", "search"])
+    parser.add_argument("depth", type=int, nargs="?", default=4)
+    parser.add_argument("--fen", default=StartFen)
+    parser.add_argument("--json", help="write the JSON profile here")
+    parser.add_argument("--collapsed", help="write collapsed stacks for flamegraph.pl here")
+    parser.add_argument("--compare", help="JSON profile of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    board = MiniChessBoard(args.fen)
+    if args.workload == "perft":
+        from Perft import perft
+        run = lambda: perft(board, args.depth)
+    else:
+        from AlphaBeta import AlphaBeta
+        run = lambda: AlphaBeta().search(board, max_depth=args.depth)
+
+    # a profile enabled by MINICHESS_PROFILE already covers the run
+    enable_from_env()
+    profile = active()
+    if profile is None:
+        with instrumented() as profile:
+            run()
+    else:
+        run()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    profile.print_summary(baseline)
+    if args.json:
+        profile.write(args.json)
+    if args.collapsed:
+        with open(args.collapsed, "w") as f:
+            f.write("\n".join(profile.collapsed()) + "\n")
+    return 0
+
+
+# Runs main from the imported module rather than __main__, so that the entry
+# points it imports share one instrumentation state with it.
+if __name__ == "__main__":
+    import Instrument
+    sys.exit(Instrument.main())
@@ -0,0 +1,333 @@
+from Encoder import encode_bitboards, new_buffer
+from Move import *
+import ActionSpace
+import math
+import numpy as np
+
+
+# Evaluators take a batch of canonical input planes, (K, C, 5, 5), and legal
+# action masks, (K, NumActions), and return (logits, values): policy logits
+# over the canonical action space and values in [-1, 1] for the side to move.
+
+# Evaluator stub giving every legal move the same prior and every position a
+# value of 0.
+class UniformEvaluator():
+    def __call__(self, planes, masks):
+        return np.zeros(masks.shape, dtype=np.float32), np.zeros(len(masks), dtype=np.float32)
+
+
+# Evaluator stub with random logits and values.
+class RandomEvaluator():
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+
+    def __call__(self, planes, masks):
+        logits = self.rng.standard_normal(masks.shape).astype(np.float32)
+        return logits, self.rng.uniform(-1, 1, len(masks)).astype(np.float32)
+
+
+# Node states stored in first_child for nodes without children.
+Unexpanded = -1
+Terminal = -2
+
+
+# PUCT Monte Carlo tree search over a tree held in flat preallocated arrays.
+# The children of a node are stored contiguously from first_child, and each
+# node keeps the move leading to it, its visit count, its prior and the sum
+# of its values from the point of view of the side that made that move. The
+# search walks a single MiniChessBoard with make_move/unmake_move. Up to
+# batch_size leaves are collected per evaluator call, with virtual loss
+# steering the simulations of a batch apart.
+class MCTS():
+    def __init__(self, evaluator, capacity=1 << 18, batch_size=8, c_puct=1.5, virtual_loss=1, tablebases=None):
+        self.evaluator = evaluator
+        self.tablebases = tablebases
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.value_sum = np.zeros(capacity, dtype=np.float32)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.first_child = np.full(capacity, Unexpanded, dtype=np.int32)
+        self.num_children = np.zeros(capacity, dtype=np.int32)
+        self.move = np.zeros(capacity, dtype=np.uint16)
+        # value of terminal nodes for the side to move
+        self.result = np.zeros(capacity, dtype=np.float32)
+        self.pending = np.zeros(capacity, dtype=bool)
+
+        self.planes = new_buffer(batch_size)
+        self.masks = np.zeros((batch_size, ActionSpace.NumActions), dtype=bool)
+        self.collisions = 0
+        self.clear()
+
+
+    # Empties the tree.
+    def clear(self):
+        self.size = 1
+        self.root_key = None
+        self.root_white = True
+        self.reset_node(0)
+
+
+    def reset_node(self, node):
+        self.visits[node] = 0
+        self.value_sum[node] = 0
+        self.first_child[node] = Unexpanded
+        self.num_children[node] = 0
+
+
+    # Returns whether the root has been expanded.
+    def root_expanded(self):
+        return self.first_child[0] >= 0
+
+
+    # Returns the child of node with the highest PUCT score.
+    def select_child(self, node):
+        first = self.first_child[node]
+        children = slice(first, first + self.num_children[node])
+        visits = self.visits[children]
+        q = self.value_sum[children] / np.maximum(visits, 1)
+        u = self.c_puct * math.sqrt(self.visits[node]) * self.prior[children] / (1 + visits)
+        return first + int(np.argmax(q + u))
+
+
+    # Walks from the root to a leaf, making the moves on board and adding
+    # virtual loss along the way. Returns the path of nodes.
+    def select(self, board):
+        node = 0
+        path = [0]
+        while self.first_child[node] >= 0:
+            node = self.select_child(node)
+            board.make_move(int(self.move[node]))
+            path.append(node)
+
+        path = np.array(path)
+        self.visits[path] += self.virtual_loss
+        self.value_sum[path] -= self.virtual_loss
+        return path
+
+
+    # Removes the virtual loss of a path and adds a leaf value, given for the
+    # side to move at the leaf, to every node on it.
+    def backup(self, path, value):
+        signs = np.where(np.arange(len(path)) % 2 == len(path) % 2, value, -value)
+        self.visits[path] += 1 - self.virtual_loss
+        self.value_sum[path] += signs + self.virtual_loss
+
+
+    # Gives node one child per move with the given priors. Leaves node
+    # unexpanded if the tree is full.
+    def expand(self, node, moves, priors):
+        first = self.size
+        if first + len(moves) > self.capacity:
+            return
+        children = slice(first, first + len(moves))
+        self.move[children] = np.frombuffer(moves, dtype=np.uint16)
+        self.prior[children] = priors
+        self.visits[children] = 0
+        self.value_sum[children] = 0
+        self.first_child[children] = Unexpanded
+        self.num_children[children] = 0
+        self.first_child[node] = first
+        self.num_children[node] = len(moves)
+        self.size += len(moves)
+
+
+    # Runs one batch of up to count simulations. Returns the number run.
+    def run_batch(self, board, count):
+        paths = []
+        moves = []
+        actions = []
+        bitboards = []
+        white = []
+        done = 0
+        for k in range(count):
+            path = self.select(board)
+            leaf = path[-1]
+            if self.pending[leaf]:
+                # another simulation of this batch already waits on the leaf
+                self.visits[path] -= self.virtual_loss
+                self.value_sum[path] += self.virtual_loss
+                self.collisions += 1
+                for i in range(len(path) - 1):
+                    board.unmake_move()
+                break
+
+            if self.first_child[leaf] == Unexpanded:
+                legal = board.get_all_moves()
+                if not legal:
+                    self.first_child[leaf] = Terminal
+                    self.result[leaf] = -1 if board.get_check_info()[0] else 0
+                elif board.is_insufficient_material():
+                    self.first_child[leaf] = Terminal
+                    self.result[leaf] = 0
+                elif self.tablebases is not None and leaf:
+                    # positions in the tablebases are scored exactly
+                    probe = self.tablebases.probe(board)
+                    if probe is not None:
+                        self.first_child[leaf] = Terminal
+                        self.result[leaf] = probe[0]
+
+            if self.first_child[leaf] == Terminal:
+                self.backup(path, self.result[leaf])
+                done += 1
+            else:
+                self.pending[leaf] = True
+                bitboards.append(board.board[:] if board.white else board.board[6:] + board.board[:6])
+                white.append(board.white)
+                paths.append(path)
+                moves.append(legal)
+                actions.append(ActionSpace.moves_to_actions(legal, board.white, True))
+
+            for i in range(len(path) - 1):
+                board.unmake_move()
+
+        if paths:
+            k = len(paths)
+            planes = self.planes[:k]
+            masks = self.masks[:k]
+            encode_bitboards(np.array(bitboards, dtype=np.uint32), np.array(white), planes, True)
+            masks[:] = False
+            for i in range(k):
+                masks[i, actions[i]] = True
+            logits, values = self.evaluator(planes, masks)
+
+            for i in range(k):
+                leaf = paths[i][-1]
+                legal_logits = logits[i, actions[i]]
+                priors = np.exp(legal_logits - legal_logits.max())
+                self.expand(leaf, moves[i], priors / priors.sum())
+                self.backup(paths[i], float(values[i]))
+                self.pending[leaf] = False
+
+        return done + len(paths)
+
+
+    # Points the tree at a board's position, keeping the tree if it is
+    # already there and starting a new one otherwise.
+    def set_root(self, board):
+        if self.root_key != board.key:
+            self.clear()
+            self.root_key = board.key
+            self.root_white = board.white
+
+
+    # Runs simulations from the position of board, which is left unchanged.
+    # If rng is given, Dirichlet noise is mixed into the root priors as in
+    # self-play.
+    def search(self, board, simulations, rng=None, alpha=0.3, noise=0.25):
+        self.set_root(board)
+        done = 0
+        cap = board.hold_history()
+        try:
+            if not self.root_expanded():
+                done += self.run_batch(board, 1)
+            if rng is not None and self.root_expanded():
+                self.add_noise(rng, alpha, noise)
+            while done < simulations and self.first_child[0] != Terminal:
+                done += self.run_batch(board, min(self.batch_size, simulations - done))
+        finally:
+            board.release_history(cap)
+
+        return done
+
+
+    def add_noise(self, rng, alpha, noise):
+        first = self.first_child[0]
+        children = slice(first, first + self.num_children[0])
+        self.prior[children] = ((1 - noise) * self.prior[children]
+                                + noise * rng.dirichlet([alpha] * self.num_children[0]))
+
+
+    # Returns the root moves as an array of packed moves and their visit
+    # counts.
+    def root_visits(self):
+        first = self.first_child[0]
+        children = slice(first, first + max(self.num_children[0], 0))
+        return self.move[children], self.visits[children]
+
+
+    # Returns the mean value of the root for its side to move.
+    def root_value(self):
+        return -self.value_sum[0] / max(self.visits[0], 1)
+
+
+    # Returns the root moves and the probabilities of playing them, from the
+    # visit counts raised to 1 / temperature. Temperature 0 picks the most
+    # visited move.
+    def policy(self, temperature=1.0):
+        moves, visits = self.root_visits()
+        if temperature == 0:
+            probs = np.zeros(len(moves))
+            probs[np.argmax(visits)] = 1
+        else:
+            probs = visits.astype(np.float64) ** (1 / temperature)
+            probs /= probs.sum()
+        return moves, probs
+
+
+    # Returns the visit distribution at the root over the canonical action
+    # space, as a policy training target.
+    def action_policy(self):
+        moves, visits = self.root_visits()
+        target = np.zeros(ActionSpace.NumActions, dtype=np.float32)
+        actions = ActionSpace.moves_to_actions(moves, self.root_white, True)
+        target[actions] = visits / max(visits.sum(), 1)
+        return target
+
+
+    # Picks a root move by the visit policy at a temperature.
+    def select_move(self, temperature=0.0, rng=None):
+        moves, probs = self.policy(temperature)
+        if temperature == 0 or rng is None:
+            return int(moves[np.argmax(probs)])
+        return int(rng.choice(moves, p=probs))
+
+
+    # Follows the last move made on board, which must have been played from
+    # the root position: the child it leads to becomes the root and keeps its
+    # subtree, compacted to the front of the arrays. Starts a new tree if the
+    # move was not expanded.
+    def advance(self, board):
+        moves, visits = self.root_visits()
+        found = np.flatnonzero(moves == board.moves[-1])
+        if len(found):
+            self.reroot(self.first_child[0] + int(found[0]))
+            # a leaf scored by the tablebases still needs its moves as a root
+            if self.first_child[0] == Terminal:
+                self.reset_node(0)
+        else:
+            self.clear()
+        self.root_key = board.key
+        self.root_white = board.white
+
+
+    # Copies the subtree of node to the front of the arrays, level by level,
+    # so that children stay contiguous, and makes it the root.
+    def reroot(self, node):
+        fields = [self.visits, self.value_sum, self.prior, self.move, self.result]
+        level = np.array([node])
+        old_ids = []
+        first_child = []
+        num_children = []
+        size = 0
+        while len(level):
+            counts = np.where(self.first_child[level] >= 0, self.num_children[level], 0)
+            size += len(level)
+            # children of this level come right after it, in order
+            first_child.append(np.where(counts > 0, size + np.cumsum(counts) - counts,
+                                        np.minimum(self.first_child[level], Unexpanded)))
+            num_children.append(counts)
+            old_ids.append(level)
+            starts = np.repeat(self.first_child[level] - np.cumsum(counts) + counts, counts)
+            level = starts + np.arange(counts.sum())
+
+        old_ids = np.concatenate(old_ids)
+        for field in fields:
+            field[:len(old_ids)] = field[old_ids]
+        self.first_child[:len(old_ids)] = np.concatenate(first_child)
+        self.num_children[:len(old_ids)] = np.concatenate(num_children)
+        self.size = len(old_ids)
@@ -1,11 +1,15 @@
-from MiniChessBoard import Square, Bitboard
-import itertools
-import pickle
-import uuid
+from Bitboard import Bitboard, MagicsPath, pack_magics, load_magics, write_magics
+import argparse
+import numpy as np
+import sys
+import time
 
 
 FULL_64 = 0xFFFFFFFFFFFFFFFF
 
+# Seed of the magic number search, so rebuilt tables are reproducible.
+SEED = 0x5eed
+
 # Returns the list of squares that a bishop placed at a given square can
 # attack, given the original square and a bitboard of the occupied squares
 def bishop_attacks(sq, blocked):
@@ -57,62 +61,148 @@ def rook_attacks(sq, blocked):
 
     return attacked_squares
 
-# Generates a random 64-bit integer
-def gen_64():
-    return uuid.uuid4().int >> 64
-
-
-# Generates a magic number and corresponding table for a given square and piece
-# type. Returns a dictionary holding the magic number, table, and the size of
-# the bit shift required in the algorithm
-def gen_magic(sq, bishop):
-    mask = bishop_attacks(sq, 0) if bishop else rook_attacks(sq, 0)
-
-    for bits in range(len(mask), 25):
-        for it in range(1000):
-            magic = gen_64() & gen_64() & gen_64()
-            done = True
-            database = {}
-
-            for l in range(len(mask) + 1):
-                if not done:
-                    break
-
-                blocked_combs = [x for x in itertools.combinations(mask, l)]
-                for b in blocked_combs:
-                    blocked = Bitboard.gen_bitboard(b)
-                    results = Bitboard.gen_bitboard(bishop_attacks(sq, blocked) if bishop else
-                                                    rook_attacks(sq, blocked))
-
-                    index = ((blocked * magic) & FULL_64) >> (64 - bits)
-                    if index in database and database[index] != results:
-                        done = False
-                        break
 
-                    database[index] = results
-                    Bitboard.print_bitboard(results)
-                    print()
-
-            if done:
-                return {"mask": Bitboard.gen_bitboard(mask), "magic": magic,
-                        "table": database, "bits": bits}
-
-    print("Failed to find magic!")
-
-
-# Generates all magic numbers and saves them to pickle files
-def gen_all_magics():
-    bishop_magics = [None] * 25
-    rook_magics = [None] * 25 
+# Returns the attack bitboard of a bishop or rook on a square.
+def slider_attacks(sq, blocked, bishop):
+    return Bitboard.gen_bitboard(bishop_attacks(sq, blocked) if bishop else
+                                 rook_attacks(sq, blocked))
+
+
+# Returns the bitboard of squares whose occupancy can change the attacks of a
+# slider on a square. The last square of each ray never can, so it is left
+# out to keep the tables small.
+def relevant_mask(sq, bishop):
+    empty = slider_attacks(sq, 0, bishop)
+    mask = 0
+    for s in bishop_attacks(sq, 0) if bishop else rook_attacks(sq, 0):
+        if slider_attacks(sq, 1 << s, bishop) != empty:
+            mask = Bitboard.set_square(mask, s)
+
+    return mask
+
+
+# Returns every subset of a mask, enumerated with the carry-rippler trick.
+def subsets(mask):
+    result = [0]
+    sub = -mask & mask
+    while sub:
+        result.append(sub)
+        sub = (sub - mask) & mask
+
+    return result
+
+
+# Draws a batch of candidate magics. ANDing three random numbers gives sparse
+# candidates, which are far more likely to be magic.
+def gen_candidates(rng, count):
+    draw = lambda: rng.integers(0, FULL_64, size=count, dtype=np.uint64, endpoint=True)
+    return draw() & draw() & draw()
+
+
+# Tests a batch of candidate magics at once. occupancies and attacks hold
+# every subset of a square's mask and its attack bitboard. Returns a boolean
+# array marking the candidates that map no two subsets with different attacks
+# to the same index.
+def test_candidates(candidates, occupancies, attacks, bits):
+    indices = (occupancies[None, :] * candidates[:, None]) >> np.uint64(64 - bits)
+    order = np.argsort(indices, axis=1, kind="stable")
+    indices = np.take_along_axis(indices, order, axis=1)
+    sorted_attacks = attacks[order]
+    conflicts = (indices[:, 1:] == indices[:, :-1]) & (sorted_attacks[:, 1:] != sorted_attacks[:, :-1])
+
+    return ~conflicts.any(axis=1)
+
+
+# Finds the magic with the fewest index bits for a square and piece type.
+# Returns a (mask, magic, bits, table) tuple, where table maps each index to
+# its attack bitboard.
+def gen_magic(sq, bishop, rng, batch=4096, tries=64):
+    mask = relevant_mask(sq, bishop)
+    blocked = subsets(mask)
+    results = [slider_attacks(sq, b, bishop) for b in blocked]
+    occupancies = np.array(blocked, dtype=np.uint64)
+    attacks = np.array(results, dtype=np.uint32)
+
+    # no index can be smaller than the number of distinct attack sets
+    min_bits = max(1, (len(set(results)) - 1).bit_length())
+    for bits in range(min_bits, Bitboard.popcount(mask) + 2):
+        for it in range(tries):
+            candidates = gen_candidates(rng, batch)
+            found = np.flatnonzero(test_candidates(candidates, occupancies, attacks, bits))
+            if len(found):
+                magic = int(candidates[found[0]])
+                table = {}
+                for b, result in zip(blocked, results):
+                    table[((b * magic) & FULL_64) >> (64 - bits)] = result
+                return mask, magic, bits, table
+
+    raise RuntimeError("Failed to find magic for square " + str(sq))
+
+
+# Checks a magic against the reference attack functions for every occupancy
+# of the square's full rays, so that squares outside the relevant mask are
+# covered too. Raises an AssertionError on the first mismatch.
+def verify_magic(sq, bishop, mask, magic, bits, table):
+    for blocked in subsets(slider_attacks(sq, 0, bishop)):
+        index = (((blocked & mask) * magic) & FULL_64) >> (64 - bits)
+        assert table.get(index) == slider_attacks(sq, blocked, bishop), \
+            "bad {} magic on square {}".format("bishop" if bishop else "rook", sq)
+
+
+# Checks the magic tables currently loaded into Bitboard against the
+# reference attack functions for every occupancy of every square's rays.
+# The magic lookups are used directly, whichever backend is selected.
+def verify_loaded():
     for sq in range(25):
-        bishop_magics[sq] = gen_magic(sq, True)
-        rook_magics[sq] = gen_magic(sq, False)
-
-    with open("bishop_magics.pkl", "wb") as f:
-        pickle.dump(bishop_magics, f)
-    with open("rook_magics.pkl", "wb") as f:
-        pickle.dump(rook_magics, f)
-
-bishop_magics = [None] * 25
-for sq in [6]:
-    bishop_magics[sq] = gen_magic(sq, True)
+        for bishop, lookup in [(True, Bitboard.get_magic_bishop_attacks),
+                               (False, Bitboard.get_magic_rook_attacks)]:
+            for blocked in subsets(slider_attacks(sq, 0, bishop)):
+                assert lookup(sq, blocked) == slider_attacks(sq, blocked, bishop), \
+                    "bad {} table entry on square {}".format("bishop" if bishop else "rook", sq)
+
+
+# Searches magics for every square. Returns the bishop and rook tables as
+# lists of 25 (mask, magic, bits, table) tuples, as expected by
+# Bitboard.pack_magics.
+def build_magics(seed=SEED, batch=4096, tries=64, verbose=False):
+    rng = np.random.default_rng(seed)
+    tables = []
+    for bishop in [True, False]:
+        magics = []
+        for sq in range(25):
+            magic = gen_magic(sq, bishop, rng, batch, tries)
+            verify_magic(sq, bishop, *magic)
+            magics.append(magic)
+            if verbose:
+                print("{} {:>2}: {} relevant squares, {} bits".format(
+                    "bishop" if bishop else "rook", sq, Bitboard.popcount(magic[0]), magic[2]))
+        tables.append(magics)
+
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the magic bitboard tables.")
+    parser.add_argument("--output", default=MagicsPath)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--batch", type=int, default=4096,
+                        help="candidate magics tested per NumPy batch")
+    parser.add_argument("--tries", type=int, default=64,
+                        help="batches tried before allowing another index bit")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    bishop, rook = build_magics(args.seed, args.batch, args.tries, verbose=True)
+    data = pack_magics(bishop, rook)
+
+    # verify the bytes that will be written before replacing the old file
+    load_magics(data=data)
+    verify_loaded()
+    write_magics(args.output, data)
+
+    print("wrote {} ({} bytes) in {:.1f}s".format(args.output, len(data), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
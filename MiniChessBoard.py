@@ -1,36 +1,212 @@
 from Bitboard import Bitboard
 from Enums import *
-from Move import Move
+from Evaluation import Evaluation, PieceValues
+from Move import *
+from Zobrist import Zobrist
+from array import array
+import os
+import sys
+
+
+# Mailbox entries for every (color, piece) pair, shared by all boards so that
+# square lookups never allocate.
+PieceInfo = [[(Color(c), Piece(p)) for p in range(6)] for c in range(2)]
+NoPiece = (Color.NONE, Piece.NONE)
+
+# FEN of the Gardner starting position. White pieces are upper case.
+StartFen = "rnbqk/ppppp/5/PPPPP/RNBQK w"
+
+# The first and last ranks, where pawn moves promote.
+PromotionRanks = 0x1f | 0x1f << 20
+
+# Number of plies without a capture or pawn move after which the game is
+# drawn.
+HalfmoveLimit = 100
+
+# The a and e files and the whole board, for shifting pawns into attacks.
+FileA = 0x108421
+FileE = FileA << 4
+AllSquares = (1 << 25) - 1
+
+
+# Returns the MVV-LVA ordering score of a capture or promotion: the value
+# of the captured piece and of the promotion piece, less the attacker's rank
+# to break ties in favour of the cheapest attacker.
+def capture_order(mailbox, move):
+    flags = move >> FlagsShift
+    score = -mailbox[move & StartMask][1]
+    if flags & Flags.Capture:
+        score += 8 * PieceValues[mailbox[move >> EndShift & StartMask][1]]
+    if flags & 8:
+        score += 8 * PieceValues[PromPieces[flags & 3]]
+    return score
 
 
 # Represents a board for Gardner minichess. It stores information about the
 # current board state, as well as the move history.
+#
+# The pieces are 12 bitboards in one flat list, board[6 * color + piece],
+# white pawn to black king. With history_limit set, only the last
+# history_limit to 2 * history_limit moves are kept for unmake_move,
+# repetitions and move history, so long games stop growing; keep it at
+# least HalfmoveLimit for repetitions to be exact.
 class MiniChessBoard():
-    def __init__(self):
-        self.board = [None] * 2
-        for i in range(2):
-            self.board[i] = [0] * 6
+    __slots__ = ("board", "mailbox", "occupancy", "occupied", "counts", "key", "score", "white",
+                 "move_count", "moves", "undo", "keys", "halfmoves", "num_legal", "debug",
+                 "history_cap", "attack_maps", "attack_key")
+
+    # When set, the derived state and Zobrist key are checked against the raw
+    # bitboards after every make_move/unmake_move. Can also be enabled with
+    # MINICHESS_DEBUG=1.
+    debug_default = os.environ.get("MINICHESS_DEBUG", "") not in ("", "0")
+
+    def __init__(self, fen=None, debug=None, history_limit=None):
+        self.board = [0] * 12
 
         # initialize pieces
-        self.board[0][Piece.Pawn] = 0b1111100000
-        self.board[0][Piece.Knight] = 0b10
-        self.board[0][Piece.Bishop] = 0b100
-        self.board[0][Piece.Rook] = 1
-        self.board[0][Piece.Queen] = 0b1000
-        self.board[0][Piece.King] = 0b10000
+        self.board[Piece.Pawn] = 0b1111100000
+        self.board[Piece.Knight] = 0b10
+        self.board[Piece.Bishop] = 0b100
+        self.board[Piece.Rook] = 1
+        self.board[Piece.Queen] = 0b1000
+        self.board[Piece.King] = 0b10000
 
         # initialize black pieces
-        self.board[1][Piece.Pawn] = self.board[0][Piece.Pawn] << 10
-        self.board[1][Piece.Knight] = self.board[0][Piece.Knight] << 20
-        self.board[1][Piece.Bishop] = self.board[0][Piece.Bishop] << 20
-        self.board[1][Piece.Rook] = self.board[0][Piece.Rook] << 20
-        self.board[1][Piece.Queen] = self.board[0][Piece.Queen] << 20
-        self.board[1][Piece.King] = self.board[0][Piece.King] << 20
+        self.board[6 + Piece.Pawn] = self.board[Piece.Pawn] << 10
+        for piece in (Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen, Piece.King):
+            self.board[6 + piece] = self.board[piece] << 20
 
+        # number of plies made since the position was set up
         self.move_count = 0
         self.white = True
         self.moves = [None]
-        self.captured = [None]
+        # Undo records holding the (moved piece, captured piece, key, score,
+        # halfmove counter) of each move.
+        self.undo = [None]
+        # Zobrist keys of every position of the game, for repetitions, and
+        # the number of plies since the last capture or pawn move.
+        self.keys = [None]
+        self.halfmoves = 0
+        self.debug = self.debug_default if debug is None else debug
+        self.history_cap = sys.maxsize if history_limit is None else 2 * history_limit + 1
+
+        if fen is None:
+            self.init_derived_state()
+        else:
+            self.set_fen(fen)
+
+
+    # Sets up the position described by a FEN string such as StartFen: five
+    # ranks from rank 5 down to rank 1, then the side to move. The move
+    # history is cleared.
+    def set_fen(self, fen):
+        fields = fen.split()
+        ranks = fields[0].split("/")
+        if len(ranks) != 5:
+            raise ValueError("FEN must describe 5 ranks: " + fen)
+
+        self.board = [0] * 12
+        for i, rank in enumerate(ranks):
+            sq = 5 * (4 - i)
+            for ch in rank:
+                if ch.isdigit():
+                    sq += int(ch)
+                    continue
+                if ch.lower() not in PieceNames[:6]:
+                    raise ValueError("Invalid piece in FEN: " + ch)
+                color = Color.White if ch.isupper() else Color.Black
+                piece = PieceNames.index(ch.lower())
+                self.board[6 * color + piece] |= 1 << sq
+                sq += 1
+            if sq != 5 * (5 - i):
+                raise ValueError("FEN rank does not have 5 squares: " + rank)
+
+        self.white = len(fields) < 2 or fields[1] == "w"
+        self.move_count = 0
+        self.moves = [None]
+        self.undo = [None]
+        self.keys = [None]
+        self.halfmoves = 0
+        self.init_derived_state()
+
+
+    # Returns the FEN string describing the current position.
+    def get_fen(self):
+        ranks = []
+        for i in range(4, -1, -1):
+            rank = ""
+            empty = 0
+            for j in range(5):
+                c, p = self.mailbox[5 * i + j]
+                if c == Color.NONE:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += PieceNames[p].upper() if c == Color.White else PieceNames[p]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        return "/".join(ranks) + (" w" if self.white else " b")
+
+
+    # Rebuilds the mailbox, occupancy bitboards, material counts, Zobrist key
+    # and evaluation score from the piece bitboards. Must be called whenever
+    # self.board is modified directly.
+    def init_derived_state(self):
+        self.init_piece_state()
+        self.key = Zobrist.compute(self)
+        self.keys[-1] = self.key
+        # material plus piece-square score from white's point of view
+        self.score = Evaluation.compute(self)
+        # number of legal moves, once generated for this position
+        self.num_legal = None
+
+
+    # Rebuilds the mailbox, occupancy bitboards and material counts from the
+    # piece bitboards.
+    def init_piece_state(self):
+        self.mailbox = [NoPiece] * 25
+        self.occupancy = [0, 0]
+        self.counts = [Bitboard.popcount(pieces) for pieces in self.board]
+        for c in range(2):
+            for p in range(6):
+                pieces = self.board[6 * c + p]
+                self.occupancy[c] |= pieces
+                while pieces:
+                    self.mailbox[Bitboard.lsb(pieces)] = PieceInfo[c][p]
+                    pieces = Bitboard.pop_lsb(pieces)
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+        self.attack_key = None
+
+
+    # Checks that the mailbox, occupancy bitboards, material counts, Zobrist
+    # key and score agree with the piece bitboards, raising an AssertionError
+    # if they do not.
+    def check_state(self):
+        occupancy = [0, 0]
+        for c in range(2):
+            for p in range(6):
+                occupancy[c] |= self.board[6 * c + p]
+        assert not (occupancy[0] & occupancy[1]), "colors overlap"
+        assert self.occupancy == occupancy, "stale color occupancy"
+        assert self.occupied == occupancy[0] | occupancy[1], "stale occupancy"
+
+        for sq in range(25):
+            expected = NoPiece
+            for c in range(2):
+                for p in range(6):
+                    if Bitboard.is_set(self.board[6 * c + p], sq):
+                        expected = PieceInfo[c][p]
+            assert self.mailbox[sq] == expected, \
+                "stale mailbox at " + Square(sq).name
+
+        assert self.counts == [Bitboard.popcount(pieces) for pieces in self.board], "stale material counts"
+        assert self.key == Zobrist.compute(self), "stale Zobrist key"
+        assert self.keys[-1] == self.key, "stale key history"
+        assert self.score == Evaluation.compute(self), "stale evaluation score"
 
     
     # Returns the color of the side to move.
@@ -39,24 +215,17 @@ class MiniChessBoard():
 
     # Given a square, returns the color and type of the piece on the square.
     def get_square_info(self, square):
-        for c in range(2):
-            for p in range(6):
-                if Bitboard.is_set(self.board[c][p], square):
-                    return Color(c), Piece(p)
-
-        return Color.NONE, Piece.NONE
+        return self.mailbox[square]
 
     
-    # Returns the type of piece on a given square.
+    # Returns the color of a piece on a given square.
     def get_square_color(self, square):
-        c, p = self.get_square_info(square)
-        return c
+        return self.mailbox[square][0]
         
 
-    # Returns the color of a piece on a given square.
+    # Returns the type of piece on a given square.
     def get_square_piece(self, square):
-        c, p = self.get_square_info(square)
-        return p
+        return self.mailbox[square][1]
 
         
     # Prints out the current state of the board.
@@ -72,130 +241,358 @@ class MiniChessBoard():
 
     # Returns the bitboard of all of the occupied squares on a board
     def get_occupied(self):
-        occupied = 0
-        for c in range(2):
-            for p in range(6):
-                occupied |= self.board[c][p]
+        return self.occupied
+
 
-        return occupied
+    # Returns the bitboard of all of the squares occupied by a given color.
+    def get_occupancy(self, color):
+        return self.occupancy[color]
 
 
     # Given a color and piece, returns the bitboard of all pieces on that board
     # with that color and piece.
     def get_pieces(self, color, piece):
-        return self.board[color][piece]
-
-
-    # returns whether the given color attacks the given square
-    def attacked(self, color, sq):
-        other_color = Color.Black if color == Color.White else Color.White
-        pawns = self.get_pieces(color, Piece.Pawn)
-        knights = self.get_pieces(color, Piece.Knight)
-        bishopQueens = self.get_pieces(color, Piece.Bishop) | self.get_pieces(color, Piece.Queen)
-        rookQueens = self.get_pieces(color, Piece.Rook) | self.get_pieces(color, Piece.Queen)
-        kings = self.get_pieces(color, Piece.King)
-
-        if pawns & Bitboard.pawn_attacks[other_color][sq]:
-            return True
-        if knights & Bitboard.get_knight_attacks(sq):
-            return True
-        if bishopQueens & Bitboard.get_bishop_attacks(sq, self.get_occupied()):
-            return True
-        if rookQueens & Bitboard.get_rook_attacks(sq, self.get_occupied()):
-            return True
-        if kings & Bitboard.get_king_attacks(sq):
-            return True
+        return self.board[6 * color + piece]
+
+
+    # Returns whether the given color attacks the given square. Sliding attacks
+    # are computed through the given occupancy, which defaults to the board's.
+    def attacked(self, color, sq, occupied=None):
+        if occupied is None:
+            occupied = self.occupied
+        board = self.board
+        base = 6 * color
+        queens = board[base + Piece.Queen]
+
+        return bool(board[base + Piece.Pawn] & Bitboard.pawn_attacks[color ^ 1][sq]
+                    or board[base + Piece.Knight] & Bitboard.knight_attacks[sq]
+                    or board[base + Piece.King] & Bitboard.king_attacks[sq]
+                    or (board[base + Piece.Bishop] | queens) & Bitboard.get_bishop_attacks(sq, occupied)
+                    or (board[base + Piece.Rook] | queens) & Bitboard.get_rook_attacks(sq, occupied))
+
+
+    # Returns the pieces of both colors attacking a square, with sliding
+    # attacks computed through the given occupancy, which defaults to the
+    # board's. Pieces outside the occupancy are still included.
+    def attackers_to(self, sq, occupied=None):
+        if occupied is None:
+            occupied = self.occupied
+        board = self.board
+        bishops = (board[Piece.Bishop] | board[Piece.Queen]
+                   | board[6 + Piece.Bishop] | board[6 + Piece.Queen])
+        rooks = (board[Piece.Rook] | board[Piece.Queen]
+                 | board[6 + Piece.Rook] | board[6 + Piece.Queen])
+
+        return ((Bitboard.pawn_attacks[Color.Black][sq] & board[Piece.Pawn])
+                | (Bitboard.pawn_attacks[Color.White][sq] & board[6 + Piece.Pawn])
+                | (Bitboard.knight_attacks[sq] & (board[Piece.Knight] | board[6 + Piece.Knight]))
+                | (Bitboard.king_attacks[sq] & (board[Piece.King] | board[6 + Piece.King]))
+                | (Bitboard.get_bishop_attacks(sq, occupied) & bishops)
+                | (Bitboard.get_rook_attacks(sq, occupied) & rooks))
+
+
+    # Returns every square the given color attacks. The map is computed on
+    # first use and cached until the position's Zobrist key changes, so
+    # make_move and unmake_move invalidate it without any extra work. The
+    # other color's king is left out of the occupancy, so squares behind it
+    # on a slider's line count as attacked: its own square is attacked
+    # exactly when it is in check, and it can never step to a square the
+    # map holds.
+    def attack_map(self, color):
+        if self.attack_key != self.key:
+            self.attack_maps = [None, None]
+            self.attack_key = self.key
+        attacks = self.attack_maps[color]
+        if attacks is not None:
+            return attacks
+
+        board = self.board
+        base = 6 * color
+        occupied = self.occupied ^ board[6 * (color ^ 1) + Piece.King]
+        pawns = board[base + Piece.Pawn]
+        if color == Color.White:
+            attacks = ((pawns & ~FileA) << 4 | (pawns & ~FileE) << 6) & AllSquares
+        else:
+            attacks = (pawns & ~FileA) >> 6 | (pawns & ~FileE) >> 4
+        attacks |= Bitboard.king_attacks[Bitboard.lsb(board[base + Piece.King])]
+        pieces = board[base + Piece.Knight]
+        while pieces:
+            attacks |= Bitboard.knight_attacks[Bitboard.lsb(pieces)]
+            pieces = Bitboard.pop_lsb(pieces)
+        pieces = board[base + Piece.Bishop] | board[base + Piece.Queen]
+        while pieces:
+            attacks |= Bitboard.get_bishop_attacks(Bitboard.lsb(pieces), occupied)
+            pieces = Bitboard.pop_lsb(pieces)
+        pieces = board[base + Piece.Rook] | board[base + Piece.Queen]
+        while pieces:
+            attacks |= Bitboard.get_rook_attacks(Bitboard.lsb(pieces), occupied)
+            pieces = Bitboard.pop_lsb(pieces)
 
-        return False
+        self.attack_maps[color] = attacks
+        return attacks
 
 
     # Returns whether the current player is in check or not.
     def in_check(self):
-        color, other = (Color.White, Color.Black) if self.white else (Color.Black, Color.White)
-        sq = Bitboard.lsb(self.get_pieces(color, Piece.King))
-        return self.attacked(other, sq)
+        color = Color.White if self.white else Color.Black
+        return bool(self.attack_map(color ^ 1) & self.board[6 * color + Piece.King])
+
+
+    # Returns the static exchange evaluation of a capture or promotion: the
+    # material the side to move wins, in PieceValues, if both sides keep
+    # recapturing on the end square with their least valuable attacker for
+    # as long as that pays. Pins are ignored, and a king only recaptures
+    # when the other side has no attacker left. Only the move itself is
+    # scored as a promotion.
+    def see(self, move):
+        start = move & StartMask
+        end = move >> EndShift & StartMask
+        flags = move >> FlagsShift
+        board = self.board
+        color, piece = self.mailbox[start]
+
+        gain = [PieceValues[self.mailbox[end][1]] if flags & Flags.Capture else 0]
+        value = PieceValues[piece]
+        if flags & 8:
+            value = PieceValues[PromPieces[flags & 3]]
+            gain[0] += value - PieceValues[Piece.Pawn]
+        occupied = self.occupied ^ (1 << start)
+        attackers = self.attackers_to(end, occupied) & occupied
+        side = color ^ 1
+        while True:
+            # score for side if it takes the piece now on the square
+            gain.append(value - gain[-1])
+            ours = attackers & self.occupancy[side]
+            if not ours:
+                break
+            base = 6 * side
+            for piece in (Piece.Pawn, Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen, Piece.King):
+                if ours & board[base + piece]:
+                    break
+            if piece == Piece.King and attackers & self.occupancy[side ^ 1]:
+                break
+            occupied ^= 1 << Bitboard.lsb(ours & board[base + piece])
+            # recompute to uncover sliders behind the piece that moved
+            attackers = self.attackers_to(end, occupied) & occupied
+            value = PieceValues[piece]
+            side ^= 1
+
+        for d in range(len(gain) - 2, 0, -1):
+            gain[d - 1] = -max(-gain[d - 1], gain[d])
+        return gain[0]
 
 
     # Returns whether the game should be ruled a draw due to insufficient
     # material.
     def is_insufficient_material(self):
-        for color in [Color.White, Color.Black]:
-            for piece in [Piece.Pawn, Piece.Rook, Piece.Queen]:
-                if Bitboard.popcount(self.get_pieces(color, piece)) > 0:
-                    return False
-            knight_count = Bitboard.popcount(self.get_pieces(color, Piece.Knight))
-            bishop_count = Bitboard.popcount(self.get_pieces(color, Piece.Bishop))
+        counts = self.counts
+        for base in (0, 6):
+            if counts[base + Piece.Pawn] or counts[base + Piece.Rook] or counts[base + Piece.Queen]:
+                return False
+            knight_count = counts[base + Piece.Knight]
+            bishop_count = counts[base + Piece.Bishop]
             if (bishop_count and knight_count) or bishop_count > 1 or knight_count > 2:
                 return False
 
         return True
 
 
-    # Given a legal move, applies the move on the chessboard.
+    # Returns whether the position has occurred count times, counting this
+    # one, since the last capture or pawn move.
+    def is_repetition(self, count=3):
+        keys = self.keys
+        recent = keys[len(keys) - 1 - min(self.halfmoves, len(keys) - 1):]
+        return recent[::-2].count(self.key) >= count
+
+
+    # Returns None while the game goes on, and otherwise (result, Termination)
+    # with the result from white's point of view (1, -1 or 0). Reuses the
+    # legal move count of get_all_moves if it already ran in this position.
+    def outcome(self):
+        if self.num_legal is None:
+            self.get_all_moves()
+        if not self.num_legal:
+            if self.in_check():
+                return (-1 if self.white else 1), Termination.Checkmate
+            return 0, Termination.Stalemate
+        if self.is_insufficient_material():
+            return 0, Termination.InsufficientMaterial
+        if self.halfmoves >= 8 and self.is_repetition():
+            return 0, Termination.Repetition
+        if self.halfmoves >= HalfmoveLimit:
+            return 0, Termination.MoveRule
+        return None
+
+
+    # Given a legal packed move (or Move), applies the move on the chessboard.
     def make_move(self, move):
-        start = move.get_start()
-        end = move.get_end()
+        start = move & StartMask
+        end = move >> EndShift & StartMask
         startBB = 1 << start
         endBB = 1 << end
-        flags = move.get_flags()
-
-        start_color, start_piece = self.get_square_info(start)
-        end_color, end_piece = self.get_square_info(end)
-
-        self.board[start_color][start_piece] ^= startBB
-        self.board[start_color][start_piece] ^= endBB
-
-        if move.is_capture():
-            self.board[end_color][end_piece] ^= endBB
-            self.captured.append(end_piece)
-        else:
-            self.captured.append(None)
-
-        if move.is_prom():
+        moveBB = startBB | endBB
+        flags = move >> FlagsShift
+
+        info = self.mailbox[start]
+        color, piece = info
+        base = 6 * color
+        board = self.board
+        captured = None
+        keys = Zobrist.pieces[color]
+        key = self.key
+        scores = Evaluation.piece_square[color]
+        score = self.score
+
+        board[base + piece] ^= moveBB
+        self.occupancy[color] ^= moveBB
+        key ^= Zobrist.side ^ keys[piece][start] ^ keys[piece][end]
+        score += scores[piece][end] - scores[piece][start]
+
+        if flags & Flags.Capture:
+            other_color, captured = self.mailbox[end]
+            board[6 * other_color + captured] ^= endBB
+            self.occupancy[other_color] ^= endBB
+            self.counts[6 * other_color + captured] -= 1
+            key ^= Zobrist.pieces[other_color][captured][end]
+            score -= Evaluation.piece_square[other_color][captured][end]
+
+        if flags & 8:
             # remove pawn at end place
-            self.board[start_color][start_piece] ^= endBB
-            if flags == Flags.KnightProm or flags == Flags.KnightPromCap:
-                self.board[start_color][Piece.Knight] ^= endBB
-            elif flags == Flags.BishopProm or flags == Flags.BishopPromCap:
-                self.board[start_color][Piece.Bishop] ^= endBB
-            elif flags == Flags.RookProm or flags == Flags.RookPromCap:
-                self.board[start_color][Piece.Rook] ^= endBB
-            elif flags == Flags.QueenProm or flags == Flags.QueenPromCap:
-                self.board[start_color][Piece.Queen] ^= endBB
-
+            board[base + piece] ^= endBB
+            prom = PromPieces[flags & 3]
+            board[base + prom] ^= endBB
+            self.counts[base + piece] -= 1
+            self.counts[base + prom] += 1
+            key ^= keys[piece][end] ^ keys[prom][end]
+            score += scores[prom][end] - scores[piece][end]
+            info = PieceInfo[color][prom]
+
+        self.mailbox[start] = NoPiece
+        self.mailbox[end] = info
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+
+        self.undo.append((piece, captured, self.key, self.score, self.halfmoves))
+        self.key = key
+        self.score = score
+        self.keys.append(key)
+        self.halfmoves = 0 if flags or piece == Piece.Pawn else self.halfmoves + 1
+        self.num_legal = None
         self.moves.append(move)
+        self.move_count += 1
         self.white = not self.white
+        if len(self.moves) > self.history_cap:
+            self.trim_history()
 
+        if self.debug:
+            self.check_state()
 
-    # Undoes the last move that was made on the board.
+
+    # Undoes the last move that was made on the board. Does nothing at the
+    # position the board was set up in, and raises an IndexError if the move
+    # was dropped from a bounded history.
     def unmake_move(self):
         move = self.moves.pop()
         if move is None:
+            self.moves.append(None)
+            if self.move_count:
+                raise IndexError("move history was trimmed by history_limit")
             return
 
-        captured = self.captured.pop()
+        piece, captured, self.key, self.score, self.halfmoves = self.undo.pop()
+        self.keys.pop()
+        self.num_legal = None
+        self.move_count -= 1
 
-        start = move.get_start()
-        end = move.get_end()
+        start = move & StartMask
+        end = move >> EndShift & StartMask
         startBB = 1 << start
         endBB = 1 << end
-        flags = move.get_flags()
-        start_color, start_piece = self.get_square_info(end)
-        other_color = Color.White if start_color == Color.Black else Color.Black
+        moveBB = startBB | endBB
+        color, end_piece = self.mailbox[end]
+        base = 6 * color
+        board = self.board
+
+        # remove the piece standing on the end square, then replace the moved
+        # piece on the start square
+        board[base + end_piece] ^= endBB
+        board[base + piece] ^= startBB
+        self.occupancy[color] ^= moveBB
+        self.mailbox[start] = PieceInfo[color][piece]
+        if end_piece != piece:
+            self.counts[base + end_piece] -= 1
+            self.counts[base + piece] += 1
+
+        if captured is not None:
+            other_color = color ^ 1
+            board[6 * other_color + captured] ^= endBB
+            self.occupancy[other_color] ^= endBB
+            self.counts[6 * other_color + captured] += 1
+            self.mailbox[end] = PieceInfo[other_color][captured]
+        else:
+            self.mailbox[end] = NoPiece
+
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+        self.white = not self.white
 
-        # replace start piece and remove
-        self.board[start_color][start_piece] ^= startBB
-        self.board[start_color][start_piece] ^= endBB
+        if self.debug:
+            self.check_state()
 
-        if move.is_capture():
-            self.board[other_color][captured] ^= endBB
 
-        if move.is_prom():
-            # replace pawn at start
-            self.board[start_color][start_piece] ^= startBB
-            self.board[start_color][Piece.Pawn] ^= startBB
+    # Drops the oldest moves from the history, keeping the last
+    # history_limit of them.
+    def trim_history(self):
+        drop = len(self.moves) - 1 - (self.history_cap - 1) // 2
+        del self.moves[1:1 + drop]
+        del self.undo[1:1 + drop]
+        del self.keys[:drop]
+
+
+    # Keeps every move made from now on in the history, whatever the
+    # history limit, until release_history is called with the returned
+    # value. Searches and rollouts hold the history so that they can always
+    # unmake their way back to the root.
+    def hold_history(self):
+        cap = self.history_cap
+        self.history_cap = sys.maxsize
+        return cap
+
+
+    # Ends a hold_history, trimming the history back to the limit.
+    def release_history(self, cap):
+        self.history_cap = cap
+        if len(self.moves) > cap:
+            self.trim_history()
 
-        self.white = not self.white
+
+    # Returns the position as an immutable tuple of ints: the 12 piece
+    # bitboards, then the side to move, halfmove counter, Zobrist key and
+    # score. The move history is not included.
+    def snapshot(self):
+        return (*self.board, self.white, self.halfmoves, self.key, self.score)
+
+
+    # Sets the board to a position returned by snapshot. The key and score
+    # are taken from the snapshot rather than recomputed, and the move
+    # history starts afresh at the restored position.
+    def restore(self, snapshot):
+        self.board = list(snapshot[:12])
+        white, self.halfmoves, self.key, self.score = snapshot[12:]
+        self.white = bool(white)
+        self.init_piece_state()
+        self.move_count = 0
+        self.moves = [None]
+        self.undo = [None]
+        self.keys = [self.key]
+        self.num_legal = None
+
+
+    # Returns a new board in the same position, without the move history.
+    def clone(self):
+        board = MiniChessBoard.__new__(MiniChessBoard)
+        board.debug = self.debug
+        board.history_cap = self.history_cap
+        board.restore(self.snapshot())
+        return board
 
 
     ######################################
@@ -203,79 +600,84 @@ class MiniChessBoard():
     ######################################
 
 
-    # Gets all the pawn moves (ignoring captures) from a given square.
-    def get_pawn_sq_moves(self, sq, color):
-        moves = []
-        attacks = Bitboard.pawn_attacks[color][sq]
+    # Gets all the pawn moves from a given square and appends them to moves, a
+    # list or array('H') of packed moves, which is returned. Only moves ending
+    # on a square in mask are generated.
+    def get_pawn_sq_moves(self, sq, color, mask=Bitboard.full64, moves=None):
+        if moves is None:
+            moves = array('H')
+        attacks = Bitboard.pawn_attacks[color][sq] & self.occupancy[color ^ 1] & mask
         while attacks:
             end_sq = Bitboard.lsb(attacks)
-            # valid capture
-            if (abs(Bitboard.get_file(sq) - Bitboard.get_file(end_sq)) == 1
-                and self.get_square_piece(end_sq) != Piece.NONE
-                and self.get_square_color(end_sq) != color):
-                # promotion
-                if Bitboard.get_rank(end_sq) == 1 or Bitboard.get_rank(end_sq) == 5:
-                    moves.append(Move(sq, end_sq, Flags.KnightPromCap))
-                    moves.append(Move(sq, end_sq, Flags.BishopPromCap))
-                    moves.append(Move(sq, end_sq, Flags.RookPromCap))
-                    moves.append(Move(sq, end_sq, Flags.QueenPromCap))
-                else:
-                    moves.append(Move(sq, end_sq, Flags.Capture))
+            move = sq | end_sq << EndShift
+            # promotion
+            if end_sq < 5 or end_sq >= 20:
+                for bits in PromCapBits:
+                    moves.append(move | bits)
+            else:
+                moves.append(move | CaptureBits)
             attacks = Bitboard.pop_lsb(attacks)
-                    
 
         end_sq = sq + 5 if color == Color.White else sq - 5
         if (Bitboard.is_valid_square(end_sq) 
-            and self.get_square_piece(end_sq) == Piece.NONE):
-            if Bitboard.get_rank(end_sq) == 1 or Bitboard.get_rank(end_sq) == 5:
-                moves.append(Move(sq, end_sq, Flags.KnightProm))
-                moves.append(Move(sq, end_sq, Flags.BishopProm))
-                moves.append(Move(sq, end_sq, Flags.RookProm))
-                moves.append(Move(sq, end_sq, Flags.QueenProm))
+            and not Bitboard.is_set(self.occupied, end_sq)
+            and Bitboard.is_set(mask, end_sq)):
+            move = sq | end_sq << EndShift
+            if end_sq < 5 or end_sq >= 20:
+                for bits in PromBits:
+                    moves.append(move | bits)
             else:
-                moves.append(Move(sq, end_sq, Flags.Quiet))
+                moves.append(move)
 
         return moves
 
 
     # Given a starting square and a bitboard of ending squares and a color,
-    # returns a list of possible moves.
-    def get_piece_moves(self, sq, attacks, color):
-        moves = []
+    # appends the possible moves to moves, a list or array('H') of packed
+    # moves, which is returned.
+    def get_piece_moves(self, sq, attacks, color, moves=None):
+        if moves is None:
+            moves = array('H')
+        attacks &= ~self.occupancy[color]
+        captures = self.occupancy[color ^ 1]
         while attacks:
             end_sq = Bitboard.lsb(attacks)
-            end_sq_color = self.get_square_color(end_sq)
-            if end_sq_color == Color.NONE:
-                moves.append(Move(sq, end_sq, Flags.Quiet))
-            elif end_sq_color != color:
-                moves.append(Move(sq, end_sq, Flags.Capture))
+            if captures >> end_sq & 1:
+                moves.append(sq | end_sq << EndShift | CaptureBits)
+            else:
+                moves.append(sq | end_sq << EndShift)
                 
             attacks = Bitboard.pop_lsb(attacks)
 
         return moves
 
 
-    # Given a color and a piece, returns all moves that pieces of that color
-    # can make.
-    def get_moves(self, color, piece):
+    # Given a color and a piece, appends all moves that pieces of that color
+    # can make to moves and returns it. Moves are restricted to end on a
+    # square in mask, and pieces in pinned may only move along their ray in
+    # pin_rays.
+    def get_moves(self, color, piece, mask=Bitboard.full64, pinned=0, pin_rays=None,
+                  moves=None):
+        if moves is None:
+            moves = array('H')
         pieces = self.get_pieces(color, piece)
-        moves = []
         while pieces:
             sq = Bitboard.lsb(pieces)
+            sq_mask = pin_rays[sq] & mask if pinned >> sq & 1 else mask
             if piece == Piece.Pawn:
-                moves.extend(self.get_pawn_sq_moves(sq, color))
+                self.get_pawn_sq_moves(sq, color, sq_mask, moves)
             else:
                 if piece == Piece.Knight:
                     attacks = Bitboard.get_knight_attacks(sq)
                 elif piece == Piece.Bishop:
-                    attacks = Bitboard.get_bishop_attacks(sq, self.get_occupied())
+                    attacks = Bitboard.get_bishop_attacks(sq, self.occupied)
                 elif piece == Piece.Rook:
-                    attacks = Bitboard.get_rook_attacks(sq, self.get_occupied())
+                    attacks = Bitboard.get_rook_attacks(sq, self.occupied)
                 elif piece == Piece.Queen:
-                    attacks = Bitboard.get_queen_attacks(sq, self.get_occupied())
+                    attacks = Bitboard.get_queen_attacks(sq, self.occupied)
                 elif piece == Piece.King:
                     attacks = Bitboard.get_king_attacks(sq)
-                moves.extend(self.get_piece_moves(sq, attacks, color))
+                self.get_piece_moves(sq, attacks & sq_mask, color, moves)
 
             pieces = Bitboard.pop_lsb(pieces)
 
@@ -295,14 +697,162 @@ class MiniChessBoard():
         return legal
 
 
-    # Returns the list of all legal moves in a position.
-    def get_all_moves(self):
+    # Returns the check and pin information of the side to move as a tuple
+    # (checkers, check_mask, pinned, pin_rays). checkers holds the enemy
+    # pieces giving check, and check_mask the squares a non-king move must end
+    # on to answer it. pinned holds the pieces pinned to their king, and
+    # pin_rays maps each of their squares to the ray they may move along.
+    def get_check_info(self):
+        color = Color.White if self.white else Color.Black
+        other = color ^ 1
+        theirs = self.board[6 * other:6 * other + 6]
+        occupied = self.occupied
+        king_sq = Bitboard.lsb(self.board[6 * color + Piece.King])
+        bishops = theirs[Piece.Bishop] | theirs[Piece.Queen]
+        rooks = theirs[Piece.Rook] | theirs[Piece.Queen]
+
+        checkers = ((Bitboard.pawn_attacks[color][king_sq] & theirs[Piece.Pawn])
+                    | (Bitboard.knight_attacks[king_sq] & theirs[Piece.Knight])
+                    | (Bitboard.get_bishop_attacks(king_sq, occupied) & bishops)
+                    | (Bitboard.get_rook_attacks(king_sq, occupied) & rooks))
+        if not checkers:
+            check_mask = Bitboard.full64
+        elif not Bitboard.pop_lsb(checkers):
+            check_mask = Bitboard.between[king_sq][Bitboard.lsb(checkers)] | checkers
+        else:
+            check_mask = 0
+
+        # sliders that would attack the king if our own pieces were removed
+        pinned = 0
+        pin_rays = {}
+        snipers = ((Bitboard.get_bishop_attacks(king_sq, self.occupancy[other]) & bishops)
+                   | (Bitboard.get_rook_attacks(king_sq, self.occupancy[other]) & rooks))
+        while snipers:
+            sq = Bitboard.lsb(snipers)
+            blockers = Bitboard.between[king_sq][sq] & occupied
+            if blockers and not Bitboard.pop_lsb(blockers) and blockers & self.occupancy[color]:
+                pinned |= blockers
+                pin_rays[Bitboard.lsb(blockers)] = Bitboard.between[king_sq][sq] | (1 << sq)
+            snipers = Bitboard.pop_lsb(snipers)
+
+        return checkers, check_mask, pinned, pin_rays
+
+
+    # Appends the king moves of the side to move that do not end on an
+    # attacked square to moves and returns it. Only moves ending on a square
+    # in mask are generated. The enemy attack map sees through the king, so
+    # it cannot step back along a slider's line.
+    def get_king_moves(self, moves=None, mask=Bitboard.full64):
+        color = Color.White if self.white else Color.Black
+        king_sq = Bitboard.lsb(self.board[6 * color + Piece.King])
+        safe = Bitboard.get_king_attacks(king_sq) & ~self.attack_map(color ^ 1) & mask
+        return self.get_piece_moves(king_sq, safe, color, moves)
+
+
+    # Returns all legal moves in a position as an array('H') of packed moves.
+    # If moves is given, it is cleared and refilled instead, so one buffer
+    # can be reused across plies. Checks and pins are worked out once for
+    # the position, so only king moves need an attack test. The number of
+    # moves is kept for outcome.
+    def get_all_moves(self, moves=None):
+        if moves is None:
+            moves = array('H')
+        else:
+            del moves[:]
+        color = Color.White if self.white else Color.Black
+        checkers, check_mask, pinned, pin_rays = self.get_check_info()
+
+        # in double check only the king can move
+        if not Bitboard.pop_lsb(checkers):
+            for piece in (Piece.Pawn, Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen):
+                self.get_moves(color, piece, check_mask, pinned, pin_rays, moves)
+
+        self.get_king_moves(moves)
+        self.num_legal = len(moves)
+        return moves
+
+
+    # Appends the legal moves of the piece on sq, of the side to move, to
+    # moves and returns it, given the position's check information.
+    def get_square_moves(self, sq, check_info, moves):
+        color, piece = self.mailbox[sq]
+        checkers, check_mask, pinned, pin_rays = check_info
+        if piece == Piece.King:
+            self.get_king_moves(moves)
+        elif not Bitboard.pop_lsb(checkers):
+            mask = pin_rays[sq] & check_mask if pinned >> sq & 1 else check_mask
+            if piece == Piece.Pawn:
+                self.get_pawn_sq_moves(sq, color, mask, moves)
+            else:
+                if piece == Piece.Knight:
+                    attacks = Bitboard.get_knight_attacks(sq)
+                elif piece == Piece.Bishop:
+                    attacks = Bitboard.get_bishop_attacks(sq, self.occupied)
+                elif piece == Piece.Rook:
+                    attacks = Bitboard.get_rook_attacks(sq, self.occupied)
+                else:
+                    attacks = Bitboard.get_queen_attacks(sq, self.occupied)
+                self.get_piece_moves(sq, attacks & mask, color, moves)
+
+        return moves
+
+
+    # Yields the legal moves of the position in stages: the hash move if it
+    # is legal, then captures and promotions, most valuable victim first,
+    # then quiet moves, sorted by quiet_key (highest first) if given. Each
+    # stage is generated only once the previous one is used up, so a search
+    # that cuts off early never generates the rest. With quiets off only the
+    # first two stages are produced.
+    def gen_staged_moves(self, hash_move=0, quiet_key=None, quiets=True):
         color = Color.White if self.white else Color.Black
-        moves = self.get_moves(color, Piece.Pawn)
-        moves.extend(self.get_moves(color, Piece.Knight))
-        moves.extend(self.get_moves(color, Piece.Bishop))
-        moves.extend(self.get_moves(color, Piece.Rook))
-        moves.extend(self.get_moves(color, Piece.Queen))
-        moves.extend(self.get_moves(color, Piece.King))
-
-        return [move for move in moves if self.is_legal(move)]
+        check_info = self.get_check_info()
+        checkers, check_mask, pinned, pin_rays = check_info
+        double_check = Bitboard.pop_lsb(checkers)
+
+        if hash_move:
+            start = hash_move & StartMask
+            if (start < 25 and self.mailbox[start][0] == color
+                    and hash_move in self.get_square_moves(start, check_info, [])):
+                yield hash_move
+
+        them = self.occupancy[color ^ 1]
+        tactical = self.get_king_moves([], them)
+        if not double_check:
+            self.get_moves(color, Piece.Pawn, check_mask & (them | PromotionRanks), pinned, pin_rays,
+                           tactical)
+            for piece in (Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen):
+                self.get_moves(color, piece, check_mask & them, pinned, pin_rays, tactical)
+
+        mailbox = self.mailbox
+        if len(tactical) > 1:
+            # most valuable victim first, then least valuable attacker
+            tactical.sort(key=lambda move: capture_order(mailbox, move), reverse=True)
+        for move in tactical:
+            if move != hash_move:
+                yield move
+
+        if not quiets:
+            return
+        quiet = self.get_king_moves([], ~self.occupied)
+        if not double_check:
+            empty = check_mask & ~self.occupied
+            self.get_moves(color, Piece.Pawn, empty & ~PromotionRanks, pinned, pin_rays, quiet)
+            for piece in (Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen):
+                self.get_moves(color, piece, empty, pinned, pin_rays, quiet)
+        if quiet_key is not None:
+            quiet.sort(key=quiet_key, reverse=True)
+        for move in quiet:
+            if move != hash_move:
+                yield move
+
+
+    # Returns all legal moves in a position by making every pseudo-legal move
+    # and testing whether it leaves the king in check. Kept as a slow
+    # reference for get_all_moves.
+    def get_all_moves_filtered(self):
+        color = Color.White if self.white else Color.Black
+        moves = array('H')
+        for piece in (Piece.Pawn, Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen, Piece.King):
+            self.get_moves(color, piece, moves=moves)
+
+        return array('H', [move for move in moves if self.is_legal(move)])
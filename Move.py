@@ -1,6 +1,50 @@
 from Enums import *
 
 
+# Moves are packed into a single int: bits 0-4 hold the start square, bits
+# 5-9 the end square and bits 10-13 the Flags. Move generation and the board
+# work on packed moves directly; the Move class is a view for the API edge.
+StartMask = 0x1f
+EndShift = 5
+FlagsShift = 10
+
+# Flags shifted into place, for building packed moves without enum lookups.
+QuietBits = Flags.Quiet << FlagsShift
+CaptureBits = Flags.Capture << FlagsShift
+PromBits = [Flags.KnightProm << FlagsShift, Flags.BishopProm << FlagsShift,
+            Flags.RookProm << FlagsShift, Flags.QueenProm << FlagsShift]
+PromCapBits = [Flags.KnightPromCap << FlagsShift, Flags.BishopPromCap << FlagsShift,
+               Flags.RookPromCap << FlagsShift, Flags.QueenPromCap << FlagsShift]
+
+# The piece a promotion flag promotes to, indexed by the flag's low two bits.
+PromPieces = [Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen]
+
+
+# Packs a start square, end square and flags into a move.
+def encode_move(start, end, flags):
+    return start | end << EndShift | flags << FlagsShift
+
+
+# Returns the start square of a packed move.
+def move_start(move):
+    return move & StartMask
+
+
+# Returns the end square of a packed move.
+def move_end(move):
+    return move >> EndShift & StartMask
+
+
+# Returns the flags of a packed move.
+def move_flags(move):
+    return move >> FlagsShift
+
+
+# Returns the piece a promotion promotes to.
+def prom_piece(move):
+    return PromPieces[move >> FlagsShift & 3]
+
+
 # Returns the piece's letter code given a promotion flag
 def get_piece(flag):
     if flag == Flags.KnightProm or flag == Flags.KnightPromCap:
@@ -14,12 +58,38 @@ def get_piece(flag):
     else:
         return ""
 
-# Represents a move on a chess board.
-class Move:
-    def __init__(self, start, end, flags):
-        self.start = start
-        self.end = end
-        self.flags = flags
+
+# Returns the notation of a packed move, such as "a2a3", "b3xc4" or "a4a5Q".
+def move_str(move):
+    start = Square(move & StartMask).name
+    end = Square(move >> EndShift & StartMask).name
+    flags = move >> FlagsShift
+    cap = "x" if flags & Flags.Capture else ""
+    return start + cap + end + get_piece(flags)
+
+
+# Represents a move on a chess board. A Move is a packed move, so it can be
+# passed anywhere a packed move is expected; Move(packed) wraps a packed move
+# and Move(start, end, flags) packs one.
+class Move(int):
+    __slots__ = ()
+
+    def __new__(cls, start, end=None, flags=None):
+        if end is None:
+            return int.__new__(cls, start)
+        return int.__new__(cls, encode_move(start, end, flags))
+
+    @property
+    def start(self):
+        return self & StartMask
+
+    @property
+    def end(self):
+        return self >> EndShift & StartMask
+
+    @property
+    def flags(self):
+        return Flags(self >> FlagsShift)
 
     def get_start(self):
         return self.start
@@ -31,13 +101,13 @@ class Move:
         return self.flags
 
     def is_capture(self):
-        return self.flags & 4
+        return self >> FlagsShift & Flags.Capture
 
     def is_prom(self):
-        return self.flags & 8
+        return self >> FlagsShift & 8
 
     def __str__(self):
-        start = Square(self.start).name
-        end = Square(self.end).name
-        cap = "x" if self.is_capture() else ""
-        return start + cap + end + get_piece(self.flags)
+        return move_str(self)
+
+    def __repr__(self):
+        return "Move(" + move_str(self) + ")"
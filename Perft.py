@@ -0,0 +1,173 @@
+from MiniChessBoard import MiniChessBoard, StartFen
+from Move import move_str
+from TranspositionTable import TranspositionTable
+from multiprocessing import Pool
+import Instrument
+import argparse
+import sys
+import time
+
+
+# Reference positions as (name, FEN, [perft(1), perft(2), ...]). The counts
+# were checked against an independent mailbox move generator and include
+# promotions to knight, bishop, rook and queen.
+Positions = [
+    ("start", StartFen,
+     [7, 53, 506, 4775, 52512, 572874]),
+    ("promotions", "1r2k/P1P2/5/2p1p/K3R w",
+     [21, 177, 2252, 24040, 297781]),
+    ("black promotions", "k4/4P/1n3/p3p/R3K b",
+     [8, 70, 599, 5802, 54752]),
+    ("captures into check", "4k/1p3/1Pq2/2K2/5 w",
+     [2, 30, 65, 809, 1873]),
+    ("file pin", "4r/k1p2/5/3PB/2N1K w",
+     [5, 63, 411, 3992, 31617]),
+    ("diagonal pins", "r3k/1P3/5/b2p1/KR2q w",
+     [12, 156, 1315, 21168, 186388]),
+    ("double check", "2k2/p1P1P/1r1P1/p1n2/K3r w",
+     [1, 22, 101, 1112, 6027]),
+    ("open lines", "1k3/2q2/5/1B1N1/K1R2 w",
+     [15, 210, 2492, 29206, 342764]),
+]
+
+
+# Counts the leaf nodes of the legal move tree below a position. If a
+# transposition table is given, subtree counts are cached by Zobrist key.
+def perft(board, depth, tt=None):
+    if depth == 0:
+        return 1
+
+    if tt is not None and depth > 1:
+        entry = tt.probe(board.key)
+        if entry is not None and entry[0] == depth:
+            return entry[2]
+
+    moves = board.get_all_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1, tt)
+        board.unmake_move()
+
+    if tt is not None:
+        tt.store(board.key, depth, nodes)
+
+    return nodes
+
+
+# Transposition table of the current worker process, if caching is enabled.
+_worker_tt = None
+
+
+def _init_worker(hash_mb):
+    global _worker_tt
+    _worker_tt = TranspositionTable(hash_mb) if hash_mb else None
+
+
+# Counts the nodes below one root move. Moves are sent to workers by their
+# index in the root move list, so only the FEN has to be pickled.
+def _perft_root_move(args):
+    fen, index, depth = args
+    board = MiniChessBoard(fen)
+    board.make_move(board.get_all_moves()[index])
+    return perft(board, depth - 1, _worker_tt)
+
+
+# Returns a list of (move, nodes) pairs giving the perft count below each root
+# move. With more than one process the root moves are split across a pool.
+def divide(board, depth, processes=1, hash_mb=0):
+    moves = board.get_all_moves()
+    if depth < 1:
+        return []
+
+    if processes > 1:
+        fen = board.get_fen()
+        tasks = [(fen, i, depth) for i in range(len(moves))]
+        with Pool(processes, _init_worker, (hash_mb,)) as pool:
+            counts = pool.map(_perft_root_move, tasks, chunksize=1)
+    else:
+        tt = TranspositionTable(hash_mb) if hash_mb else None
+        counts = []
+        for move in moves:
+            board.make_move(move)
+            counts.append(perft(board, depth - 1, tt))
+            board.unmake_move()
+
+    return list(zip(moves, counts))
+
+
+# Runs perft on a board and returns (nodes, seconds).
+def run(board, depth, processes=1, hash_mb=0):
+    start = time.perf_counter()
+    if processes > 1:
+        nodes = sum(n for m, n in divide(board, depth, processes, hash_mb))
+    else:
+        tt = TranspositionTable(hash_mb) if hash_mb else None
+        nodes = perft(board, depth, tt)
+
+    return nodes, time.perf_counter() - start
+
+
+def format_rate(nodes, seconds):
+    return "{:,} nodes in {:.3f}s ({:,.0f} nps)".format(
+        nodes, seconds, nodes / seconds if seconds > 0 else 0)
+
+
+# Runs every reference position up to the given depth. Returns True if all
+# counts match.
+def run_suite(depth, processes=1, hash_mb=0):
+    passed = True
+    total_nodes = 0
+    total_time = 0
+    for name, fen, counts in Positions:
+        for d in range(1, min(depth, len(counts)) + 1):
+            nodes, seconds = run(MiniChessBoard(fen), d, processes, hash_mb)
+            total_nodes += nodes
+            total_time += seconds
+            ok = nodes == counts[d - 1]
+            passed = passed and ok
+            print("{:<20} depth {} {:>10,} {}".format(
+                name, d, nodes, "ok" if ok else "FAIL (expected {:,})".format(counts[d - 1])))
+
+    print("total: " + format_rate(total_nodes, total_time))
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Counts leaf nodes of the legal move tree.")
+    parser.add_argument("depth", type=int, nargs="?", default=5)
+    parser.add_argument("--fen", default=StartFen, help="position to search")
+    parser.add_argument("--divide", action="store_true",
+                        help="print the node count below each root move")
+    parser.add_argument("--suite", action="store_true",
+                        help="check the reference positions up to depth")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="split root moves across this many processes")
+    parser.add_argument("--hash", type=int, default=0, metavar="MB",
+                        help="size of the perft cache per process (0 disables)")
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+
+    if args.suite:
+        return 0 if run_suite(args.depth, args.processes, args.hash) else 1
+
+    board = MiniChessBoard(args.fen)
+    if args.divide:
+        start = time.perf_counter()
+        results = divide(board, args.depth, args.processes, args.hash)
+        seconds = time.perf_counter() - start
+        for move, nodes in results:
+            print("{}: {}".format(move_str(move), nodes))
+        nodes = sum(n for m, n in results)
+    else:
+        nodes, seconds = run(board, args.depth, args.processes, args.hash)
+
+    print("depth {}: {}".format(args.depth, format_rate(nodes, seconds)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
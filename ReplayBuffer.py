@@ -0,0 +1,142 @@
+from Encoder import encode_bitboards, new_buffer
+import ActionSpace
+import numpy as np
+import os
+import struct
+
+
+# A replay buffer file starts with a header holding the capacity and, kept
+# up to date in place, the next slot to write and the number of samples.
+# The sample arrays follow, each aligned to 64 bytes. Bump ReplayVersion
+# whenever the layout changes.
+ReplayTag = b"MCREPLAY"
+ReplayVersion = 1
+ReplayHeader = struct.Struct("<8sIIQ")
+ReplayHeaderSize = 64
+
+# Order of the 12 bitboards with the colors swapped.
+SwappedColors = np.r_[6:12, 0:6]
+
+
+# Returns 25-bit bitboards with their ranks mirrored, so that rank 1 becomes
+# rank 5.
+def mirror_ranks(bitboards):
+    rank = np.uint32(0x1f)
+    mirrored = np.zeros_like(bitboards)
+    for r in range(5):
+        mirrored |= ((bitboards >> np.uint32(5 * r)) & rank) << np.uint32(5 * (4 - r))
+    return mirrored
+
+
+# Returns positions, given as (N, 12) bitboards and (N,) side to move, as
+# seen by the other color: ranks mirrored, colors swapped and the other side
+# to move.
+def flip_colors(bitboards, white):
+    return mirror_ranks(bitboards[:, SwappedColors]), ~white
+
+
+# Fixed-capacity ring buffer of training samples in a memory-mapped file.
+# Each sample is a position as the 12 MiniChessBoard.board bitboards and the
+# side to move, a policy over the canonical action space and a value for the
+# side to move. The file is reopened as is after a restart.
+class ReplayBuffer():
+    def __init__(self, path, capacity=None):
+        self.path = path
+        if not os.path.exists(path):
+            if capacity is None:
+                raise ValueError("capacity is needed to create a replay buffer")
+            self.create(path, capacity)
+
+        with open(path, "rb") as f:
+            tag, version, actions, self.capacity = ReplayHeader.unpack(f.read(ReplayHeader.size))
+        if tag != ReplayTag or version != ReplayVersion or actions != ActionSpace.NumActions:
+            raise ValueError("not a version {} replay buffer: {}".format(ReplayVersion, path))
+        if capacity is not None and capacity != self.capacity:
+            raise ValueError("replay buffer {} has capacity {}".format(path, self.capacity))
+
+        self.counters = np.memmap(path, np.uint64, "r+", ReplayHeader.size, (2,))
+        offset = ReplayHeaderSize
+        for field, dtype, shape in self.fields(self.capacity):
+            setattr(self, field, np.memmap(path, dtype, "r+", offset, shape))
+            offset += -(-np.dtype(dtype).itemsize * int(np.prod(shape)) // 64) * 64
+
+
+    @staticmethod
+    def fields(capacity):
+        return [("bitboards", np.uint32, (capacity, 12)),
+                ("white", np.bool_, (capacity,)),
+                ("policies", np.float16, (capacity, ActionSpace.NumActions)),
+                ("values", np.float32, (capacity,))]
+
+
+    @staticmethod
+    def create(path, capacity):
+        size = ReplayHeaderSize
+        for field, dtype, shape in ReplayBuffer.fields(capacity):
+            size += -(-np.dtype(dtype).itemsize * int(np.prod(shape)) // 64) * 64
+        with open(path, "wb") as f:
+            f.write(ReplayHeader.pack(ReplayTag, ReplayVersion, ActionSpace.NumActions, capacity))
+            f.truncate(size)
+
+
+    def __len__(self):
+        return int(self.counters[1])
+
+
+    # Appends samples, overwriting the oldest once the buffer is full.
+    # bitboards is (N, 12), white (N,), policies (N, NumActions) over
+    # canonical actions and values (N,).
+    def add(self, bitboards, white, policies, values):
+        n = len(values)
+        head = int(self.counters[0])
+        if n > self.capacity:
+            bitboards, white, policies, values = [a[-self.capacity:] for a in (bitboards, white, policies, values)]
+            head = (head + n - self.capacity) % self.capacity
+            n = self.capacity
+        slots = (head + np.arange(n)) % self.capacity
+        self.bitboards[slots] = bitboards
+        self.white[slots] = white
+        self.policies[slots] = policies
+        self.values[slots] = values
+        self.counters[0] = (head + n) % self.capacity
+        self.counters[1] = min(len(self) + n, self.capacity)
+
+
+    # Appends the positions of one game from the start position, given as
+    # (plies, 12) bitboards, with their policies and the result from white's
+    # point of view.
+    def add_game(self, bitboards, policies, result):
+        white = np.arange(len(bitboards)) % 2 == 0
+        self.add(bitboards, white, policies, np.where(white, result, -result))
+
+
+    # Draws batch_size samples uniformly and returns (planes, policies,
+    # values), with the planes written into out if given. With augment set,
+    # each sample is color-flipped with probability one half. Canonical
+    # planes look the same after a flip, so augmentation only matters when
+    # canonical is off; policies are then mapped to actual actions.
+    def sample(self, batch_size, rng, canonical=True, augment=False, out=None):
+        if not len(self):
+            raise ValueError("replay buffer is empty")
+        indices = np.sort(rng.integers(0, len(self), batch_size))
+        bitboards = self.bitboards[indices]
+        white = self.white[indices]
+        if augment:
+            flip = rng.random(batch_size) < 0.5
+            bitboards[flip], white[flip] = flip_colors(bitboards[flip], white[flip])
+
+        policies = self.policies[indices].astype(np.float32)
+        if canonical:
+            bitboards = np.where(white[:, None], bitboards, bitboards[:, SwappedColors])
+        else:
+            policies = np.where(white[:, None], policies, policies[:, ActionSpace.FlippedActions])
+
+        if out is None:
+            out = new_buffer(batch_size)
+        encode_bitboards(bitboards, white, out, canonical)
+        return out, policies, self.values[indices].copy()
+
+
+    def flush(self):
+        for array in (self.counters, self.bitboards, self.white, self.policies, self.values):
+            array.flush()
@@ -0,0 +1,147 @@
+from Bitboard import Bitboard
+from Enums import *
+from MiniChessBoard import MiniChessBoard, StartFen, HalfmoveLimit
+from array import array
+from multiprocessing import Pool
+import Instrument
+import argparse
+import numpy as np
+import os
+import random
+import sys
+import time
+
+
+# Pieces in pseudo-legal generation order.
+RolloutPieces = (Piece.Pawn, Piece.Knight, Piece.Bishop, Piece.Rook, Piece.Queen, Piece.King)
+
+# Rollouts per task when a batch is split across processes.
+RolloutChunk = 256
+
+_rng = None
+_rng_pid = None
+
+
+# Returns a random.Random seeded once per process from the OS, so forked
+# workers do not share a sequence.
+def process_rng():
+    global _rng, _rng_pid
+    if _rng_pid != os.getpid():
+        _rng = random.Random(os.urandom(16))
+        _rng_pid = os.getpid()
+    return _rng
+
+
+# Plays uniformly random moves from the position of board until the game
+# ends or max_plies plies are played, and returns (result, plies) with the
+# result from white's point of view. The board is left unchanged, also
+# with a history_limit shorter than the rollout, since the history is held
+# while it plays.
+#
+# Moves are not generated legally. Each ply generates the pseudo-legal moves
+# without any check or pin analysis, samples one and plays it. If the
+# mover's king is left attacked, the move is unmade, dropped from the list
+# and another one is sampled. The accepted move is uniform over the legal
+# moves, and an empty list means mate or stalemate. Game end otherwise
+# follows board.outcome(), except that draws by material, repetition and
+# the move rule are checked before mate.
+def rollout(board, rng=None, max_plies=256, moves=None):
+    uniform = (rng or process_rng()).random
+    if moves is None:
+        moves = array('H')
+    root = board.move_count
+    cap = board.hold_history()
+    try:
+        result = _play_rollout(board, uniform, max_plies, moves)
+        plies = board.move_count - root
+    finally:
+        while board.move_count > root:
+            board.unmake_move()
+        board.release_history(cap)
+    return result, plies
+
+
+# Plays the moves of a rollout, leaving them on the board, and returns the
+# result from white's point of view.
+def _play_rollout(board, uniform, max_plies, moves):
+    result = 0
+    for ply in range(max_plies):
+        if (board.is_insufficient_material() or board.halfmoves >= HalfmoveLimit
+                or board.halfmoves >= 8 and board.is_repetition()):
+            break
+
+        color = 0 if board.white else 1
+        del moves[:]
+        for piece in RolloutPieces:
+            board.get_moves(color, piece, moves=moves)
+
+        n = len(moves)
+        while n:
+            i = int(uniform() * n)
+            board.make_move(moves[i])
+            if not board.attacked(color ^ 1, Bitboard.lsb(board.board[6 * color + Piece.King])):
+                break
+            board.unmake_move()
+            n -= 1
+            moves[i] = moves[n]
+
+        if not n:
+            if board.in_check():
+                result = -1 if board.white else 1
+            break
+
+    return result
+
+
+def _rollout_chunk(args):
+    board, count, seed, max_plies = args
+    rng = process_rng() if seed is None else random.Random(seed)
+    results = np.zeros(count, dtype=np.int8)
+    plies = np.zeros(count, dtype=np.int32)
+    moves = array('H')
+    for i in range(count):
+        results[i], plies[i] = rollout(board, rng, max_plies, moves)
+    return results, plies
+
+
+# Runs count rollouts from the position of board and returns their results
+# and ply counts as arrays. With a seed the rollouts are reproducible for any
+# number of processes, since each chunk of RolloutChunk games gets its own
+# seed derived from it.
+def rollouts(board, count, seed=None, max_plies=256, processes=1):
+    tasks = [(board, min(RolloutChunk, count - i), None if seed is None else seed * 1000003 + i, max_plies)
+             for i in range(0, count, RolloutChunk)]
+    if processes > 1:
+        with Pool(processes) as pool:
+            parts = pool.map(_rollout_chunk, tasks)
+    else:
+        parts = [_rollout_chunk(task) for task in tasks]
+    if not parts:
+        return np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int32)
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays random rollouts from a position.")
+    parser.add_argument("games", type=int, nargs="?", default=10000)
+    parser.add_argument("--fen", default=StartFen)
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--max-plies", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+
+    board = MiniChessBoard(args.fen)
+    start = time.perf_counter()
+    results, plies = rollouts(board, args.games, args.seed, args.max_plies, args.processes)
+    seconds = time.perf_counter() - start
+    print("{:,} games, {:,} plies in {:.2f}s: {:,.1f} games/s, {:,.0f} plies/s".format(
+        args.games, int(plies.sum()), seconds, args.games / seconds, plies.sum() / seconds))
+    print("white wins {}, draws {}, black wins {}, mean length {:.1f} plies".format(
+        int((results == 1).sum()), int((results == 0).sum()), int((results == -1).sum()),
+        plies.mean() if len(plies) else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+from MiniChessBoard import MiniChessBoard
+from array import array
+from multiprocessing import shared_memory
+import Instrument
+import MCTS
+import argparse
+import multiprocessing as mp
+import numpy as np
+import os
+import sys
+import time
+
+
+# Plays one game on a fresh board and returns (moves, result, positions):
+# the packed moves as an array('H'), the result from white's point of view
+# (1, -1 or 0) and, if record_positions is set, the 12 bitboards of every
+# position before a move as a list of lists. Games end as board.outcome()
+# rules, or are drawn at max_plies. With simulations set moves are chosen by
+# MCTS with root noise, sampled by visit count for the first
+# temperature_plies plies and greedily after; otherwise they are uniformly
+# random.
+def play_game(rng, search=None, simulations=0, temperature_plies=8, max_plies=256,
+              record_positions=False):
+    board = MiniChessBoard()
+    positions = []
+    moves = board.get_all_moves()
+    while board.outcome() is None and board.move_count < max_plies:
+        if record_positions:
+            positions.append(board.board[:])
+        if search is not None and simulations:
+            search.search(board, simulations, rng)
+            temperature = 1.0 if board.move_count < temperature_plies else 0.0
+            board.make_move(search.select_move(temperature, rng))
+            search.advance(board)
+        else:
+            board.make_move(moves[rng.integers(len(moves))])
+        moves = board.get_all_moves()
+
+    outcome = board.outcome()
+    result = 0 if outcome is None else outcome[0]
+
+    return array('H', board.moves[1:]), result, positions
+
+
+# Ring buffer of finished games in one shared memory block, written by the
+# self-play workers and read by the driver without pickling. Each slot holds
+# a game's moves, result and optionally its positions as bitboards, plus a
+# sequence number marking which game the slot holds once it is complete.
+class GameBuffer():
+    def __init__(self, capacity, max_plies, positions=False, name=None):
+        self.capacity = capacity
+        self.max_plies = max_plies
+        self.positions = positions
+        fields = [("seq", np.int64, ()), ("length", np.int32, ()), ("result", np.int32, ()),
+                  ("worker", np.int32, ()), ("moves", np.uint16, (max_plies,))]
+        if positions:
+            fields.append(("bitboards", np.uint32, (max_plies, 12)))
+
+        layout = []
+        size = 0
+        for field, dtype, shape in fields:
+            layout.append((field, dtype, (capacity,) + shape, size))
+            size += np.dtype(dtype).itemsize * capacity * int(np.prod(shape, dtype=np.int64))
+            size += -size % 8
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        for field, dtype, shape, offset in layout:
+            setattr(self, field, np.ndarray(shape, dtype, self.shm.buf, offset))
+        if name is None:
+            self.seq[:] = 0
+
+
+    # Returns the arguments that attach another process to the buffer.
+    def spec(self):
+        return self.capacity, self.max_plies, self.positions, self.name
+
+
+    # Writes game number index into its slot and marks it complete.
+    def write(self, index, worker, moves, result, positions):
+        slot = index % self.capacity
+        length = min(len(moves), self.max_plies)
+        self.length[slot] = length
+        self.result[slot] = result
+        self.worker[slot] = worker
+        self.moves[slot, :length] = np.frombuffer(moves, dtype=np.uint16)[:length]
+        if self.positions:
+            self.bitboards[slot, :length] = np.array(positions[:length], dtype=np.uint32).reshape(-1, 12)
+        self.seq[slot] = index + 1
+
+
+    # Returns whether game number index is complete in its slot.
+    def ready(self, index):
+        return self.seq[index % self.capacity] == index + 1
+
+
+    # Copies game number index out of its slot as (moves, result, bitboards).
+    def read(self, index):
+        slot = index % self.capacity
+        length = self.length[slot]
+        bitboards = self.bitboards[slot, :length].copy() if self.positions else None
+        return self.moves[slot, :length].copy(), int(self.result[slot]), bitboards
+
+
+    def close(self, unlink=False):
+        for field in ["seq", "length", "result", "worker", "moves", "bitboards"]:
+            self.__dict__.pop(field, None)
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+# Shared counters and semaphores of a self-play run. started counts games
+# handed to workers, written counts slots claimed, and free and filled count
+# the empty and complete slots of the buffer.
+class SyncState():
+    def __init__(self, capacity, workers):
+        self.lock = mp.Lock()
+        self.started = mp.RawValue("q", 0)
+        self.written = mp.RawValue("q", 0)
+        self.free = mp.Semaphore(capacity)
+        self.filled = mp.Semaphore(0)
+        # per worker: games, plies, busy seconds, seconds waiting for a slot
+        self.stats = mp.RawArray("d", 4 * workers)
+
+
+# Body of a self-play worker process. Plays games until total have been
+# started and writes them into the shared buffer.
+def _worker(worker, total, spec, sync, config):
+    games = GameBuffer(*spec[:3], name=spec[3])
+    rng = np.random.default_rng([config["seed"], worker])
+    search = None
+    if config["simulations"]:
+        search = MCTS.MCTS(MCTS.UniformEvaluator(), batch_size=config["batch_size"])
+    stats = np.frombuffer(sync.stats, dtype=np.float64).reshape(-1, 4)[worker]
+
+    while True:
+        with sync.lock:
+            if sync.started.value >= total:
+                break
+            sync.started.value += 1
+
+        start = time.perf_counter()
+        moves, result, positions = play_game(rng, search, config["simulations"],
+                                             config["temperature_plies"], games.max_plies,
+                                             games.positions)
+        busy = time.perf_counter()
+        sync.free.acquire()
+        with sync.lock:
+            index = sync.written.value
+            sync.written.value += 1
+        stats[3] += time.perf_counter() - busy
+        games.write(index, worker, moves, result, positions)
+        sync.filled.release()
+        stats[0] += 1
+        stats[1] += len(moves)
+        stats[2] += busy - start
+
+    games.close()
+
+
+# Generates self-play games in a pool of worker processes. Iterating yields
+# (moves, result, bitboards) for each finished game: the packed moves as a
+# uint16 array, the result from white's point of view and, if positions is
+# set, the (plies, 12) bitboards of each position before a move. Use as a
+# context manager so the workers and shared memory are always cleaned up.
+class SelfPlay():
+    def __init__(self, games, workers=None, simulations=0, batch_size=8, temperature_plies=8,
+                 max_plies=256, capacity=64, positions=False, seed=0):
+        self.total = games
+        self.workers = workers or os.cpu_count()
+        self.config = {"simulations": simulations, "batch_size": batch_size,
+                       "temperature_plies": temperature_plies, "seed": seed}
+        self.buffer = GameBuffer(capacity, max_plies, positions)
+        self.sync = SyncState(capacity, self.workers)
+        self.processes = []
+        self.read = 0
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for worker in range(self.workers):
+            process = mp.Process(target=_worker, daemon=True,
+                                 args=(worker, self.total, self.buffer.spec(), self.sync, self.config))
+            process.start()
+            self.processes.append(process)
+
+
+    def __iter__(self):
+        while self.read < self.total:
+            while not self.buffer.ready(self.read):
+                if not self.sync.filled.acquire(timeout=0.1) and \
+                        not any(process.is_alive() for process in self.processes):
+                    raise RuntimeError("self-play workers exited before finishing")
+            game = self.buffer.read(self.read)
+            self.read += 1
+            self.sync.free.release()
+            yield game
+        self.end_time = time.perf_counter()
+
+
+    # Returns the games and plies per second of the run so far, and each
+    # worker's utilization: the share of wall time spent playing games
+    # rather than waiting for a free slot or idling.
+    def stats(self):
+        seconds = getattr(self, "end_time", time.perf_counter()) - self.start_time
+        workers = np.frombuffer(self.sync.stats, dtype=np.float64).reshape(-1, 4)
+        return {
+            "games": self.read,
+            "plies": int(workers[:, 1].sum()),
+            "seconds": seconds,
+            "games_per_second": self.read / seconds,
+            "plies_per_second": workers[:, 1].sum() / seconds,
+            "utilization": (workers[:, 2] / seconds).tolist(),
+            "wait_seconds": workers[:, 3].tolist(),
+        }
+
+
+    def close(self):
+        for process in self.processes:
+            if self.read < self.total:
+                process.terminate()
+            process.join()
+        self.processes = []
+        self.buffer.close(unlink=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates self-play games.")
+    parser.add_argument("games", type=int, nargs="?", default=200)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--simulations", type=int, default=0,
+                        help="MCTS simulations per move with a uniform evaluator (0 plays randomly)")
+    parser.add_argument("--max-plies", type=int, default=256)
+    parser.add_argument("--positions", action="store_true", help="record the positions of each game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+
+    results = [0, 0, 0]
+    with SelfPlay(args.games, args.workers, args.simulations, max_plies=args.max_plies,
+                  positions=args.positions, seed=args.seed) as games:
+        for moves, result, bitboards in games:
+            results[result + 1] += 1
+        stats = games.stats()
+
+    print("{} games, {:,} plies in {:.2f}s: {:.1f} games/s, {:,.0f} plies/s".format(
+        stats["games"], stats["plies"], stats["seconds"], stats["games_per_second"],
+        stats["plies_per_second"]))
+    print("white wins {}, draws {}, black wins {}".format(results[2], results[1], results[0]))
+    for worker, (used, wait) in enumerate(zip(stats["utilization"], stats["wait_seconds"])):
+        print("worker {:>2}: {:5.1f}% busy, {:.2f}s waiting for a slot".format(worker, 100 * used, wait))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+from Bitboard import Bitboard
+from Enums import *
+from MiniChessBoard import MiniChessBoard
+from Move import *
+from multiprocessing import Pool
+import Instrument
+import argparse
+import numpy as np
+import os
+import struct
+import sys
+import time
+
+
+# Endgame tablebases built by retrograde analysis. A table covers one
+# material signature, such as "KQvK" or "KPvKN", and stores for every
+# position the result for the side to move (WDL: 1 win, 0 draw, -1 loss)
+# and the distance to mate in plies (DTM). Positions are indexed perfectly
+# by piece placement:
+#   index = side * 25^k + sum(square_i * 25^i)
+# over the k pieces in signature order, white before black and kings,
+# queens, rooks, bishops, knights, pawns in that order, with side 0 when
+# white is to move. Indexes of impossible placements are stored as draws.
+# Games are scored as MCTS scores them: mate and stalemate first, then
+# insufficient material. There is no move-count rule.
+# Bump TablebaseVersion whenever the layout changes.
+TablebaseTag = b"MCTBASE\0"
+TablebaseVersion = 1
+TablebaseHeader = struct.Struct("<8sII16sQ")
+TablebasePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+
+# Piece types in signature order, and their letters.
+SignatureOrder = [Piece.King, Piece.Queen, Piece.Rook, Piece.Bishop, Piece.Knight, Piece.Pawn]
+PieceLetters = "PNBRQK"
+
+
+# Returns the signature name of a list of (color, piece) pairs.
+def signature_name(pieces):
+    sides = ["", ""]
+    for color, piece in sorted(pieces, key=lambda cp: (cp[0], SignatureOrder.index(cp[1]))):
+        sides[color] += PieceLetters[piece]
+    return sides[0] + "v" + sides[1]
+
+
+# Returns the (color, piece) pairs of a signature name in signature order.
+# Raises ValueError unless each side has exactly one king.
+def parse_signature(name):
+    sides = name.upper().split("V")
+    if len(sides) != 2 or any(side.count("K") != 1 for side in sides):
+        raise ValueError("invalid material signature: " + name)
+    pieces = []
+    for color, side in enumerate(sides):
+        for letter in side:
+            if letter not in PieceLetters:
+                raise ValueError("invalid piece in signature: " + letter)
+            pieces.append((color, PieceLetters.index(letter)))
+    return sorted(pieces, key=lambda cp: (cp[0], SignatureOrder.index(cp[1])))
+
+
+# Returns whether a signature is drawn by the insufficient material rule of
+# MiniChessBoard.is_insufficient_material.
+def insufficient(pieces):
+    for color in range(2):
+        types = [piece for c, piece in pieces if c == color]
+        if Piece.Pawn in types or Piece.Rook in types or Piece.Queen in types:
+            return False
+        knights = types.count(Piece.Knight)
+        bishops = types.count(Piece.Bishop)
+        if (bishops and knights) or bishops > 1 or knights > 2:
+            return False
+    return True
+
+
+# Returns the signature and index of a position given as a list of
+# (color, piece, square) triples and the side to move (0 for white).
+def position_index(placed, side):
+    placed = sorted(placed, key=lambda cps: (cps[0], SignatureOrder.index(cps[1])))
+    index = 0
+    for color, piece, sq in reversed(placed):
+        index = index * 25 + sq
+    return signature_name([(c, p) for c, p, sq in placed]), side * 25 ** len(placed) + index
+
+
+# Returns the signature and index of a board's position.
+def board_index(board):
+    placed = []
+    for color in range(2):
+        for piece in SignatureOrder:
+            pieces = board.board[6 * color + piece]
+            while pieces:
+                placed.append((color, piece, Bitboard.lsb(pieces)))
+                pieces = Bitboard.pop_lsb(pieces)
+    return position_index(placed, 0 if board.white else 1)
+
+
+# Returns the signatures reached from a signature by one capture or
+# promotion, which must be built first.
+def dependencies(pieces):
+    result = set()
+    for i, (color, piece) in enumerate(pieces):
+        if piece == Piece.King:
+            continue
+        result.add(signature_name(pieces[:i] + pieces[i + 1:]))
+        if piece == Piece.Pawn:
+            for prom in PromPieces:
+                promoted = pieces[:i] + [(color, prom)] + pieces[i + 1:]
+                result.add(signature_name(promoted))
+                # promotions that capture
+                for j, (other, captured) in enumerate(pieces):
+                    if other != color and captured != Piece.King:
+                        result.add(signature_name([cp for k, cp in enumerate(promoted) if k != j]))
+    return sorted(result)
+
+
+# Reads and memory-maps tablebase files on demand.
+class Tablebases():
+    def __init__(self, directory=TablebasePath):
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".mctb"):
+                    self.max_pieces = max(self.max_pieces, len(parse_signature(name[:-5])))
+
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".mctb")
+
+
+    # Returns the (wdl, dtm) arrays of a signature, or None if it has not
+    # been built.
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = load_table(self.path(name))
+        return self.tables[name]
+
+
+    # Returns (wdl, dtm) for the side to move of a position given by its
+    # signature and index, or None if the signature has no table.
+    def probe_index(self, name, index):
+        table = self.table(name)
+        if table is None:
+            return None
+        return int(table[0][index]), int(table[1][index])
+
+
+    # Returns (wdl, dtm) for the side to move of a board, or None if its
+    # material has no table.
+    def probe(self, board):
+        if Bitboard.popcount(board.occupied) > self.max_pieces:
+            return None
+        return self.probe_index(*board_index(board))
+
+
+    # Returns a move that keeps the best result by the tables, preferring
+    # the fastest win and the slowest loss, or None if the position has no
+    # table or no moves.
+    def best_move(self, board):
+        best = None
+        best_score = None
+        for move in board.get_all_moves():
+            board.make_move(move)
+            result = self.probe(board)
+            board.unmake_move()
+            if result is None:
+                return None
+            wdl, dtm = result
+            score = (-wdl, -dtm if wdl < 0 else dtm)
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return best
+
+
+# Memory-maps a table file. Returns (wdl, dtm) arrays, or None if the file is
+# missing or was written by another format version.
+def load_table(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        tag, version, dtm_bytes, name, count = TablebaseHeader.unpack(f.read(TablebaseHeader.size))
+    if tag != TablebaseTag or version != TablebaseVersion:
+        return None
+    offset = TablebaseHeader.size
+    wdl = np.memmap(path, np.int8, "r", offset, (count,))
+    offset += count + count % 2
+    dtm = np.memmap(path, np.uint8 if dtm_bytes == 1 else np.uint16, "r", offset, (count,))
+    return wdl, dtm
+
+
+# Writes a table file atomically, with one byte per DTM value if they fit.
+def write_table(path, name, wdl, dtm):
+    dtm = dtm.astype(np.uint8) if dtm.max(initial=0) < 256 else dtm.astype(np.uint16)
+    tmp = path + ".tmp" + str(os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(TablebaseHeader.pack(TablebaseTag, TablebaseVersion, dtm.itemsize,
+                                         name.encode(), len(wdl)))
+            f.write(wdl.astype(np.int8).tobytes())
+            f.write(bytes(len(wdl) % 2))
+            f.write(dtm.tobytes())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# Tables of earlier signatures in the current worker process.
+_worker_tables = None
+
+
+def _init_worker(directory):
+    global _worker_tables
+    _worker_tables = Tablebases(directory)
+
+
+# Generates the moves of the positions with indexes in [start, stop) of a
+# signature. Returns (valid, moves, check, internal, external): whether each
+# index is a legal position, its number of legal moves and whether the side
+# to move is in check, then the moves staying in the signature as
+# (parent, child) index arrays and the captures and promotions leaving it as
+# (parent, child wdl, child dtm) arrays.
+def _gen_edges(args):
+    name, start, stop = args
+    pieces = parse_signature(name)
+    k = len(pieces)
+    size = 25 ** k
+    powers = [25 ** i for i in range(k)]
+    board = MiniChessBoard()
+    valid = np.zeros(stop - start, dtype=bool)
+    counts = np.zeros(stop - start, dtype=np.int16)
+    checks = np.zeros(stop - start, dtype=bool)
+    parents = []
+    children = []
+    ext_parents = []
+    ext_results = []
+
+    for index in range(start, stop):
+        side, rest = divmod(index, size)
+        squares = []
+        for i in range(k):
+            rest, sq = divmod(rest, 25)
+            squares.append(sq)
+        if len(set(squares)) != k:
+            continue
+        if any(piece == Piece.Pawn and (sq < 5 or sq >= 20) for (color, piece), sq in zip(pieces, squares)):
+            continue
+
+        board.board = [0] * 12
+        for (color, piece), sq in zip(pieces, squares):
+            board.board[6 * color + piece] |= 1 << sq
+        board.white = not side
+        board.init_derived_state()
+        # the side that just moved must not be left in check
+        board.white = not board.white
+        illegal = board.in_check()
+        board.white = not board.white
+        if illegal:
+            continue
+
+        moves = board.get_all_moves()
+        valid[index - start] = True
+        counts[index - start] = len(moves)
+        checks[index - start] = board.in_check()
+        for move in moves:
+            from_sq = move & StartMask
+            to_sq = move >> EndShift & StartMask
+            flags = move >> FlagsShift
+            mover = squares.index(from_sq)
+            if not flags & (Flags.Capture | 8):
+                parents.append(index)
+                children.append((1 - side) * size + index % size + (to_sq - from_sq) * powers[mover])
+                continue
+
+            placed = [(color, piece, sq) for (color, piece), sq in zip(pieces, squares)
+                      if sq != to_sq]
+            color, piece = pieces[mover]
+            placed = [(c, p, to_sq if sq == from_sq else sq) for c, p, sq in placed]
+            if flags & 8:
+                placed = [(c, PromPieces[flags & 3] if sq == to_sq else p, sq) for c, p, sq in placed]
+            child_name, child_index = position_index(placed, 1 - side)
+            wdl, dtm = _worker_tables.probe_index(child_name, child_index)
+            ext_parents.append(index)
+            ext_results.append((wdl, dtm))
+
+    ext_results = np.array(ext_results, dtype=np.int32).reshape(-1, 2)
+    return (valid, counts, checks, np.array(parents, dtype=np.int64), np.array(children, dtype=np.int64),
+            np.array(ext_parents, dtype=np.int64), ext_results[:, 0], ext_results[:, 1])
+
+
+# Solves a signature from its move graph by iterating over distances: a
+# position is won in n plies if a move reaches a position lost in n - 1,
+# and lost in n plies if every move reaches a position won in at most n - 1.
+# Returns (wdl, dtm) arrays over all indexes.
+def solve(valid, counts, checks, parents, children, ext_parents, ext_wdl, ext_dtm, draw_all=False):
+    n = len(valid)
+    wdl = np.zeros(n, dtype=np.int8)
+    dtm = np.zeros(n, dtype=np.int32)
+    resolved = ~valid | (counts == 0)
+    wdl[valid & (counts == 0) & checks] = -1
+    if draw_all:
+        return wdl, dtm
+
+    edge_parents = np.concatenate([parents, ext_parents])
+    ext_wdl = ext_wdl.astype(np.int8)
+    last = int(ext_dtm.max(initial=0)) + 1
+    ply = 1
+    while True:
+        child_wdl = np.concatenate([np.where(resolved[children], wdl[children], 0), ext_wdl])
+        child_dtm = np.concatenate([dtm[children], ext_dtm])
+        if ply % 2:
+            wins = edge_parents[(child_wdl == -1) & (child_dtm == ply - 1)]
+            new = np.zeros(n, dtype=bool)
+            new[wins] = True
+            new &= ~resolved
+            wdl[new] = 1
+        else:
+            won = np.bincount(edge_parents, weights=(child_wdl == 1) & (child_dtm <= ply - 1), minlength=n)
+            new = ~resolved & (won == counts)
+            wdl[new] = -1
+        dtm[new] = ply
+        resolved |= new
+        if new.any():
+            last = max(last, ply + 1)
+        elif ply > last:
+            break
+        ply += 1
+
+    return wdl, dtm
+
+
+# Builds the table of a signature, and first the tables it depends on, into
+# directory. Move generation is split across processes. Returns the number
+# of legal positions in the table.
+def build(name, directory=TablebasePath, processes=1, chunk=20000, verbose=False, force=False):
+    pieces = parse_signature(name)
+    name = signature_name(pieces)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + ".mctb")
+    if not force and load_table(path) is not None:
+        return None
+    for dependency in dependencies(pieces):
+        build(dependency, directory, processes, chunk, verbose)
+
+    start = time.perf_counter()
+    total = 2 * 25 ** len(pieces)
+    tasks = [(name, i, min(i + chunk, total)) for i in range(0, total, chunk)]
+    if processes > 1:
+        with Pool(processes, _init_worker, (directory,)) as pool:
+            parts = pool.map(_gen_edges, tasks)
+    else:
+        _init_worker(directory)
+        parts = [_gen_edges(task) for task in tasks]
+
+    fields = [np.concatenate([part[i] for part in parts]) for i in range(8)]
+    wdl, dtm = solve(*fields, draw_all=insufficient(pieces))
+    write_table(path, name, wdl, dtm)
+
+    positions = int(fields[0].sum())
+    if verbose:
+        print("{:<10} {:>10,} positions: {:>9,} wins, {:>9,} losses, longest mate {:>3} plies ({:.1f}s)".format(
+            name, positions, int((wdl == 1).sum()), int((wdl == -1).sum()), int(dtm.max(initial=0)),
+            time.perf_counter() - start))
+    return positions
+
+
+# Checks a table against MiniChessBoard on random legal positions: mates
+# and stalemates must match get_all_moves/in_check, and every other result
+# must follow from the results of the position's moves. Raises an
+# AssertionError on the first mismatch and returns the positions checked.
+def verify(name, tables=None, samples=2000, seed=0):
+    tables = tables or Tablebases()
+    pieces = parse_signature(name)
+    rng = np.random.default_rng(seed)
+    board = MiniChessBoard()
+    checked = 0
+    while checked < samples:
+        squares = rng.choice(25, len(pieces), replace=False)
+        if any(p == Piece.Pawn and (sq < 5 or sq >= 20) for (c, p), sq in zip(pieces, squares)):
+            continue
+        board.board = [0] * 12
+        for (color, piece), sq in zip(pieces, squares):
+            board.board[6 * color + piece] |= 1 << int(sq)
+        board.white = bool(rng.integers(2))
+        board.init_derived_state()
+        board.white = not board.white
+        illegal = board.in_check()
+        board.white = not board.white
+        if illegal:
+            continue
+
+        wdl, dtm = tables.probe(board)
+        moves = board.get_all_moves()
+        if not moves:
+            assert (wdl, dtm) == ((-1, 0) if board.in_check() else (0, 0)), board.get_fen()
+        elif insufficient(pieces):
+            assert (wdl, dtm) == (0, 0), board.get_fen()
+        else:
+            results = []
+            for move in moves:
+                board.make_move(move)
+                results.append(tables.probe(board))
+                board.unmake_move()
+            if any(w == -1 for w, d in results):
+                expected = (1, 1 + min(d for w, d in results if w == -1))
+            elif all(w == 1 for w, d in results):
+                expected = (-1, 1 + max(d for w, d in results))
+            else:
+                expected = (0, 0)
+            assert (wdl, dtm) == expected, board.get_fen()
+        checked += 1
+
+    return checked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds endgame tablebases by retrograde analysis.")
+    parser.add_argument("signatures", nargs="+", help="material signatures such as KQvK or KPvKN")
+    parser.add_argument("--directory", default=TablebasePath)
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="rebuild tables that already exist")
+    parser.add_argument("--verify", type=int, default=0, metavar="N",
+                        help="check N random positions of each table against the move generator")
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+
+    for name in args.signatures:
+        build(name, args.directory, args.processes, verbose=True, force=args.force)
+        if args.verify:
+            checked = verify(name, Tablebases(args.directory), args.verify)
+            print("{}: {:,} positions verified".format(signature_name(parse_signature(name)), checked))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+from array import array
+from Enums import Bound
+
+
+# A fixed-size hash table mapping Zobrist keys to search results. Each bucket
+# holds two entries: a depth-preferred slot, which is only overwritten by
+# results searched at least as deep, and an always-replace slot that takes
+# every other store. Entries hold a depth, a value with its Bound, and an
+# arbitrary payload such as a move list or best move.
+class TranspositionTable():
+    # Approximate cost in bytes of one entry: the packed key/depth/bound
+    # arrays plus the value and payload references and a boxed value.
+    entry_size = 64
+
+    # Depth stored in slots that have never been written.
+    empty = -32768
+
+    def __init__(self, size_mb=16):
+        buckets = 1
+        while 2 * buckets * 2 * TranspositionTable.entry_size <= size_mb * 2**20:
+            buckets *= 2
+        self.size_mb = size_mb
+        self.mask = buckets - 1
+
+        slots = 2 * buckets
+        self.keys = array('Q', bytes(8 * slots))
+        self.depths = array('h', [TranspositionTable.empty]) * slots
+        self.bounds = array('B', bytes(slots))
+        self.values = [None] * slots
+        self.data = [None] * slots
+
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+
+    # Returns the number of entries the table can hold.
+    def capacity(self):
+        return len(self.keys)
+
+
+    # Removes every entry and resets the statistics.
+    def clear(self):
+        self.__init__(self.size_mb)
+
+
+    # Looks up a key. Returns a (depth, bound, value, data) tuple if the
+    # position is stored, and None otherwise.
+    def probe(self, key):
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.depths[i] != TranspositionTable.empty:
+                self.hits += 1
+                return self.depths[i], Bound(self.bounds[i]), self.values[i], self.data[i]
+
+        return None
+
+
+    # Stores the result of searching a position to a given depth.
+    def store(self, key, depth, value, bound=Bound.Exact, data=None):
+        self.stores += 1
+        slot = (key & self.mask) << 1
+        if self.keys[slot] != key and self.depths[slot] > depth:
+            slot += 1
+
+        if self.keys[slot] != key and self.depths[slot] != TranspositionTable.empty:
+            self.overwrites += 1
+
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.bounds[slot] = bound
+        self.values[slot] = value
+        self.data[slot] = data
+
+
+    # Returns the fraction of probes that found their position.
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+    # Returns the fraction of slots currently holding an entry.
+    def fill_rate(self):
+        used = sum(1 for d in self.depths if d != TranspositionTable.empty)
+        return used / len(self.depths)
+
+
+    # Returns a dictionary of usage statistics.
+    def stats(self):
+        return {"capacity": self.capacity(), "probes": self.probes,
+                "hits": self.hits, "hit_rate": self.hit_rate(),
+                "stores": self.stores, "overwrites": self.overwrites}
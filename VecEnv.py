@@ -0,0 +1,418 @@
+from Bitboard import Bitboard
+from Enums import *
+from MiniChessBoard import MiniChessBoard, HalfmoveLimit
+from Move import *
+from Zobrist import Zobrist
+from array import array
+import numpy as np
+
+
+# Lookup tables from Bitboard as NumPy arrays, indexed the same way.
+PawnAttacks = np.array(Bitboard.pawn_attacks, dtype=np.uint32)
+KnightAttacks = np.array(Bitboard.knight_attacks, dtype=np.uint32)
+KingAttacks = np.array(Bitboard.king_attacks, dtype=np.uint32)
+Between = np.array(Bitboard.between, dtype=np.uint32)
+Line = np.array(Bitboard.line, dtype=np.uint32)
+RankAttacks = np.array(Bitboard.rank_attacks, dtype=np.uint32)
+FileAttacks = np.array(Bitboard.file_attacks, dtype=np.uint32)
+DiagAttacks = np.array(Bitboard.diag_attacks, dtype=np.uint32)
+AntiAttacks = np.array(Bitboard.anti_attacks, dtype=np.uint32)
+RankShifts = np.array(Bitboard.rank_shifts, dtype=np.uint64)
+FileShifts = np.array(Bitboard.file_shifts, dtype=np.uint64)
+DiagMasks = np.array(Bitboard.diag_masks, dtype=np.uint64)
+AntiMasks = np.array(Bitboard.anti_masks, dtype=np.uint64)
+
+Squares = np.arange(25)
+PieceCodes = np.arange(1, 7, dtype=np.uint8)[:, None]
+SquareBits = np.array([1 << sq for sq in range(25)], dtype=np.uint32)
+FullBoard = np.uint32((1 << 25) - 1)
+
+# The square a pawn of each color pushes to, as a bitboard (0 on the last
+# rank), and the ranks a pawn of each color promotes on.
+PawnPushes = np.array([[1 << (sq + 5) if sq < 20 else 0 for sq in range(25)],
+                       [1 << (sq - 5) if sq >= 5 else 0 for sq in range(25)]], dtype=np.uint32)
+PromotionRanks = np.array([0x1f00000, 0x1f], dtype=np.uint32)
+
+# De Bruijn table giving the index of an isolated bit of a 32-bit word.
+DeBruijn32 = 0x077CB531
+DeBruijnIndex = np.zeros(32, dtype=np.intp)
+for _i in range(32):
+    DeBruijnIndex[((1 << _i) * DeBruijn32 & 0xFFFFFFFF) >> 27] = _i
+
+# Zobrist keys as [6 * color + piece][square], like MiniChessBoard.board.
+ZobristPieces = np.array(Zobrist.pieces, dtype=np.uint64).reshape(12, 25)
+ZobristSide = np.uint64(Zobrist.side)
+
+ByteCounts = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# Returns the index of the least significant set bit of every element of a
+# uint32 array (0 for empty bitboards).
+def lsb(b):
+    isolated = b & (~b + np.uint32(1))
+    return DeBruijnIndex[(isolated * np.uint32(DeBruijn32)) >> np.uint32(27)]
+
+
+# Returns the number of set bits of every element of a uint32 array.
+def popcount(b):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(b)
+    b = np.ascontiguousarray(b, dtype=np.uint32)
+    return ByteCounts[b.view(np.uint8)].reshape(b.shape + (4,)).sum(axis=-1)
+
+
+# Returns the bishop attacks from squares sq through occupancies occupied,
+# using Bitboard's kindergarten tables. Both arguments broadcast.
+def bishop_attacks(sq, occupied):
+    occupied = occupied.astype(np.uint64)
+    diag = ((occupied & DiagMasks[sq]) * np.uint64(0x108421)) >> np.uint64(20) & np.uint64(31)
+    anti = ((occupied & AntiMasks[sq]) * np.uint64(0x108421)) >> np.uint64(20) & np.uint64(31)
+    return DiagAttacks[sq, diag] | AntiAttacks[sq, anti]
+
+
+# Returns the rook attacks from squares sq through occupancies occupied,
+# using Bitboard's kindergarten tables. Both arguments broadcast.
+def rook_attacks(sq, occupied):
+    occupied = occupied.astype(np.uint64)
+    rank = (occupied >> RankShifts[sq]) & np.uint64(31)
+    file = (((occupied >> FileShifts[sq]) & np.uint64(0x108421))
+            * np.uint64(0x111110)) >> np.uint64(20) & np.uint64(31)
+    return RankAttacks[sq, rank] | FileAttacks[sq, file]
+
+
+# Holds N Gardner minichess games as NumPy arrays and steps them all at once.
+# boards has shape (N, 2, 6) and holds the bitboards of MiniChessBoard.board
+# as [color][piece]. Legal moves are kept as an (N, 25) array of
+# target bitboards per start square, and actions are packed moves. Games end
+# as MiniChessBoard.outcome() ends them, or after max_plies plies. For
+# repetitions every game keeps the Zobrist keys of its positions since the
+# last capture or pawn move, history[i, j] holding the key after j of them.
+class VecEnv():
+    def __init__(self, n, max_plies=256, auto_reset=True):
+        self.n = n
+        self.max_plies = max_plies
+        self.auto_reset = auto_reset
+        self.rows = np.arange(n)
+
+        start = MiniChessBoard()
+        self.start_board = np.array(start.board, dtype=np.uint32).reshape(2, 6)
+
+        self.boards = np.zeros((n, 2, 6), dtype=np.uint32)
+        self.white = np.ones(n, dtype=bool)
+        self.plies = np.zeros(n, dtype=np.int32)
+        self.done = np.zeros(n, dtype=bool)
+        self.boards[:] = self.start_board
+        self.halfmoves = np.zeros(n, dtype=np.int32)
+        self.keys = self.compute_keys()
+        self.history = np.zeros((n, HalfmoveLimit + 1), dtype=np.uint64)
+        self.history[:, 0] = self.keys
+        self.update()
+
+        # legal move state of the start position, copied into reset games
+        self.start_targets = self.targets[0].copy()
+        self.start_checkers = self.checkers[0]
+        self.start_num_moves = self.num_moves[0]
+        self.start_key = self.keys[0]
+
+
+    # Resets the selected games (all by default) to the start position.
+    def reset(self, selected=None):
+        if selected is None:
+            selected = np.ones(self.n, dtype=bool)
+        self.boards[selected] = self.start_board
+        self.white[selected] = True
+        self.plies[selected] = 0
+        self.done[selected] = False
+        self.halfmoves[selected] = 0
+        self.keys[selected] = self.history[selected, 0] = self.start_key
+        self.targets[selected] = self.start_targets
+        self.checkers[selected] = self.start_checkers
+        self.num_moves[selected] = self.start_num_moves
+
+
+    # Copies the positions of a list of N MiniChessBoards into the games.
+    def set_boards(self, boards):
+        self.boards[:] = np.array([board.board for board in boards], dtype=np.uint32).reshape(-1, 2, 6)
+        self.white[:] = [board.white for board in boards]
+        self.plies[:] = [board.move_count for board in boards]
+        self.done[:] = False
+        self.halfmoves[:] = [board.halfmoves for board in boards]
+        self.keys[:] = [board.key for board in boards]
+        self.history[:] = 0
+        for i, board in enumerate(boards):
+            # as far back as the board's own history goes
+            last = min(board.halfmoves, HalfmoveLimit)
+            recent = board.keys[len(board.keys) - 1 - min(last, len(board.keys) - 1):]
+            self.history[i, last + 1 - len(recent):last + 1] = recent
+        self.update()
+
+
+    # Returns game i as a MiniChessBoard.
+    def get_board(self, i):
+        board = MiniChessBoard()
+        board.board = [int(bb) for bb in self.boards[i].ravel()]
+        board.white = bool(self.white[i])
+        board.init_derived_state()
+        board.halfmoves = int(self.halfmoves[i])
+        board.keys = [int(key) for key in self.history[i, :min(board.halfmoves, HalfmoveLimit) + 1]]
+        return board
+
+
+    # Returns the (N,) Zobrist keys of the positions, as Zobrist.compute.
+    def compute_keys(self):
+        bits = (self.boards.reshape(self.n, 12, 1) >> Squares.astype(np.uint32)) & np.uint32(1)
+        keys = np.bitwise_xor.reduce(np.where(bits != 0, ZobristPieces, np.uint64(0)).reshape(self.n, -1),
+                                     axis=1)
+        return keys ^ np.where(self.white, np.uint64(0), ZobristSide)
+
+
+    # Returns whether the position of each game has occurred count times,
+    # counting this one, since the last capture or pawn move, as
+    # MiniChessBoard.is_repetition.
+    def is_repetition(self, count=3):
+        last = np.minimum(self.halfmoves, HalfmoveLimit)
+        width = int(last.max()) + 1 if self.n else 0
+        back = last[:, None] - np.arange(width)
+        same = (back >= 0) & (back % 2 == 0) & (self.history[:, :width] == self.keys[:, None])
+        return same.sum(axis=1) >= count
+
+
+    # Returns, for every game, (side to move, pieces of the side to move,
+    # pieces of the other side) with shapes (N,), (N, 6) and (N, 6).
+    def sides(self):
+        side = (~self.white).astype(np.intp)
+        return side, self.boards[self.rows, side], self.boards[self.rows, 1 - side]
+
+
+    # Returns an (N, 25) array holding the type of the piece on each square,
+    # given an (N, 6) array of one side's bitboards per game, with Piece.NONE
+    # for squares without one.
+    def piece_map(self, pieces):
+        bits = ((pieces[:, :, None] >> Squares.astype(np.uint32)) & np.uint32(1)).astype(np.uint8)
+        # squares hold at most one piece, so the weighted sum is its type + 1
+        piece = (bits * PieceCodes).sum(axis=1, dtype=np.uint8)
+        return np.where(piece == 0, Piece.NONE, piece - 1)
+
+
+    # Returns the (N,) bitboards of squares attacked by the given pieces (an
+    # (N, 6) array) of color (an (N,) array) through occupancies occupied.
+    def attack_maps(self, pieces, color, occupied):
+        piece = self.piece_map(pieces)
+        occupied = occupied[:, None]
+        attacks = np.where(piece == Piece.Knight, KnightAttacks, 0)
+        attacks |= np.where(piece == Piece.King, KingAttacks, 0)
+        attacks |= np.where(piece == Piece.Pawn, PawnAttacks[color[:, None], Squares], 0)
+        diagonal = (piece == Piece.Bishop) | (piece == Piece.Queen)
+        straight = (piece == Piece.Rook) | (piece == Piece.Queen)
+        attacks |= np.where(diagonal, bishop_attacks(Squares, occupied), 0)
+        attacks |= np.where(straight, rook_attacks(Squares, occupied), 0)
+        return np.bitwise_or.reduce(attacks, axis=1).astype(np.uint32)
+
+
+    # Computes the legal moves of every game, as MiniChessBoard.get_all_moves
+    # does with check and pin masks. Sets targets, an (N, 25) array of the
+    # legal target squares of the piece on each square, checkers and
+    # num_moves, the number of legal moves counting each promotion piece.
+    def update(self):
+        side, us, them = self.sides()
+        occ_us = np.bitwise_or.reduce(us, axis=1)
+        occ_them = np.bitwise_or.reduce(them, axis=1)
+        occupied = occ_us | occ_them
+        king = lsb(us[:, Piece.King])
+
+        bishops = them[:, Piece.Bishop] | them[:, Piece.Queen]
+        rooks = them[:, Piece.Rook] | them[:, Piece.Queen]
+        checkers = ((PawnAttacks[side, king] & them[:, Piece.Pawn])
+                    | (KnightAttacks[king] & them[:, Piece.Knight])
+                    | (bishop_attacks(king, occupied) & bishops)
+                    | (rook_attacks(king, occupied) & rooks))
+        count = popcount(checkers)
+        check_mask = np.where(count == 0, FullBoard,
+                              np.where(count == 1, Between[king, lsb(checkers)] | checkers, 0))
+
+        # a slider aiming at the king through exactly one of our pieces pins it
+        snipers = (bishop_attacks(king, occ_them) & bishops) | (rook_attacks(king, occ_them) & rooks)
+        blockers = Between[king] & occupied[:, None]
+        pins = (((snipers[:, None] >> Squares.astype(np.uint32)) & np.uint32(1)).astype(bool)
+                & (popcount(blockers) == 1) & ((blockers & occ_us[:, None]) != 0))
+        pinned = np.bitwise_or.reduce(np.where(pins, blockers, 0), axis=1)
+
+        # the king must not shield squares behind it from sliders
+        attacked = self.attack_maps(them, 1 - side, occupied & ~us[:, Piece.King])
+
+        piece = self.piece_map(us)
+        sq_occupied = occupied[:, None]
+        targets = np.where(piece == Piece.Knight, KnightAttacks, 0)
+        diagonal = (piece == Piece.Bishop) | (piece == Piece.Queen)
+        straight = (piece == Piece.Rook) | (piece == Piece.Queen)
+        targets |= np.where(diagonal, bishop_attacks(Squares, sq_occupied), 0)
+        targets |= np.where(straight, rook_attacks(Squares, sq_occupied), 0)
+        pawn = piece == Piece.Pawn
+        targets |= np.where(pawn, PawnPushes[side[:, None], Squares] & ~sq_occupied, 0)
+        targets |= np.where(pawn, PawnAttacks[side[:, None], Squares] & occ_them[:, None], 0)
+        targets &= check_mask[:, None]
+        pinned_here = ((pinned[:, None] >> Squares.astype(np.uint32)) & np.uint32(1)).astype(bool)
+        targets &= np.where(pinned_here, Line[king[:, None], Squares], FullBoard)
+        targets |= np.where(piece == Piece.King, KingAttacks & ~attacked[:, None], 0)
+        targets &= ~occ_us[:, None]
+        targets = targets.astype(np.uint32)
+
+        promotions = np.where(pawn, targets & PromotionRanks[side][:, None], 0).astype(np.uint32)
+        self.targets = targets
+        self.checkers = checkers
+        self.num_moves = popcount(targets).sum(axis=1) + 3 * popcount(promotions).sum(axis=1)
+
+
+    # Returns whether each game is drawn by insufficient material, by the
+    # same rule as MiniChessBoard.is_insufficient_material.
+    def insufficient_material(self):
+        heavy = self.boards[:, :, Piece.Pawn] | self.boards[:, :, Piece.Rook] | self.boards[:, :, Piece.Queen]
+        knights = popcount(self.boards[:, :, Piece.Knight])
+        bishops = popcount(self.boards[:, :, Piece.Bishop])
+        enough = (heavy != 0) | ((bishops > 0) & (knights > 0)) | (bishops > 1) | (knights > 2)
+        return ~enough.any(axis=1)
+
+
+    # Returns the legal moves of game i as an array('H') of packed moves.
+    def legal_moves(self, i):
+        moves = array('H')
+        side = 0 if self.white[i] else 1
+        occ_them = int(np.bitwise_or.reduce(self.boards[i, 1 - side]))
+        pawns = int(self.boards[i, side, Piece.Pawn])
+        for sq in range(25):
+            targets = int(self.targets[i, sq])
+            while targets:
+                end = Bitboard.lsb(targets)
+                move = sq | end << EndShift
+                capture = Bitboard.is_set(occ_them, end)
+                if Bitboard.is_set(pawns, sq) and (end < 5 or end >= 20):
+                    for bits in (PromCapBits if capture else PromBits):
+                        moves.append(move | bits)
+                else:
+                    moves.append(move | CaptureBits if capture else move)
+                targets = Bitboard.pop_lsb(targets)
+
+        return moves
+
+
+    # Returns one uniformly random legal packed move per game (0 for games
+    # without legal moves). A start square is drawn weighted by its number of
+    # moves, then one of its targets and, for promotions, the piece.
+    def random_actions(self, rng):
+        side, us, them = self.sides()
+        shifts = Squares.astype(np.uint32)
+        pawns = ((us[:, Piece.Pawn, None] >> shifts) & np.uint32(1)).astype(bool)
+        promotions = np.where(pawns, self.targets & PromotionRanks[side][:, None], 0).astype(np.uint32)
+        # each promotion stands for four moves
+        weights = popcount(self.targets).astype(np.int64) + 3 * popcount(promotions)
+        cumulative = np.cumsum(weights, axis=1)
+        pick = (rng.random(self.n) * cumulative[:, -1]).astype(np.int64)
+        start = (cumulative > pick[:, None]).argmax(axis=1)
+
+        targets = self.targets[self.rows, start]
+        bits = np.cumsum((targets[:, None] >> shifts) & np.uint32(1), axis=1)
+        nth = (rng.random(self.n) * bits[:, -1]).astype(np.int64)
+        end = (bits > nth[:, None]).argmax(axis=1)
+
+        occ_them = np.bitwise_or.reduce(them, axis=1)
+        capture = ((occ_them >> end.astype(np.uint32)) & np.uint32(1)).astype(np.int64)
+        promotion = pawns[self.rows, start] & ((end < 5) | (end >= 20))
+        flags = np.where(promotion, 8 + rng.integers(0, 4, self.n), 0) | (capture << 2)
+        actions = start | end << EndShift | flags << FlagsShift
+        return np.where(cumulative[:, -1] > 0, actions, 0).astype(np.uint16)
+
+
+    # Plays one packed move (an (N,) array) in every unfinished game. Returns
+    # (results, done): done marks the games that ended with this move, and
+    # results holds their outcome from white's point of view (1 for a white
+    # win, -1 for a black win, 0 otherwise). Finished games are reset to the
+    # start position if auto_reset is set, and skip further moves otherwise.
+    def step(self, actions):
+        active = ~self.done
+        actions = np.asarray(actions).astype(np.uint32)
+        start = (actions & np.uint32(StartMask)).astype(np.intp)
+        end = (actions >> np.uint32(EndShift) & np.uint32(StartMask)).astype(np.intp)
+        flags = actions >> np.uint32(FlagsShift)
+        from_bb = SquareBits[start]
+        to_bb = SquareBits[end]
+
+        side, us, them = self.sides()
+        moving = (us & from_bb[:, None]) != 0
+        captured = (them & to_bb[:, None]) != 0
+        capture = captured.any(axis=1)
+        # captures and pawn moves reset the halfmove counter
+        irreversible = moving[:, Piece.Pawn] | capture
+        us = us ^ np.where(moving, (from_bb | to_bb)[:, None], 0).astype(np.uint32)
+        promoted = (flags & np.uint32(8)) != 0
+        prom_piece = (flags & np.uint32(3)).astype(np.intp) + Piece.Knight
+        us[promoted, Piece.Pawn] ^= to_bb[promoted]
+        us[promoted, prom_piece[promoted]] |= to_bb[promoted]
+
+        # update the Zobrist keys as MiniChessBoard.make_move does
+        piece = moving.argmax(axis=1)
+        landed = np.where(promoted, prom_piece, piece)
+        keys = (self.keys ^ ZobristPieces[6 * side + piece, start] ^ ZobristPieces[6 * side + landed, end]
+                ^ ZobristSide)
+        keys ^= np.where(capture, ZobristPieces[6 * (1 - side) + captured.argmax(axis=1), end], np.uint64(0))
+        them = them & ~to_bb[:, None]
+
+        rows = self.rows[active]
+        self.boards[rows, side[active]] = us[active]
+        self.boards[rows, 1 - side[active]] = them[active]
+        self.white[active] = ~self.white[active]
+        self.plies[active] += 1
+        self.halfmoves[active] = np.where(irreversible[active], 0, self.halfmoves[active] + 1)
+        self.keys[active] = keys[active]
+        self.history[rows, np.minimum(self.halfmoves[active], HalfmoveLimit)] = self.keys[active]
+        self.update()
+
+        mated = (self.num_moves == 0) & (self.checkers != 0)
+        done = active & ((self.num_moves == 0) | self.insufficient_material() | self.is_repetition()
+                         | (self.halfmoves >= HalfmoveLimit) | (self.plies >= self.max_plies))
+        results = np.where(done & mated, np.where(self.white, -1, 1), 0).astype(np.int8)
+
+        self.done |= done
+        if self.auto_reset and done.any():
+            self.reset(done)
+
+        return results, done
+
+
+# Plays random games side by side in a VecEnv and in MiniChessBoards and
+# checks that both agree on every position: the legal move sets, check,
+# termination, results and the resulting boards. Games start from the FENs
+# of fens in turn if given, and from the start position otherwise. Returns
+# the number of positions compared; raises an AssertionError on the first
+# difference.
+def compare_with_scalar(games=64, max_plies=120, seed=0, fens=None):
+    rng = np.random.default_rng(seed)
+    env = VecEnv(games, max_plies=max_plies, auto_reset=False)
+    boards = [MiniChessBoard(fens[i % len(fens)] if fens else None) for i in range(games)]
+    env.set_boards(boards)
+    positions = 0
+    while not env.done.all():
+        actions = np.zeros(games, dtype=np.uint16)
+        for i, board in enumerate(boards):
+            if env.done[i]:
+                continue
+            positions += 1
+            moves = board.get_all_moves()
+            assert sorted(env.legal_moves(i)) == sorted(moves), \
+                "legal moves differ in " + board.get_fen()
+            assert bool(env.checkers[i]) == board.in_check(), "check differs in " + board.get_fen()
+            assert env.num_moves[i] == len(moves), "move count differs in " + board.get_fen()
+            actions[i] = moves[rng.integers(len(moves))]
+
+        results, done = env.step(actions)
+        for i, board in enumerate(boards):
+            if env.done[i] and not done[i]:
+                continue
+            board.make_move(int(actions[i]))
+            assert env.boards[i].ravel().tolist() == board.board, "boards differ after " + str(Move(int(actions[i])))
+            assert int(env.keys[i]) == board.key, "keys differ in " + board.get_fen()
+            outcome = board.outcome()
+            over = outcome is not None or board.move_count >= max_plies
+            assert bool(done[i]) == over, "termination differs in " + board.get_fen()
+            assert results[i] == (outcome[0] if outcome else 0), "result differs in " + board.get_fen()
+
+    return positions
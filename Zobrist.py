@@ -0,0 +1,33 @@
+from Bitboard import Bitboard
+import random
+
+
+# Fixed seed so that keys are identical across runs and processes, which lets
+# positions be deduplicated between self-play games.
+SEED = 0x6a09e667f3bcc908
+
+_rng = random.Random(SEED)
+
+
+# Stores the random keys used to compute the 64-bit Zobrist key of a position.
+class Zobrist():
+    # pieces[color][piece][square]
+    pieces = [[[_rng.getrandbits(64) for sq in range(25)] for p in range(6)]
+              for c in range(2)]
+
+    # Toggled whenever the side to move changes; set when black is to move.
+    side = _rng.getrandbits(64)
+
+
+    # Computes the key of a position from scratch. Used to initialize a board
+    # and to check the incrementally updated key.
+    def compute(board):
+        key = 0 if board.white else Zobrist.side
+        for c in range(2):
+            for p in range(6):
+                pieces = board.board[6 * c + p]
+                while pieces:
+                    key ^= Zobrist.pieces[c][p][Bitboard.lsb(pieces)]
+                    pieces = Bitboard.pop_lsb(pieces)
+
+        return key
@@ -0,0 +1,535 @@
+from MiniChessBoard import MiniChessBoard
+import Instrument
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+
+# Benchmarks for the engine's hot paths, run as `python bench.py <name>`.
+# Every benchmark takes the parsed command line arguments and prints its
+# results.
+benchmarks = {}
+
+
+def benchmark(fn):
+    benchmarks[fn.__name__] = fn
+    return fn
+
+
+# Plays random games from the start position and returns the boards reached,
+# so benchmarks run on a realistic mix of openings, middlegames and endings.
+def sample_positions(count, seed=0):
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = MiniChessBoard()
+        moves = board.get_all_moves()
+        while moves and len(fens) < count:
+            fens.append(board.get_fen())
+            board.make_move(rng.choice(moves))
+            moves = board.get_all_moves()
+
+    return [MiniChessBoard(fen) for fen in fens]
+
+
+# Calls fn once for every item and returns the best calls per second over
+# several repeats. CPU time is used so that time stolen by other processes
+# or the hypervisor does not count.
+def rate(fn, items, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.process_time()
+        for item in items:
+            fn(item)
+        best = min(best, time.process_time() - start)
+
+    return len(items) / best
+
+
+def report(name, value, unit):
+    print("{:<32} {:>14,.0f} {}".format(name, value, unit))
+
+
+# Wraps a function of a board so that every call runs without the board's
+# cached attack maps, as on a position reached for the first time.
+def uncached(fn):
+    def call(board):
+        board.attack_key = None
+        return fn(board)
+    return call
+
+
+# Compares the pin/check-mask legal move generator with generating
+# pseudo-legal moves and filtering them through make/unmake.
+@benchmark
+def movegen(args):
+    boards = sample_positions(args.positions, args.seed)
+    fast = rate(uncached(MiniChessBoard.get_all_moves), boards, args.repeat)
+    slow = rate(MiniChessBoard.get_all_moves_filtered, boards, args.repeat)
+    report("get_all_moves", fast, "positions/s")
+    report("get_all_moves_filtered", slow, "positions/s")
+    print("speedup: {:.2f}x".format(fast / slow))
+
+
+# Measures the startup cost paid by every short-lived worker process: the
+# time to import the engine from outside the repository, over a bare
+# interpreter start, and the time to load the magic tables in process.
+@benchmark
+def startup(args):
+    import Bitboard
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+
+    def run(code):
+        best = float("inf")
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], env=env, cwd=os.path.dirname(here),
+                           check=True)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    bare = run("pass")
+    for module in ["Bitboard", "MiniChessBoard"]:
+        print("{:<32} {:>10.1f} ms".format("import " + module, 1000 * (run("import " + module) - bare)))
+
+    start = time.perf_counter()
+    for i in range(args.repeat):
+        Bitboard.load_magics()
+    print("{:<32} {:>10.3f} ms".format("load_magics", 1000 * (time.perf_counter() - start) / args.repeat))
+
+
+# Returns the memory held by nested lists of ints, counting shared objects
+# once. Memoryviews count their underlying buffer.
+def table_size(*objects, seen=None):
+    seen = set() if seen is None else seen
+    size = 0
+    for obj in objects:
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, memoryview):
+            size += obj.nbytes
+        else:
+            size += sys.getsizeof(obj)
+            if isinstance(obj, list):
+                size += table_size(*obj, seen=seen)
+
+    return size
+
+
+# Compares the sliding attack backends: lookups per second on occupancies
+# from sampled positions, the memory their tables hold, and move generation
+# speed with each backend selected.
+@benchmark
+def attacks(args):
+    import Bitboard
+    B = Bitboard.Bitboard
+    boards = sample_positions(args.positions, args.seed)
+    queries = [(sq, board.occupied) for board in boards for sq in range(0, 25, 3)]
+    memory = {
+        "magic": table_size(B.attack_table, B.bishop_masks, B.bishop_numbers, B.bishop_shifts,
+                            B.bishop_offsets, B.rook_masks, B.rook_numbers, B.rook_shifts,
+                            B.rook_offsets),
+        "kindergarten": table_size(B.rank_attacks, B.file_attacks, B.diag_attacks, B.anti_attacks,
+                                   B.rank_shifts, B.file_shifts, B.diag_masks, B.anti_masks),
+    }
+
+    selected = B.attack_backend
+    for name, (bishop, rook) in Bitboard.AttackBackends.items():
+        Bitboard.select_attacks(name)
+        print(name + ":")
+        report("  bishop lookups", rate(lambda q: bishop(*q), queries, args.repeat), "calls/s")
+        report("  rook lookups", rate(lambda q: rook(*q), queries, args.repeat), "calls/s")
+        report("  get_all_moves", rate(uncached(MiniChessBoard.get_all_moves), boards, args.repeat),
+               "positions/s")
+        report("  table memory", memory[name], "bytes")
+    Bitboard.select_attacks(selected)
+
+    from Enums import Flags
+    from Move import FlagsShift
+    captures = [(board, move) for board in boards for move in board.get_all_moves()
+                if move >> FlagsShift & Flags.Capture]
+    report("in_check", rate(uncached(MiniChessBoard.in_check), boards, args.repeat), "calls/s")
+    report("attack_map (both colors)", rate(uncached(lambda b: b.attack_map(0) | b.attack_map(1)),
+                                            boards, args.repeat), "positions/s")
+    report("attackers_to", rate(lambda q: boards[0].attackers_to(*q), queries, args.repeat), "calls/s")
+    report("see", rate(lambda c: c[0].see(c[1]), captures, args.repeat), "captures/s")
+
+
+# Checks VecEnv against MiniChessBoard on random games, then compares the
+# positions per second of random self-play in a VecEnv of --batch games with
+# random play on a single MiniChessBoard.
+@benchmark
+def vecenv(args):
+    import numpy as np
+    import VecEnv
+    print("differential test: {:,} positions match".format(
+        VecEnv.compare_with_scalar(64, seed=args.seed)))
+
+    rng = np.random.default_rng(args.seed)
+    env = VecEnv.VecEnv(args.batch)
+    steps = max(1, args.positions // args.batch)
+    start = time.process_time()
+    for i in range(steps):
+        env.step(env.random_actions(rng))
+    report("VecEnv({})".format(args.batch), steps * args.batch / (time.process_time() - start),
+           "positions/s")
+
+    rng = random.Random(args.seed)
+    board = MiniChessBoard()
+    start = time.process_time()
+    for i in range(args.positions):
+        moves = board.get_all_moves()
+        if board.outcome() is not None or board.move_count > 256:
+            board = MiniChessBoard()
+            moves = board.get_all_moves()
+        board.make_move(rng.choice(moves))
+    report("MiniChessBoard", args.positions / (time.process_time() - start), "positions/s")
+
+
+# Measures encoding positions into network input planes, from a list of
+# MiniChessBoards with and without history and straight from a VecEnv.
+@benchmark
+def encode(args):
+    import numpy as np
+    import Encoder
+    import VecEnv
+    boards = sample_positions(args.batch, args.seed)
+    for history in [0, 2]:
+        out = Encoder.new_buffer(len(boards), history)
+        report("encode (history {})".format(history),
+               rate(lambda b: Encoder.encode(b, out, history), [boards] * args.repeat, 1) * len(boards),
+               "positions/s")
+
+    env = VecEnv.VecEnv(args.batch)
+    out = Encoder.new_buffer(args.batch)
+    report("encode_env", rate(lambda e: Encoder.encode_env(e, out), [env] * 10, args.repeat) * args.batch,
+           "positions/s")
+    report("encode_env (canonical)",
+           rate(lambda e: Encoder.encode_env(e, out, True), [env] * 10, args.repeat) * args.batch,
+           "positions/s")
+
+
+# Measures building legal action masks, per board, for a list of boards in
+# one scatter and for a VecEnv, and sampling actions from masked logits.
+@benchmark
+def actions(args):
+    import numpy as np
+    import ActionSpace
+    import VecEnv
+    from array import array
+    boards = sample_positions(args.positions, args.seed)
+    mask = np.zeros(ActionSpace.NumActions, dtype=bool)
+    moves = array('H')
+    report("legal_mask", rate(uncached(lambda b: ActionSpace.legal_mask(b, mask, moves)), boards,
+                              args.repeat),
+           "positions/s")
+    report("legal_masks", rate(ActionSpace.legal_masks, [boards], args.repeat) * len(boards),
+           "positions/s")
+
+    env = VecEnv.VecEnv(args.batch)
+    masks = np.zeros((args.batch, ActionSpace.NumActions), dtype=bool)
+    report("env_legal_masks", rate(lambda e: ActionSpace.env_legal_masks(e, masks), [env] * 10,
+                                   args.repeat) * args.batch, "positions/s")
+    rng = np.random.default_rng(args.seed)
+    logits = rng.standard_normal((args.batch, ActionSpace.NumActions)).astype(np.float32)
+    report("sample_actions", rate(lambda l: ActionSpace.sample_actions(l, masks, rng), [logits] * 10,
+                                  args.repeat) * args.batch, "positions/s")
+
+
+# Measures MCTS simulations per second from the start position with a
+# uniform evaluator stub, for several leaf batch sizes, and the cost of
+# keeping the subtree of the played move.
+@benchmark
+def mcts(args):
+    import MCTS
+    simulations = args.positions
+    for batch in [1, 8, 32]:
+        search = MCTS.MCTS(MCTS.UniformEvaluator(), batch_size=batch)
+        board = MiniChessBoard()
+        start = time.process_time()
+        search.search(board, simulations)
+        report("search (batch {})".format(batch), simulations / (time.process_time() - start),
+               "simulations/s")
+
+    board.make_move(search.select_move())
+    nodes = search.size
+    start = time.process_time()
+    search.advance(board)
+    print("{:<32} {:>10.3f} ms ({:,} of {:,} nodes kept)".format(
+        "advance", 1000 * (time.process_time() - start), search.size, nodes))
+
+
+# Measures the inference broker with --batch concurrent asyncio clients,
+# each evaluating sampled positions one at a time through the NumPy model
+# stand-in, for several batch size limits.
+@benchmark
+def broker(args):
+    import asyncio
+    import numpy as np
+    import ActionSpace
+    import Encoder
+    from InferenceBroker import InferenceBroker, NumpyModel
+    boards = sample_positions(args.positions, args.seed)
+    planes = Encoder.encode(boards)
+    masks = ActionSpace.legal_masks(boards)
+    model = NumpyModel()
+    clients = min(args.batch, len(boards))
+
+    async def run(max_batch_size):
+        server = InferenceBroker(model, max_batch_size)
+        task = asyncio.create_task(server.run())
+        await asyncio.sleep(0)
+
+        async def client(k):
+            for i in range(k, len(boards), clients):
+                await server.evaluate(planes[i], masks[i])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(k) for k in range(clients)])
+        seconds = time.perf_counter() - start
+        server.queue.put_nowait(None)
+        await task
+        return len(boards) / seconds, server.stats()
+
+    for max_batch_size in [1, 8, 32, 128]:
+        speed, stats = asyncio.run(run(max_batch_size))
+        report("max batch {}".format(max_batch_size), speed, "positions/s")
+        print("  mean batch {:.1f}, queue depth {:.1f} (max {}), latency p50 {:.2f} ms, p99 {:.2f} ms".format(
+            stats["mean_batch_size"], stats["mean_queue_depth"], stats["max_queue_depth"],
+            stats["latency_ms"]["p50"], stats["latency_ms"]["p99"]))
+
+
+# Measures writing and reading --positions random games in the binary game
+# record format, with and without compression, and replaying them through
+# make_move.
+@benchmark
+def records(args):
+    import numpy as np
+    import shutil
+    import tempfile
+    from GameRecords import GameReader, GameWriter
+    from SelfPlay import play_game
+    rng = np.random.default_rng(args.seed)
+    games = [play_game(rng)[:2] for i in range(args.positions)]
+    plies = sum(len(moves) for moves, result in games)
+
+    for compress in [False, True]:
+        directory = tempfile.mkdtemp()
+        try:
+            start = time.process_time()
+            with GameWriter(directory, compress=compress) as writer:
+                for moves, result in games:
+                    writer.write(moves, result)
+            write = time.process_time() - start
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            reader = GameReader(directory)
+            start = time.process_time()
+            count = sum(1 for game in reader)
+            read = time.process_time() - start
+            start = time.process_time()
+            positions = sum(1 for position in reader.positions())
+            replay = time.process_time() - start
+        finally:
+            shutil.rmtree(directory)
+
+        print("compressed:" if compress else "uncompressed:")
+        report("  size", size, "bytes ({:.2f} per move)".format(size / plies))
+        report("  write", len(games) / write, "games/s ({:.1f} MB/s)".format(size / write / 1e6))
+        report("  read", count / read, "games/s ({:.1f} MB/s)".format(size / read / 1e6))
+        report("  replay", positions / replay, "positions/s")
+
+
+# Measures sampling --batch sized minibatches, decoded to planes, from a
+# memory-mapped replay buffer filled with sampled positions.
+@benchmark
+def replay(args):
+    import numpy as np
+    import shutil
+    import tempfile
+    import ActionSpace
+    from ReplayBuffer import ReplayBuffer
+    boards = sample_positions(args.positions, args.seed)
+    bitboards = np.array([board.board for board in boards], dtype=np.uint32)
+    white = np.array([board.white for board in boards])
+    masks = ActionSpace.legal_masks(boards, canonical=True)
+    policies = masks / masks.sum(axis=1, keepdims=True)
+    rng = np.random.default_rng(args.seed)
+
+    directory = tempfile.mkdtemp()
+    try:
+        buffer = ReplayBuffer(os.path.join(directory, "replay.bin"), 1 << 16)
+        start = time.process_time()
+        for i in range(0, 1 << 16, len(boards)):
+            buffer.add(bitboards, white, policies, rng.uniform(-1, 1, len(boards)))
+        report("add", (1 << 16) / (time.process_time() - start), "samples/s")
+
+        out = np.zeros((args.batch, 13, 5, 5), dtype=np.float32)
+        for canonical, augment in [(True, False), (False, False), (False, True)]:
+            speed = rate(lambda i: buffer.sample(args.batch, rng, canonical, augment, out),
+                         range(20), args.repeat) * args.batch
+            report("sample ({}{})".format("canonical" if canonical else "actual",
+                                          ", flipped" if augment else ""), speed, "samples/s")
+        del buffer
+    finally:
+        shutil.rmtree(directory)
+
+
+# Compares alpha-beta searches to a fixed depth on sampled positions with
+# the staged move generator and with full move lists, reporting time to
+# depth and nodes per second. Cutoffs let the staged generator skip quiet
+# moves at most nodes.
+@benchmark
+def search(args):
+    from AlphaBeta import AlphaBeta
+    boards = sample_positions(args.positions, args.seed)[::max(1, args.positions // 20)]
+    for staged in [False, True]:
+        nodes = 0
+        start = time.process_time()
+        for board in boards:
+            engine = AlphaBeta(staged=staged)
+            engine.search(board, max_depth=4)
+            nodes += engine.nodes
+        seconds = time.process_time() - start
+        name = "staged" if staged else "full lists"
+        print("{:<32} {:>10.2f} s".format(name + " time to depth 4", seconds))
+        report(name + " nodes", nodes, "({:,.0f} nodes/s)".format(nodes / seconds))
+
+
+# Builds the KRvK tablebase in a temporary directory, reporting positions
+# solved per second and the probe rate on a few KRvK positions.
+@benchmark
+def tablebase(args):
+    import shutil
+    import tempfile
+    import Tablebase
+    from MiniChessBoard import MiniChessBoard
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.process_time()
+        positions = Tablebase.build("KRvK", directory)
+        seconds = time.process_time() - start
+        report("build KRvK", positions / seconds, "positions/s")
+
+        tables = Tablebase.Tablebases(directory)
+        boards = [MiniChessBoard(fen) for fen in ["k4/5/5/5/1R2K w", "k4/5/5/5/1R2K b", "5/1k3/5/2K2/R4 w"]]
+        speed = rate(tables.probe, boards * 1000, args.repeat)
+        report("probe", speed, "probes/s")
+    finally:
+        shutil.rmtree(directory)
+
+
+# Compares rejection-sampled rollouts with random games played the way
+# main.py plays them, from full legal move lists with np.random.choice.
+@benchmark
+def rollout(args):
+    import numpy as np
+    import Rollout
+    from Move import Move
+    games = max(1, args.positions // 10)
+    np.random.seed(args.seed)
+    start = time.process_time()
+    for i in range(games):
+        board = MiniChessBoard()
+        moves = board.get_all_moves()
+        while board.outcome() is None and board.move_count <= 256:
+            board.make_move(Move(np.random.choice(moves)))
+            moves = board.get_all_moves()
+    report("legal lists + np.random.choice", games / (time.process_time() - start), "games/s")
+
+    board = MiniChessBoard()
+    start = time.process_time()
+    results, plies = Rollout.rollouts(board, games, args.seed)
+    seconds = time.process_time() - start
+    report("rejection-sampled rollouts", games / seconds, "games/s")
+    report("rollout plies", plies.sum() / seconds, "plies/s")
+
+
+# Returns the bytes held by an object and everything it references, counting
+# shared objects once.
+def deep_size(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_size(obj.__dict__, seen)
+    for name in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, name):
+            size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+# Measures the memory of a board and the cost of cloning it with deepcopy,
+# clone and snapshot/restore.
+@benchmark
+def board(args):
+    import copy
+    rng = random.Random(args.seed)
+    boards = {"new board": MiniChessBoard()}
+    played = MiniChessBoard()
+    bounded = MiniChessBoard(history_limit=100)
+    for i in range(args.positions):
+        for b in (played, bounded):
+            moves = b.get_all_moves()
+            if not moves:
+                b.set_fen(MiniChessBoard().get_fen())
+                moves = b.get_all_moves()
+            b.make_move(moves[rng.randrange(len(moves))])
+    boards["after {:,} plies".format(args.positions)] = played
+    boards["history_limit=100"] = bounded
+    for name, b in boards.items():
+        report(name, deep_size(b), "bytes")
+    report("snapshot", deep_size(played.snapshot()), "bytes")
+
+    items = [played] * 200
+    snapshot = played.snapshot()
+    target = MiniChessBoard()
+    report("deepcopy", rate(copy.deepcopy, items, args.repeat), "clones/s")
+    report("clone", rate(MiniChessBoard.clone, items, args.repeat), "clones/s")
+    report("snapshot", rate(MiniChessBoard.snapshot, items, args.repeat), "snapshots/s")
+    report("restore", rate(lambda b: target.restore(snapshot), items, args.repeat), "restores/s")
+
+
+# Measures move generation with the hot paths instrumented, and again after
+# instrumentation is disabled to check that it leaves no overhead behind.
+@benchmark
+def instrument(args):
+    items = sample_positions(args.positions, args.seed)
+    if Instrument.active() is not None:
+        # already instrumented by MINICHESS_PROFILE, so nothing to compare
+        report("instrumented", rate(uncached(MiniChessBoard.get_all_moves), items, args.repeat), "positions/s")
+        return
+    report("get_all_moves", rate(uncached(MiniChessBoard.get_all_moves), items, args.repeat), "positions/s")
+    with Instrument.instrumented():
+        report("instrumented", rate(uncached(MiniChessBoard.get_all_moves), items, args.repeat), "positions/s")
+    report("after disable", rate(uncached(MiniChessBoard.get_all_moves), items, args.repeat), "positions/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs engine benchmarks.")
+    parser.add_argument("name", choices=sorted(benchmarks))
+    parser.add_argument("--positions", type=int, default=2000,
+                        help="number of sampled positions to run on")
+    parser.add_argument("--batch", type=int, default=1024,
+                        help="number of games or positions per batch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    Instrument.enable_from_env()
+    benchmarks[args.name](args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,29 @@
 from MiniChessBoard import MiniChessBoard, Bitboard
 from Enums import *
+from Move import Move
+import Instrument
 import numpy as np
-import copy
 
 
+Instrument.enable_from_env()
+
 board = MiniChessBoard()
 
 board.print_board()
 
 # Plays a random game against itself.
 moves = board.get_all_moves()
-while len(moves) > 0 and not board.is_insufficient_material():
-    move = np.random.choice(moves)
+while board.outcome() is None:
+    move = Move(np.random.choice(moves))
     print(move)
     board.make_move(move)
     print(board.in_check(), board.white)
     board.print_board()
     moves = board.get_all_moves()
 
-if board.is_insufficient_material() or not board.in_check():
-    print("draw!")
+result, termination = board.outcome()
+if result == 0:
+    print("draw!", termination.name)
 else:
-    print("won!")
+    print("won!", termination.name)
 board.print_board()
@@ -0,0 +1,25 @@
+import os
+import random
+import sys
+import pytest
+
+
+# The modules live flat at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MiniChessBoard import MiniChessBoard
+
+
+# Boards from random games, a mix of openings, middlegames and endings.
+@pytest.fixture(scope="session")
+def positions():
+    rng = random.Random(0)
+    boards = []
+    while len(boards) < 300:
+        board = MiniChessBoard()
+        moves = board.get_all_moves()
+        while moves and len(boards) < 300:
+            boards.append(board.clone())
+            board.make_move(rng.choice(moves))
+            moves = board.get_all_moves()
+    return boards
@@ -0,0 +1,48 @@
+from MiniChessBoard import MiniChessBoard
+import ActionSpace
+import VecEnv
+import numpy as np
+
+
+# Every legal move has an action of the 520, and the action gives the move
+# back, capture bit included. Canonical actions are the mirrored ones for
+# black to move.
+def test_round_trip(positions):
+    assert ActionSpace.NumActions == 520
+    assert (ActionSpace.FlippedActions[ActionSpace.FlippedActions] == np.arange(520)).all()
+    for board in positions:
+        moves = board.get_all_moves()
+        actions = [ActionSpace.move_to_action(move) for move in moves]
+        assert all(0 <= action < 520 for action in actions)
+        assert len(set(actions)) == len(moves)
+        assert [ActionSpace.action_to_move(board, action) for action in actions] == list(moves)
+        mask = ActionSpace.legal_mask(board, canonical=True)
+        assert mask.sum() == len(moves)
+        assert mask[ActionSpace.moves_to_actions(moves, board.white, True)].all()
+        assert (mask == (ActionSpace.legal_mask(board) if board.white
+                         else ActionSpace.legal_mask(board)[ActionSpace.FlippedActions])).all()
+
+
+# The VecEnv masks, computed from its target bitboards, match the masks of
+# the same positions as MiniChessBoards, and so do the moves of the actions
+# sampled from them, along random games in both action spaces.
+def test_env_legal_masks(positions):
+    env = VecEnv.VecEnv(len(positions), auto_reset=False)
+    env.set_boards(positions)
+    rng = np.random.default_rng(0)
+    for ply in range(40):
+        canonical = ply % 2 == 1
+        boards = [env.get_board(i) for i in range(env.n)]
+        masks = ActionSpace.legal_masks(boards, canonical=canonical)
+        assert (ActionSpace.env_legal_masks(env, canonical=canonical) == masks).all()
+        out = np.ones_like(masks)
+        assert (ActionSpace.env_legal_masks(env, out, canonical) == masks).all() and (out == masks).all()
+
+        actions = ActionSpace.sample_actions(rng.standard_normal(masks.shape), masks, rng)
+        moves = ActionSpace.env_actions_to_moves(env, actions, canonical)
+        playing = masks.any(axis=1) & ~env.done
+        flipped = canonical & ~env.white
+        actual = np.where(flipped, ActionSpace.FlippedActions[actions], actions)
+        assert [ActionSpace.action_to_move(boards[i], int(actual[i])) for i in np.flatnonzero(playing)] \
+            == moves[playing].tolist()
+        env.step(moves)
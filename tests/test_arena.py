@@ -0,0 +1,44 @@
+import Arena
+import math
+import pytest
+
+
+# elo and expected_score are inverses, with infinite ratings at the ends.
+def test_elo_round_trip():
+    for score in (0.1, 0.25, 0.5, 0.75, 0.9):
+        assert Arena.expected_score(Arena.elo(score)) == pytest.approx(score)
+    assert Arena.elo(0.5) == 0 and Arena.elo(0) == -math.inf and Arena.elo(1) == math.inf
+
+
+# Identical pair scores must not claim a zero-width interval.
+def test_elo_interval_of_constant_scores():
+    rating, low, high = Arena.elo_interval([0.5] * 100)
+    assert rating == 0 and low < -1 and high > 1
+    rating, low, high = Arena.elo_interval([0.5] * 400)
+    assert -low < 10
+
+
+# The SPRT accepts elo1 for a clearly stronger engine, and elo0 for an even
+# match.
+def test_sprt():
+    lower, upper = Arena.sprt_bounds()
+    assert Arena.sprt_llr([1.0, 0.75] * 50, 0, 50) >= upper
+    assert Arena.sprt_llr([0.5] * 400, 0, 50) <= lower
+
+
+# An explicit depth is kept, and depth 3 is only the default.
+def test_engine_specs():
+    assert Arena.make_engine("alphabeta").depth == 3
+    assert Arena.make_engine("alphabeta:depth=64").depth == 64
+    assert Arena.make_engine("alphabeta:depth=2").depth == 2
+    with pytest.raises(ValueError):
+        Arena.make_engine("unknown")
+
+
+# A random match is reproducible from its seed.
+def test_match_is_reproducible():
+    openings = Arena.random_openings(4)
+    first = Arena.run_match("random", "random", openings, 4, max_plies=60, seed=1)
+    second = Arena.run_match("random", "random", openings, 4, max_plies=60, seed=1)
+    assert first["pairs"] == 4
+    assert [first[k] for k in ("wins", "draws", "losses")] == [second[k] for k in ("wins", "draws", "losses")]
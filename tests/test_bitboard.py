@@ -0,0 +1,44 @@
+from Bitboard import AttackBackends, MagicsPath, load_magics
+import Magic
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+
+# Every sliding attack backend must agree with the reference ray walker for
+# every occupancy of every square's rays.
+@pytest.mark.parametrize("name", sorted(AttackBackends))
+def test_backends_match_reference(name):
+    bishop_lookup, rook_lookup = AttackBackends[name]
+    for sq in range(25):
+        for bishop, lookup in [(True, bishop_lookup), (False, rook_lookup)]:
+            for blocked in Magic.subsets(Magic.slider_attacks(sq, 0, bishop)):
+                assert lookup(sq, blocked) == Magic.slider_attacks(sq, blocked, bishop), (name, sq, bishop)
+
+
+# verify_loaded checks the magic tables whichever backend is the default, so
+# a corrupt table is caught before Magic.py writes it.
+def test_verify_loaded_catches_corrupt_magics():
+    with open(MagicsPath, "rb") as f:
+        data = bytearray(f.read())
+    data[-3] ^= 1
+    try:
+        load_magics(data=bytes(data))
+        with pytest.raises(AssertionError):
+            Magic.verify_loaded()
+    finally:
+        load_magics()
+    Magic.verify_loaded()
+
+
+# Magic.py run without a magics.bin builds the tables once, for its output,
+# rather than also at the import of Bitboard.
+def test_builder_skips_import_rebuild(tmp_path):
+    root = os.path.dirname(MagicsPath)
+    for name in ("Bitboard.py", "Enums.py", "Magic.py"):
+        shutil.copy(os.path.join(root, name), str(tmp_path))
+    subprocess.run([sys.executable, "Magic.py", "--output", "out.bin", "--tries", "1", "--batch", "512"],
+                   cwd=str(tmp_path), check=True, stdout=subprocess.DEVNULL)
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".bin")) == ["out.bin"]
@@ -0,0 +1,146 @@
+from AlphaBeta import AlphaBeta
+from Bitboard import Bitboard
+from Enums import *
+from MiniChessBoard import MiniChessBoard
+from Move import *
+import MCTS
+import Rollout
+import pytest
+import random
+
+
+# A board restored from a snapshot, or cloned, must be the same position
+# with consistent derived state.
+def test_snapshot_restore_and_clone(positions):
+    target = MiniChessBoard()
+    for board in positions:
+        target.restore(board.snapshot())
+        for copy in (target, board.clone()):
+            copy.check_state()
+            assert copy.snapshot() == board.snapshot()
+            assert copy.get_fen() == board.get_fen()
+            assert sorted(copy.get_all_moves()) == sorted(board.get_all_moves())
+
+
+# Moves made on a restored board must not disturb the snapshot it came from.
+def test_restore_then_play(positions):
+    rng = random.Random(0)
+    for board in positions[::10]:
+        snapshot = board.snapshot()
+        copy = MiniChessBoard()
+        copy.restore(snapshot)
+        moves = copy.get_all_moves()
+        if not moves:
+            continue
+        copy.make_move(rng.choice(moves))
+        copy.unmake_move()
+        assert copy.snapshot() == snapshot == board.snapshot()
+
+
+# A board with a history limit keeps at least that many moves to undo, and
+# at most about twice as many since it trims in batches, and stays
+# consistent over a long game.
+def test_history_limit():
+    rng = random.Random(0)
+    board = MiniChessBoard(history_limit=8)
+    reference = MiniChessBoard()
+    for ply in range(200):
+        moves = board.get_all_moves()
+        if not moves:
+            break
+        move = rng.choice(moves)
+        board.make_move(move)
+        reference.make_move(move)
+    assert len(board.moves) <= 2 * 8 + 1
+    assert board.snapshot() == reference.snapshot()
+    for ply in range(min(8, board.move_count)):
+        board.unmake_move()
+        reference.unmake_move()
+        assert board.snapshot() == reference.snapshot()
+    board.check_state()
+
+
+# Returns the squares holding a piece that attacks sq, found by walking
+# every piece's attacks from its own square.
+def attackers_by_piece(board, sq):
+    found = 0
+    for from_sq in range(25):
+        color, piece = board.mailbox[from_sq]
+        if piece == Piece.NONE:
+            continue
+        if piece == Piece.Pawn:
+            attacks = Bitboard.pawn_attacks[color][from_sq]
+        elif piece == Piece.Knight:
+            attacks = Bitboard.knight_attacks[from_sq]
+        elif piece == Piece.King:
+            attacks = Bitboard.king_attacks[from_sq]
+        else:
+            attacks = 0
+            if piece in (Piece.Bishop, Piece.Queen):
+                attacks |= Bitboard.get_bishop_attacks(from_sq, board.occupied)
+            if piece in (Piece.Rook, Piece.Queen):
+                attacks |= Bitboard.get_rook_attacks(from_sq, board.occupied)
+        if attacks >> sq & 1:
+            found |= 1 << from_sq
+    return found
+
+
+# attackers_to, attacked and the cached attack maps must agree with each
+# piece's own attacks.
+def test_attack_queries(positions):
+    for board in positions[::3]:
+        for sq in range(25):
+            expected = attackers_by_piece(board, sq)
+            assert board.attackers_to(sq) == expected, (board.get_fen(), sq)
+            for color in (Color.White, Color.Black):
+                assert board.attacked(color, sq) == bool(expected & board.occupancy[color])
+        for color in (Color.White, Color.Black):
+            # the map looks through the other king
+            enemy_king = board.board[6 * (color ^ 1) + Piece.King]
+            occupied = board.occupied ^ enemy_king
+            expected = sum(1 << sq for sq in range(25) if board.attacked(color, sq, occupied))
+            assert board.attack_map(color) == expected, board.get_fen()
+
+
+@pytest.mark.parametrize("fen, start, end, value", [
+    ("k4/5/2p2/5/2R1K w", 2, 12, 100),      # undefended pawn
+    ("k4/1p3/2p2/5/2R1K w", 2, 12, -400),   # pawn defended by a pawn
+    ("k4/1p3/2p2/2R2/2R1K w", 7, 12, -300), # the second rook recaptures
+    ("k4/2r2/2n2/1P3/4K w", 6, 12, 200),    # pawn takes a knight defended by a rook
+])
+def test_see(fen, start, end, value):
+    board = MiniChessBoard(fen)
+    move = next(m for m in board.get_all_moves() if m & StartMask == start and m >> EndShift & StartMask == end)
+    assert board.see(move) == value
+
+
+# Unmaking a move dropped by the history limit raises instead of silently
+# leaving the board and its move count out of step.
+def test_unmake_past_trimmed_history():
+    board = MiniChessBoard(history_limit=2)
+    for ply in range(6):
+        board.make_move(board.get_all_moves()[0])
+    with pytest.raises(IndexError):
+        while True:
+            board.unmake_move()
+    board.check_state()
+    MiniChessBoard().unmake_move()
+
+
+# Rollouts, MCTS searches and alpha-beta searches, complete or aborted,
+# that go deeper than the history limit unwind back to the root of a
+# bounded board.
+def test_bounded_history_unwinds():
+    board = MiniChessBoard(history_limit=4)
+    board.make_move(board.get_all_moves()[0])
+    snapshot = board.snapshot()
+    for seed in range(50):
+        Rollout.rollout(board, random.Random(seed), max_plies=50)
+    MCTS.MCTS(MCTS.UniformEvaluator(), 1 << 12, 8).search(board, 200)
+    AlphaBeta(hash_mb=1).search(board, max_depth=6)
+    for nodes in (500, 1234, 5000):
+        AlphaBeta(hash_mb=1).search(board, node_limit=nodes)
+    assert board.snapshot() == snapshot
+    assert board.move_count == 1 and board.history_cap == 2 * 4 + 1
+    board.unmake_move()
+    assert board.get_fen() == MiniChessBoard().get_fen()
@@ -0,0 +1,61 @@
+from Encoder import num_planes
+from InferenceBroker import InferenceBroker, NumpyModel
+import ActionSpace
+import numpy as np
+import pytest
+
+
+# Returns n empty positions as (planes, masks).
+def batch(n):
+    return (np.zeros((n, num_planes(), 5, 5), dtype=np.float32),
+            np.ones((n, ActionSpace.NumActions), dtype=bool))
+
+
+# Results through the broker match calling the model directly.
+def test_results_match_model():
+    model = NumpyModel()
+    broker = InferenceBroker(model, max_batch_size=4)
+    broker.start()
+    try:
+        planes, masks = batch(10)
+        planes[:] = np.random.default_rng(0).random(planes.shape)
+        logits, values = broker.evaluator()(planes, masks)
+        expected_logits, expected_values = model(planes, masks)
+        assert np.allclose(logits, expected_logits, atol=1e-5) and np.allclose(values, expected_values, atol=1e-5)
+    finally:
+        broker.stop()
+
+
+# A model error fails the callers of that batch, and the broker keeps
+# serving later batches.
+def test_model_errors_reach_callers():
+    model = NumpyModel()
+    calls = []
+
+    def flaky(planes, masks):
+        calls.append(len(planes))
+        if len(calls) == 1:
+            raise ValueError("model failed")
+        return model(planes, masks)
+
+    broker = InferenceBroker(flaky, max_batch_size=4)
+    broker.start()
+    try:
+        with pytest.raises(ValueError):
+            broker.evaluator()(*batch(4))
+        assert broker.evaluator()(*batch(4))[0].shape == (4, ActionSpace.NumActions)
+    finally:
+        broker.stop()
+
+
+# Statistics are kept for a bounded window however long the broker runs.
+def test_stats_window():
+    broker = InferenceBroker(NumpyModel(), max_batch_size=2, stats_window=8)
+    broker.start()
+    try:
+        for i in range(20):
+            broker.evaluator()(*batch(2))
+    finally:
+        broker.stop()
+    assert len(broker.latencies) == 8 and len(broker.depths) == 8
+    assert broker.stats()["positions"] == 40
@@ -0,0 +1,62 @@
+from Enums import *
+from MiniChessBoard import MiniChessBoard
+import Encoder
+import VecEnv
+import numpy as np
+import random
+
+
+# Returns the board with the colors swapped and the ranks mirrored, so the
+# other side is to move in the same game.
+def flipped_board(board):
+    ranks, side = board.get_fen().split()
+    return MiniChessBoard("/".join(reversed(ranks.swapcase().split("/"))) + " " + ("b" if side == "w" else "w"))
+
+
+# Each piece plane holds its pieces at row rank - 1 and column file, as the
+# mailbox places them, and the last plane tells the side to move.
+def test_planes_match_board(positions):
+    planes = Encoder.encode(positions)
+    assert planes.shape == (len(positions), Encoder.num_planes(), 5, 5)
+    for board, plane in zip(positions, planes):
+        expected = np.zeros((12, 5, 5))
+        for sq, (color, piece) in enumerate(board.mailbox):
+            if color != Color.NONE:
+                expected[6 * color + piece, sq // 5, sq % 5] = 1
+        assert (plane[:12] == expected).all()
+        assert (plane[12] == board.white).all()
+
+
+# The canonical encoding is the encoding of the position as the side to move
+# sees it, that is of the color-flipped board when black is to move, and
+# flipped_view shows the planes of the color-flipped board.
+def test_canonical_is_flipped(positions):
+    canonical = Encoder.encode(positions, canonical=True)
+    seen = Encoder.encode([board if board.white else flipped_board(board) for board in positions])
+    assert (canonical == seen).all()
+    flipped = Encoder.encode([flipped_board(board) for board in positions])
+    assert (Encoder.flipped_view(Encoder.encode(positions)) == flipped[:, :12].reshape(-1, 1, 2, 6, 5, 5)).all()
+
+
+# History planes hold the previous positions, seen by the side to move at
+# the current one, then zeros before the start of the game. The board is
+# left as it was. VecEnv positions encode the same as the boards they hold.
+def test_history_and_env():
+    rng = random.Random(1)
+    board = MiniChessBoard()
+    boards = []
+    for ply in range(5):
+        boards.append(board.clone())
+        board.make_move(rng.choice(board.get_all_moves()))
+    fen = board.get_fen()
+    planes = Encoder.encode([board], history=8, canonical=True)[0]
+    assert board.get_fen() == fen and board.move_count == 5 and not board.white
+    for i, previous in enumerate(reversed(boards)):
+        assert (planes[12 * (i + 1):12 * (i + 2)] == Encoder.encode([flipped_board(previous)])[0, :12]).all()
+    assert not planes[12 * 6:12 * 9].any()
+
+    boards.append(board)
+    env = VecEnv.VecEnv(len(boards), auto_reset=False)
+    env.set_boards(boards)
+    for canonical in (False, True):
+        assert (Encoder.encode_env(env, canonical=canonical) == Encoder.encode(boards, canonical=canonical)).all()
@@ -0,0 +1,50 @@
+from GameRecords import GameReader, GameWriter
+from MiniChessBoard import MiniChessBoard
+import os
+import pytest
+import random
+
+
+# Returns count random games of up to 60 plies as (moves, result) pairs,
+# with unfinished games scored as draws.
+def random_games(count, seed):
+    rng = random.Random(seed)
+    games = []
+    for i in range(count):
+        board = MiniChessBoard()
+        moves = []
+        plies = rng.randrange(60)
+        while len(moves) < plies and board.outcome() is None:
+            moves.append(rng.choice(board.get_all_moves()))
+            board.make_move(moves[-1])
+        outcome = board.outcome()
+        games.append((moves, outcome[0] if outcome else 0))
+    return games
+
+
+# Games come back unchanged across block and chunk boundaries, by iteration
+# and by index, and a second writer appends new chunks after the first.
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip(tmp_path, compress):
+    directory = str(tmp_path / "games")
+    games = random_games(30, 0)
+    with GameWriter(directory, games_per_chunk=7, block_size=3, compress=compress) as writer:
+        for moves, result in games[:20]:
+            writer.write(moves, result)
+    assert len(os.listdir(directory)) == 3
+    with GameWriter(directory, games_per_chunk=7, block_size=3, compress=compress) as writer:
+        for moves, result in games[20:]:
+            writer.write(moves, result)
+    assert len(os.listdir(directory)) == 5
+
+    reader = GameReader(directory)
+    assert len(reader) == len(games)
+    assert [(list(moves), result) for moves, result in reader] == games
+    for i in range(len(games)):
+        moves, result = reader.game(i)
+        assert (list(moves), result) == games[i]
+    with pytest.raises(IndexError):
+        reader.game(len(games))
+
+    plies = [(move, result) for moves, result in games for move in moves]
+    assert [(move, result) for board, move, result in reader.positions()] == plies
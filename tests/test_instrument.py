@@ -0,0 +1,71 @@
+from Bitboard import Bitboard
+from MiniChessBoard import MiniChessBoard
+import Instrument
+import Perft
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Returns the functions instrumentation patches, as found on their classes.
+def patched_functions():
+    return ([MiniChessBoard.__dict__[name] for name in Instrument.BoardFunctions + ("gen_staged_moves",)]
+            + [Bitboard.__dict__[name] for name in Instrument.AttackFunctions])
+
+
+# Disabling puts back the very same function objects, and nesting is refused.
+def test_enable_and_disable_restore_originals():
+    before = patched_functions()
+    with Instrument.instrumented() as profile:
+        assert Instrument.active() is profile
+        assert patched_functions() != before
+        with pytest.raises(RuntimeError):
+            Instrument.enable()
+    assert Instrument.active() is None
+    assert all(a is b for a, b in zip(patched_functions(), before))
+
+
+# Instrumented runs count the same nodes, and the counters add up.
+def test_profile_counts():
+    name, fen, counts = Perft.Positions[0]
+    with Instrument.instrumented() as profile:
+        assert Perft.perft(MiniChessBoard(fen), 3) == counts[2]
+        list(MiniChessBoard(fen).gen_staged_moves())
+    data = profile.to_json()
+    assert data["functions"]["get_all_moves"]["calls"] == 1 + counts[0] + counts[1]
+    assert data["legal_moves"] == sum(counts[:3])
+    assert data["functions"]["make_move"]["calls"] == counts[0] + counts[1]
+    assert sum(data["stages"]["moves"].values()) == counts[0]
+    assert data["stages"]["stops"]["exhausted"] == 1
+    for kind in ("bishop", "rook"):
+        magic = data["magic"][kind]
+        assert sum(magic["hits"]) == magic["lookups"] == data["functions"]["get_" + kind + "_attacks"]["calls"]
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in profile.collapsed())
+
+
+# MINICHESS_PROFILE enables a profile from an entry point and writes it at
+# exit, and importing the module with it set does not fail.
+def test_environment_variable(tmp_path):
+    path = str(tmp_path / "profile.json")
+    env = dict(os.environ, MINICHESS_PROFILE=path)
+    subprocess.run([sys.executable, "-c", "import Instrument"], cwd=Root, env=env, check=True)
+    assert not os.path.exists(path)
+    subprocess.run([sys.executable, "Perft.py", "3"], cwd=Root, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(path) as f:
+        assert json.load(f)["functions"]["get_all_moves"]["calls"] > 0
+    # the profiling CLI reuses the profile enabled from the environment
+    subprocess.run([sys.executable, "Instrument.py", "perft", "2"], cwd=Root, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(path) as f:
+        assert json.load(f)["functions"]["get_all_moves"]["calls"] == 8
+    # and so does the alpha-beta search CLI
+    os.remove(path)
+    subprocess.run([sys.executable, "AlphaBeta.py", "--depth", "3"], cwd=Root, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(path) as f:
+        assert json.load(f)["functions"]["gen_staged_moves"]["calls"] > 0
@@ -0,0 +1,46 @@
+from MiniChessBoard import MiniChessBoard, StartFen
+import MCTS
+import pytest
+
+
+# Finds a mate in one for either color: every mating move is a terminal
+# win, so the search soon piles its visits on one of them.
+@pytest.mark.parametrize("fen", ["k4/4Q/1K3/5/5 w", "5/5/1k3/4q/K4 b"])
+def test_mate_in_one(fen):
+    board = MiniChessBoard(fen)
+    tree = MCTS.MCTS(MCTS.UniformEvaluator(), 1 << 14)
+    tree.search(board, 400)
+    assert board.get_fen() == MiniChessBoard(fen).get_fen()
+
+    board.make_move(tree.select_move())
+    assert board.outcome()[0] == (1 if fen.endswith("w") else -1)
+    assert tree.root_value() > 0.9
+
+
+# Advancing to a searched child keeps its subtree: the new root has the
+# visits the child had, and its children the visits they had.
+def test_advance_keeps_subtree():
+    board = MiniChessBoard(StartFen)
+    tree = MCTS.MCTS(MCTS.RandomEvaluator(), 1 << 14)
+    tree.search(board, 600)
+    move = tree.select_move()
+    moves, visits = tree.root_visits()
+    child = tree.first_child[0] + int(list(moves).index(move))
+    first, count = tree.first_child[child], tree.num_children[child]
+    child_visits = int(tree.visits[child])
+    grandchildren = dict(zip(tree.move[first:first + count].tolist(),
+                             tree.visits[first:first + count].tolist()))
+    size = tree.size
+
+    board.make_move(move)
+    tree.advance(board)
+    assert tree.root_key == board.key and not tree.root_white
+    assert tree.visits[0] == child_visits
+    moves, visits = tree.root_visits()
+    assert dict(zip(moves.tolist(), visits.tolist())) == grandchildren
+    assert child_visits > 1 and tree.size < size
+
+    # searching on from the kept tree adds to its visits
+    tree.search(board, 100)
+    assert tree.visits[0] >= child_visits + 100
+    assert sorted(tree.root_visits()[0].tolist()) == sorted(board.get_all_moves())
@@ -0,0 +1,35 @@
+from Enums import Flags
+from Move import FlagsShift
+import random
+
+
+# The staged generator must yield exactly the legal moves, once each.
+def test_staged_matches_full_lists(positions):
+    for board in positions:
+        staged = list(board.gen_staged_moves())
+        assert len(staged) == len(set(staged))
+        assert sorted(staged) == sorted(board.get_all_moves()), board.get_fen()
+
+
+# A legal hash move comes first and is not repeated, and a hash move from
+# another position is skipped.
+def test_staged_hash_move(positions):
+    rng = random.Random(0)
+    for board, other in zip(positions, positions[1:]):
+        moves = board.get_all_moves()
+        if not moves:
+            continue
+        hash_move = rng.choice(moves)
+        staged = list(board.gen_staged_moves(hash_move))
+        assert staged[0] == hash_move and sorted(staged) == sorted(moves)
+        for foreign in other.get_all_moves():
+            if foreign not in moves:
+                assert sorted(board.gen_staged_moves(foreign)) == sorted(moves), board.get_fen()
+                break
+
+
+# Without quiets, exactly the captures and promotions are generated.
+def test_staged_tactical_only(positions):
+    for board in positions:
+        tactical = list(board.gen_staged_moves(quiets=False))
+        assert sorted(tactical) == sorted(m for m in board.get_all_moves() if m >> FlagsShift & (Flags.Capture | 8)), board.get_fen()
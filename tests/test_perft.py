@@ -0,0 +1,30 @@
+from MiniChessBoard import MiniChessBoard
+from TranspositionTable import TranspositionTable
+import Perft
+import pytest
+
+
+# Depth the reference suite is checked to, deep enough to reach promotions,
+# pins and checks in every position while staying fast.
+SuiteDepth = 4
+
+
+@pytest.mark.parametrize("name, fen, counts", Perft.Positions, ids=[p[0] for p in Perft.Positions])
+def test_reference_counts(name, fen, counts):
+    board = MiniChessBoard(fen)
+    for depth in range(1, min(SuiteDepth, len(counts)) + 1):
+        assert Perft.perft(board, depth) == counts[depth - 1], "depth {}".format(depth)
+    assert board.get_fen() == MiniChessBoard(fen).get_fen()
+
+
+# The cached count must match the uncached one, and divide must add up.
+@pytest.mark.parametrize("name, fen, counts", Perft.Positions[:3], ids=[p[0] for p in Perft.Positions[:3]])
+def test_cache_and_divide(name, fen, counts):
+    assert Perft.perft(MiniChessBoard(fen), 4, TranspositionTable(1)) == counts[3]
+    assert sum(nodes for move, nodes in Perft.divide(MiniChessBoard(fen), 3)) == counts[2]
+
+
+# Debug boards check their incremental state after every make and unmake.
+def test_debug_state():
+    for name, fen, counts in Perft.Positions:
+        assert Perft.perft(MiniChessBoard(fen, debug=True), 3) == counts[2], name
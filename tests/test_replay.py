@@ -0,0 +1,69 @@
+from MiniChessBoard import MiniChessBoard
+from ReplayBuffer import ReplayBuffer, flip_colors
+import ActionSpace
+import numpy as np
+import pytest
+
+
+# Returns the board encoded by the actual (non-canonical) planes of one
+# position.
+def board_from_planes(planes):
+    board = MiniChessBoard()
+    board.board = [sum(1 << int(sq) for sq in np.flatnonzero(plane.ravel() > 0.5)) for plane in planes[:12]]
+    board.white = bool(planes[12, 0, 0])
+    board.init_derived_state()
+    return board
+
+
+@pytest.fixture
+def samples(positions):
+    boards = [board for board in positions if board.get_all_moves()]
+    bitboards = np.array([board.board for board in boards], dtype=np.uint32)
+    white = np.array([board.white for board in boards])
+    return boards, bitboards, white
+
+
+# A flipped position is the same game seen by the other color: its legal
+# moves are the original ones mirrored, and flipping twice is the identity.
+def test_flip_colors(samples):
+    boards, bitboards, white = samples
+    flipped, flipped_white = flip_colors(bitboards, white)
+    again, again_white = flip_colors(flipped, flipped_white)
+    assert (again == bitboards).all() and (again_white == white).all()
+
+    mirrored = [MiniChessBoard() for board in boards]
+    for board, bb, w in zip(mirrored, flipped, flipped_white):
+        board.board = [int(b) for b in bb]
+        board.white = bool(w)
+        board.init_derived_state()
+    masks = ActionSpace.legal_masks(boards)
+    assert (ActionSpace.legal_masks(mirrored) == masks[:, ActionSpace.FlippedActions]).all()
+
+
+# Augmented samples in actual mode must keep each policy on the legal moves
+# of the position their planes show, whether or not it was flipped.
+def test_augmented_samples(samples, tmp_path):
+    boards, bitboards, white = samples
+    masks = ActionSpace.legal_masks(boards, canonical=True)
+    policies = masks / masks.sum(axis=1, keepdims=True)
+    buffer = ReplayBuffer(str(tmp_path / "replay.bin"), 1024)
+    buffer.add(bitboards, white, policies, np.zeros(len(boards)))
+
+    rng = np.random.default_rng(0)
+    planes, sampled, values = buffer.sample(200, rng, canonical=False, augment=True)
+    for plane, policy in zip(planes, sampled):
+        board = board_from_planes(plane)
+        assert ((policy > 0) == ActionSpace.legal_mask(board)).all(), board.get_fen()
+
+
+# The buffer is reopened from its file with the same contents.
+def test_reopen(samples, tmp_path):
+    boards, bitboards, white = samples
+    path = str(tmp_path / "replay.bin")
+    buffer = ReplayBuffer(path, 64)
+    buffer.add(bitboards[:100], white[:100], np.zeros((100, ActionSpace.NumActions)), np.arange(100))
+    buffer.flush()
+    del buffer
+    reopened = ReplayBuffer(path)
+    assert len(reopened) == 64 and reopened.capacity == 64
+    assert sorted(reopened.values.tolist()) == list(range(36, 100))
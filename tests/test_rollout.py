@@ -0,0 +1,29 @@
+from MiniChessBoard import MiniChessBoard
+import Rollout
+import pytest
+
+
+# Returns a board a few plies into a game, with a history limit if given.
+def played_board(history_limit=None):
+    board = MiniChessBoard(history_limit=history_limit)
+    for ply in range(5):
+        board.make_move(board.get_all_moves()[ply % 3])
+    return board
+
+
+# Seeded rollouts give the same games for any number of processes, and
+# leave the board they start from unchanged, bounded history or not.
+@pytest.mark.parametrize("history_limit", [None, 2])
+def test_rollouts(history_limit):
+    board = played_board(history_limit)
+    snapshot, fen, moves = board.snapshot(), board.get_fen(), list(board.moves)
+
+    results, plies = Rollout.rollouts(board, 300, seed=7, max_plies=80, processes=1)
+    assert board.snapshot() == snapshot and board.get_fen() == fen and board.moves == moves
+    again = Rollout.rollouts(board, 300, seed=7, max_plies=80, processes=2)
+    assert (again[0] == results).all() and (again[1] == plies).all()
+    assert board.snapshot() == snapshot and board.get_fen() == fen and board.moves == moves
+
+    assert set(results.tolist()) <= {-1, 0, 1}
+    assert plies.max() <= 80 and plies.max() > 2 * 2 + 1
+    assert (Rollout.rollouts(board, 300, seed=8, max_plies=80)[1] != plies).any()
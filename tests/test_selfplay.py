@@ -0,0 +1,31 @@
+from MiniChessBoard import MiniChessBoard
+from SelfPlay import SelfPlay, play_game
+import numpy as np
+
+
+# With fewer slots than games the workers wait on the driver, and every
+# game still arrives exactly once, legal, scored by board.outcome() and with
+# the positions it went through.
+def test_games_arrive_once():
+    with SelfPlay(games=8, workers=2, capacity=2, max_plies=60, positions=True, seed=3) as selfplay:
+        games = list(selfplay)
+        played = np.frombuffer(selfplay.sync.stats, dtype=np.float64).reshape(-1, 4)[:, 0]
+    assert len(games) == 8 and played.sum() == 8
+
+    # each worker plays its own seeded sequence of games
+    expected = []
+    for worker, count in enumerate(played):
+        rng = np.random.default_rng([3, worker])
+        expected += [play_game(rng, max_plies=60)[:2] for i in range(int(count))]
+    assert (sorted((moves.tolist(), result) for moves, result, bitboards in games)
+            == sorted((moves.tolist(), result) for moves, result in expected))
+
+    for moves, result, bitboards in games:
+        board = MiniChessBoard()
+        for move, position in zip(moves.tolist(), bitboards):
+            assert position.tolist() == board.board
+            assert move in board.get_all_moves()
+            board.make_move(move)
+        outcome = board.outcome()
+        assert result == (outcome[0] if outcome else 0)
+        assert outcome is not None or len(moves) == 60
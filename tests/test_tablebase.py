@@ -0,0 +1,30 @@
+from Enums import Termination
+from MiniChessBoard import MiniChessBoard
+import Tablebase
+import pytest
+
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    Tablebase.build("KRvK", directory)
+    return Tablebase.Tablebases(directory)
+
+
+# Sampled positions must agree with a one-ply search over the tables and
+# with the move generator's mates and stalemates.
+@pytest.mark.parametrize("name", ["KvK", "KRvK"])
+def test_verify(tables, name):
+    assert Tablebase.verify(name, tables, 300) == 300
+
+
+# Playing the table's best moves for both sides must mate in exactly the
+# distance the table gives.
+def test_best_moves_mate_in_dtm(tables):
+    board = MiniChessBoard("k4/5/5/5/1R2K w")
+    wdl, dtm = tables.probe(board)
+    assert wdl == 1
+    for ply in range(dtm):
+        assert board.outcome() is None
+        board.make_move(tables.best_move(board))
+    assert board.outcome() == (1, Termination.Checkmate)
@@ -0,0 +1,62 @@
+from Enums import Termination
+from MiniChessBoard import MiniChessBoard, HalfmoveLimit
+from Move import encode_move
+import VecEnv
+import numpy as np
+
+
+# Random games in a VecEnv and in MiniChessBoards must agree on legal moves,
+# check, boards and termination at every ply.
+def test_matches_scalar_boards():
+    assert VecEnv.compare_with_scalar(64, seed=0) > 0
+
+
+# Random moves in a VecEnv must always be legal in the scalar board.
+def test_random_actions_are_legal():
+    env = VecEnv.VecEnv(32)
+    rng = np.random.default_rng(0)
+    for step in range(50):
+        actions = env.random_actions(rng)
+        for i in range(env.n):
+            assert actions[i] in env.get_board(i).get_all_moves()
+        env.step(actions)
+
+
+# Endgames with blocked pawns, where random play often ends by repetition
+# or the move rule rather than by material.
+BlockedFens = ["k4/p4/P4/5/4K w", "4k/p1p2/P1P2/5/K4 b", "k4/pp3/PP3/5/3NK w", "kn3/p4/P4/5/3NK w"]
+
+
+# VecEnv must end and score games by the same rules as outcome(), including
+# repetitions and the halfmove limit.
+def test_matches_scalar_outcomes():
+    assert VecEnv.compare_with_scalar(64, max_plies=400, seed=1, fens=BlockedFens) > 0
+
+
+# Kings stepping out and back twice repeat the position a third time on the
+# eighth ply, which ends the game in both implementations.
+def test_repetition():
+    board = MiniChessBoard("k4/p4/P4/5/4K w")
+    env = VecEnv.VecEnv(1, auto_reset=False)
+    env.set_boards([board])
+    shuffle = [encode_move(4, 3, 0), encode_move(20, 21, 0), encode_move(3, 4, 0), encode_move(21, 20, 0)]
+    for ply, move in enumerate(2 * shuffle):
+        assert board.outcome() is None and not env.done[0]
+        board.make_move(move)
+        results, done = env.step([move])
+    assert board.outcome() == (0, Termination.Repetition)
+    assert done[0] and results[0] == 0
+
+
+# Games end once HalfmoveLimit plies pass without a capture or pawn move,
+# and set_boards carries the counter over.
+def test_halfmove_limit():
+    board = MiniChessBoard("k4/p4/P4/5/4K w")
+    board.halfmoves = HalfmoveLimit - 1
+    env = VecEnv.VecEnv(1, auto_reset=False)
+    env.set_boards([board])
+    move = encode_move(4, 3, 0)
+    board.make_move(move)
+    results, done = env.step([move])
+    assert board.outcome() == (0, Termination.MoveRule)
+    assert done[0] and results[0] == 0